@@ -1,48 +1,34 @@
 """
 Convert ledger.db from legacy to bin format.
 
-Test temp util
+The height range is split in chunks, converted by a process pool with Transaction.from_legacy / to_bin_tuple,
+and written in order with a bulk LedgerWriter. Every written chunk is read back and verified - row count and
+checksum - then checkpointed, in the convert_checkpoint table of the bin ledger, along with its balances and txids:
+an interrupted conversion resumes with the heights no checkpoint covers, and a conversion run again on a grown source
+converts the new heights, new mirror blocks included.
+
+Run as python3 convert_db.py legacy_ledger.db bin_ledger.db [--chunk-size heights] [--workers count]
+
+Every run writes its rows by increasing height: mirror blocks - negative heights - come first.
 """
 
+import argparse
+import os
 import sqlite3
 import sys
-from os import remove
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from time import time
+from typing import Iterable, Iterator, List, Tuple
 
 sys.path.append('../')
+from bismuthcore import balances
+from bismuthcore.ledgerschema import SQL_CREATE
+from bismuthcore.ledgerwriter import LedgerWriter
+from bismuthcore.publickeys import PublicKeyStore
 from bismuthcore.transaction import Transaction
-
-SQL_CREATE = ('''
-              CREATE TABLE "misc" (
-                  `block_height`	INTEGER,
-                  `difficulty`	TEXT
-              )''',
-              '''CREATE TABLE "transactions" (
-                  `block_height`	INTEGER,
-                  `timestamp`	NUMERIC,
-                  `address`	TEXT,
-                  `recipient`	TEXT,
-                  `amount`	INTEGER,
-                  `signature`	BLOB,
-                  `public_key`	BLOB,
-                  `block_hash`	BLOB(28),
-                  `fee`	INTEGER,
-                  `reward`	INTEGER,
-                  `operation`	TEXT,
-                  `openfield`	TEXT
-              )''',
-              'CREATE INDEX `Timestamp Index` ON `transactions` (`timestamp`)',
-              'CREATE INDEX `Signature Index` ON `transactions` (`signature`)',
-              'CREATE INDEX `Reward Index` ON `transactions` (`reward`)',
-              'CREATE INDEX `Recipient Index` ON `transactions` (`recipient`)',
-              'CREATE INDEX `Openfield Index` ON `transactions` (`openfield`)',
-              'CREATE INDEX `Fee Index` ON `transactions` (`fee`)',
-              'CREATE INDEX `Block Height Index` ON `transactions` (`block_height`)',
-              'CREATE INDEX `Block Hash Index` ON `transactions` (`block_hash`)',
-              'CREATE INDEX `Amount Index` ON `transactions` (`amount`)',
-              'CREATE INDEX `Address Index` ON `transactions` (`address`)',
-              'CREATE INDEX `Operation Index` ON `transactions` (`operation`)',
-)
-
+from bismuthcore.txidindex import TxidIndex, txid
 
 SQL_CREATE_LEGACY = ('''
                      CREATE TABLE "misc" (
@@ -76,6 +62,17 @@ SQL_CREATE_LEGACY = ('''
                      'CREATE INDEX `Operation Index` ON `transactions` (`operation`)',
                      )
 
+SQL_CREATE_CHECKPOINT = ('CREATE TABLE IF NOT EXISTS convert_checkpoint '
+                         '(start INTEGER PRIMARY KEY, end INTEGER, rows INTEGER, checksum BLOB)')
+
+SQL_CHUNK = ("SELECT * FROM transactions WHERE block_height >= ? AND block_height < ? "
+             "ORDER BY block_height, rowid")
+
+SQL_DELETE_RANGE = "DELETE FROM transactions WHERE block_height >= ? AND block_height < ?"
+
+# (start, end) height range, end excluded
+Chunk = Tuple[int, int]
+
 
 def create(db, sql: tuple):
     for line in sql:
@@ -83,33 +80,150 @@ def create(db, sql: tuple):
     db.commit()
 
 
-if __name__ == "__main__":
+def chunks(low: int, high: int, size: int) -> List[Chunk]:
+    """Splits the low..high heights, both included, in ranges of size heights"""
+    return [(start, min(start + size, high + 1)) for start in range(low, high + 1, size)]
 
+
+def rows_checksum(rows: Iterable[tuple]) -> bytes:
+    """Checksum of bin tuples, in order"""
+    check = sha256()
+    for row in rows:
+        check.update(repr(row).encode('utf-8'))
+    return check.digest()
+
+
+def convert_chunk(legacy_path: str, chunk: Chunk) -> Tuple[List[tuple], bytes]:
+    """Bin tuples of the legacy transactions of the chunk, and their checksum. Runs in the pool workers.
+    The tuples are written as is, no Transaction is built again to insert them."""
+    ledger = sqlite3.connect(f'file:{legacy_path}?mode=ro', uri=True, timeout=1)
+    ledger.text_factory = str
     try:
-        remove('ledger_new.db')
-    except:
-        pass
-    try:
-        remove('ledger_legacy.db')
-    except:
-        pass
-    test_new = sqlite3.connect('ledger_new.db', timeout=1)
-    create(test_new, SQL_CREATE)
-    test_legacy = sqlite3.connect('ledger_legacy.db', timeout=1)
-    create(test_legacy, SQL_CREATE_LEGACY)
-
-    with sqlite3.connect('../../../Bismuth-temp/static/ledger.db', timeout=1) as ledger:
-        ledger.text_factory = str
-        res = ledger.execute("select * from transactions where block_height > 700000 limit 100000")
-        for row in res:
-            tx = Transaction.from_legacy(row)
-            test_legacy.execute("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", row)
-            tx.public_key = b''
-            test_new.execute("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", tx.to_bin_tuple())
-    test_new.commit()
-    test_new.close()
-    test_legacy.commit()
-    test_legacy.close()
+        rows = [Transaction.from_legacy(list(row)).to_bin_tuple() for row in ledger.execute(SQL_CHUNK, chunk)]
+    finally:
+        ledger.close()
+    return rows, rows_checksum(rows)
+
+
+def converted_chunks(legacy_path: str, todo: List[Chunk], workers: int) -> Iterator[Tuple[Chunk, List[tuple], bytes]]:
+    """Converts the chunks, in a process pool if workers > 1. Yields them in order, at most 2 * workers in flight."""
+    if workers <= 1:
+        for chunk in todo:
+            yield (chunk, *convert_chunk(legacy_path, chunk))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for chunk in todo:
+                pending.append((chunk, executor.submit(convert_chunk, legacy_path, chunk)))
+                if len(pending) >= 2 * workers:
+                    chunk, future = pending.popleft()
+                    yield (chunk, *future.result())
+            while pending:
+                chunk, future = pending.popleft()
+                yield (chunk, *future.result())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def gaps(low: int, high: int, done: List[Chunk]) -> List[Chunk]:
+    """The ranges of the low..high heights, both included, no done range covers. done is sorted by start."""
+    missing = []
+    start = low
+    for done_start, done_end in done:
+        if done_start > start:
+            missing.append((start, done_start))
+        start = max(start, done_end)
+    if start <= high:
+        missing.append((start, high + 1))
+    return missing
+
+
+def resume(db, low: int, high: int, size: int) -> List[Chunk]:
+    """Chunks still to be converted: the heights of low..high no checkpoint covers, in ranges of size heights.
+    A source ledger that grew since - new blocks above, new mirror blocks below - is converted further.
+    Drops the rows of a chunk interrupted before its checkpoint.
+    Raises ValueError if the checkpoints cover heights the source does not have."""
+    done = [tuple(row) for row in db.execute("SELECT start, end FROM convert_checkpoint ORDER BY start")]
+    if done and (done[0][0] < low or max(end for _, end in done) > high + 1):
+        raise ValueError("Checkpoints do not match the source ledger heights: a new conversion is needed")
+    todo = []
+    for start, end in gaps(low, high, done):
+        db.execute(SQL_DELETE_RANGE, (start, end))
+        todo.extend(chunks(start, end - 1, size))
+    db.commit()
+    return todo
+
+
+def verify_chunk(db, public_keys: PublicKeyStore, first_rowid: int, chunk: Chunk, count: int,
+                 checksum: bytes) -> None:
+    """Reads the committed chunk back - the rowids after first_rowid - and compares with what was converted.
+    Raises ValueError."""
+    rows = [Transaction.from_v2(list(row), public_keys=public_keys).to_bin_tuple()
+            for row in db.execute("SELECT * FROM transactions WHERE rowid > ? ORDER BY rowid", (first_rowid, ))]
+    if len(rows) != count:
+        raise ValueError(f"Chunk {chunk}: {len(rows)} rows written, {count} converted")
+    if rows_checksum(rows) != checksum:
+        raise ValueError(f"Chunk {chunk}: checksum mismatch")
+
+
+def convert(legacy_path: str, bin_path: str, chunk_size: int=10000, workers: int=0, verify: bool=True) -> int:
+    """Converts, or resumes converting, the legacy ledger. Returns the number of transactions converted."""
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    ledger = sqlite3.connect(f'file:{legacy_path}?mode=ro', uri=True, timeout=1)
+    low, high = ledger.execute("SELECT MIN(block_height), MAX(block_height) FROM transactions").fetchone()
+    misc = ledger.execute("SELECT * FROM misc").fetchall()
+    ledger.close()
+    new = not os.path.exists(bin_path)
+    db = sqlite3.connect(bin_path, timeout=1)
+    if new:
+        create(db, SQL_CREATE)
+    create(db, (SQL_CREATE_CHECKPOINT, ))
+    todo = resume(db, low, high, chunk_size) if low is not None else []
+    public_keys = PublicKeyStore(db)
+    txid_index = TxidIndex(db)
+    count = 0
+    start_time = time()
+    # Flushed once per chunk. The balances, txids and checkpoint of the chunk are only committed - together -
+    # once the chunk rows are verified: rows committed without their checkpoint are dropped by resume.
+    with LedgerWriter(db, batch_size=sys.maxsize, bulk=True, public_keys=public_keys) as writer:
+        for chunk, rows, checksum in converted_chunks(legacy_path, todo, workers):
+            first_rowid = db.execute("SELECT IFNULL(MAX(rowid), 0) FROM transactions").fetchone()[0]
+            writer.add_rows(rows)
+            writer.flush()
+            if verify:
+                try:
+                    verify_chunk(db, public_keys, first_rowid, chunk, len(rows), checksum)
+                except ValueError:
+                    # Not converted then: a new run retries it
+                    db.execute("DELETE FROM transactions WHERE rowid > ?", (first_rowid, ))
+                    db.commit()
+                    raise
+            balances.apply_deltas(db, balances.ledger_deltas(db, "WHERE rowid > ?", (first_rowid, )))
+            txid_index.add_rows((txid(row[5]), row[0]) for row in rows)
+            db.execute("INSERT INTO convert_checkpoint VALUES (?, ?, ?, ?)", (*chunk, len(rows), checksum))
+            db.commit()
+            count += len(rows)
+            print(f"Heights {chunk[0]} to {chunk[1] - 1}: {len(rows)} txs, "
+                  f"{count / max(time() - start_time, 1e-6):.0f} tx/s")
+    db.execute("DELETE FROM misc")
+    db.executemany("INSERT INTO misc VALUES (?, ?)", misc)
+    db.commit()
+    db.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a legacy ledger.db to the bin format, resumable")
+    parser.add_argument("legacy", help="legacy ledger.db, read only")
+    parser.add_argument("bin", help="bin ledger to create, or to resume")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="heights per chunk")
+    parser.add_argument("--workers", type=int, default=0, help="converting processes, 0 for all cpus")
+    parser.add_argument("--no-verify", action="store_true", help="do not read back and verify every chunk")
+    args = parser.parse_args()
+    converted = convert(args.legacy, args.bin, args.chunk_size, args.workers, verify=not args.no_verify)
+    print(f"{converted} transactions converted")
 
 
 """
@@ -123,4 +237,3 @@ Indexes
 - new (no pubkey)   243277824
 - new (dup pubkeys) 294117376
 """
-
@@ -0,0 +1,158 @@
+"""
+Incremental per address balances for the bin ledger
+
+The balances table holds, for every address, the sums of the transactions table in integer units:
+credit (amounts received), debit (amounts sent), fees (fees paid) and rewards (mining rewards received).
+It is updated in the same sql transaction as the transactions rows, so a balance is a single row lookup
+instead of a scan of the address history. None of these functions commit.
+BalanceCache memoizes balances for a given ledger tip, for the mempool admission checks.
+"""
+
+from typing import Callable, Dict, Hashable, Iterable, List
+
+from bismuthcore.helpers import LRUCache
+from bismuthcore.transaction import Transaction
+
+__version__ = '0.0.2'
+
+
+SQL_UPSERT = "INSERT INTO balances (address, credit, debit, fees, rewards) VALUES (?,?,?,?,?) " \
+             "ON CONFLICT(address) DO UPDATE SET credit = credit + excluded.credit, " \
+             "debit = debit + excluded.debit, fees = fees + excluded.fees, rewards = rewards + excluded.rewards"
+
+SQL_GET = "SELECT credit, debit, fees, rewards FROM balances WHERE address = ?"
+
+SQL_GET_ALL = "SELECT address, credit, debit, fees, rewards FROM balances"
+
+SQL_DELETE_EMPTY = "DELETE FROM balances WHERE credit = 0 AND debit = 0 AND fees = 0 AND rewards = 0"
+
+SQL_CLEAR = "DELETE FROM balances"
+
+SQL_CREDITS = "SELECT recipient, SUM(iamount), SUM(ireward) FROM transactions {} GROUP BY recipient"
+
+SQL_DEBITS = "SELECT address, SUM(iamount), SUM(ifee) FROM transactions {} GROUP BY address"
+
+# Same condition as the node rollback: blocks from height, and their mirror - negative height - blocks.
+SQL_FROM_HEIGHT = "WHERE block_height >= ? OR block_height <= ?"
+
+SQL_DELETE_FROM_HEIGHT = "DELETE FROM transactions " + SQL_FROM_HEIGHT
+
+# Deltas are address: [credit, debit, fees, rewards]
+Deltas = Dict[str, List[int]]
+
+
+def transaction_deltas(transactions: Iterable[Transaction], deltas: Deltas=None) -> Deltas:
+    """Sums the balance changes of the given transactions, added to deltas if given."""
+    if deltas is None:
+        deltas = {}
+    for transaction in transactions:
+        if transaction.amount or transaction.reward:
+            recipient = deltas.setdefault(transaction.recipient, [0, 0, 0, 0])
+            recipient[0] += transaction.amount
+            recipient[3] += transaction.reward
+        if transaction.amount or transaction.fee:
+            sender = deltas.setdefault(transaction.address, [0, 0, 0, 0])
+            sender[1] += transaction.amount
+            sender[2] += transaction.fee
+    return deltas
+
+
+def apply_deltas(db, deltas: Deltas, sign: int=1) -> None:
+    """Adds - or subtracts, with sign=-1 - the deltas to the balances table."""
+    db.executemany(SQL_UPSERT, ((address, sign * credit, sign * debit, sign * fees, sign * rewards)
+                                for address, (credit, debit, fees, rewards) in deltas.items()))
+    if sign < 0:
+        db.execute(SQL_DELETE_EMPTY)
+
+
+def apply(db, transactions: Iterable[Transaction]) -> None:
+    """Accounts for transactions being inserted in the ledger"""
+    apply_deltas(db, transaction_deltas(transactions))
+
+
+def ledger_deltas(db, where: str='', params: tuple=()) -> Deltas:
+    """Balances of the transactions table rows matching the where clause, computed by sql."""
+    deltas = {}
+    for recipient, credit, rewards in db.execute(SQL_CREDITS.format(where), params):
+        balance = deltas.setdefault(recipient, [0, 0, 0, 0])
+        balance[0] += credit
+        balance[3] += rewards
+    for address, debit, fees in db.execute(SQL_DEBITS.format(where), params):
+        balance = deltas.setdefault(address, [0, 0, 0, 0])
+        balance[1] += debit
+        balance[2] += fees
+    return deltas
+
+
+def rollback(db, height: int) -> None:
+    """Removes the transactions of blocks from height on - and their mirror blocks - and their balance changes."""
+    params = (height, -height)
+    apply_deltas(db, ledger_deltas(db, SQL_FROM_HEIGHT, params), sign=-1)
+    db.execute(SQL_DELETE_FROM_HEIGHT, params)
+
+
+def get(db, address: str) -> tuple:
+    """(credit, debit, fees, rewards) of the address"""
+    row = db.execute(SQL_GET, (address, )).fetchone()
+    return tuple(row) if row else (0, 0, 0, 0)
+
+
+def get_balance(db, address: str) -> int:
+    """Balance of the address, in integer units"""
+    credit, debit, fees, rewards = get(db, address)
+    return credit + rewards - debit - fees
+
+
+class BalanceCache:
+    """Ledger balances, in integer units, by address, for the current ledger tip.
+
+    The tip is any value identifying the ledger state - (height, block hash) of the last block: when it changes,
+    every cached balance is dropped. Balances of a tip are computed once, by lookup(address).
+    """
+
+    __slots__ = ('lookup', 'tip', '_cache')
+
+    def __init__(self, lookup: Callable[[str], int]=None, max_entries: int=10000):
+        """lookup is the default balance function, for instance functools.partial(get_balance, db)"""
+        self.lookup = lookup
+        self.tip = None
+        self._cache = LRUCache(max_entries)
+
+    def get(self, address: str, tip: Hashable, lookup: Callable[[str], int]=None) -> int:
+        """Balance of the address at tip. lookup overrides the default one, for ledgers reached through a cursor."""
+        if tip != self.tip:
+            self._cache.clear()
+            self.tip = tip
+        balance = self._cache.get(address)
+        if balance is None:
+            balance = (lookup or self.lookup)(address)
+            self._cache.set(address, balance)
+        return balance
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.tip = None
+
+    @property
+    def stats(self) -> dict:
+        return self._cache.stats
+
+
+def rebuild(db) -> None:
+    """Recomputes the whole balances table from the transactions table"""
+    db.execute(SQL_CLEAR)
+    apply_deltas(db, ledger_deltas(db))
+    db.execute(SQL_DELETE_EMPTY)
+
+
+def check_consistency(db) -> dict:
+    """Recomputes the balances from scratch and compares with the table.
+
+    Returns the mismatching addresses, as address: (expected, stored) - empty if consistent.
+    """
+    expected = {address: tuple(balance) for address, balance in ledger_deltas(db).items() if any(balance)}
+    stored = {row[0]: tuple(row[1:]) for row in db.execute(SQL_GET_ALL)}
+    zero = (0, 0, 0, 0)
+    return {address: (expected.get(address, zero), stored.get(address, zero))
+            for address in expected.keys() | stored.keys()
+            if expected.get(address, zero) != stored.get(address, zero)}
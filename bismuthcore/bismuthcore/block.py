@@ -4,14 +4,15 @@ Bismuth core Block Class
 """
 
 from bismuthcore.transaction import Transaction
+from bismuthcore.transactionbatch import TransactionBatch
 from bismuthcore.transactionslist import TransactionsList
-from typing import List
+from typing import List, Union
 from bismuthcore.helpers import address_validate, address_is_rsa
+from bismuthcore.signatureverifier import signature_item, verify_signature
 from time import time as ttime
-from polysign.signerfactory import SignerFactory
 from base64 import b64decode, b64encode
 
-__version__ = "0.0.2"
+__version__ = "0.0.9"
 
 
 class Block(TransactionsList):
@@ -19,12 +20,15 @@ class Block(TransactionsList):
     Holds a single block only, and can provide extra info about the block"""
 
     # Inner storage is compact, binary form
-    __slots__ = ('computed', '_tokens_operation_present', '_last_block_timestamp', 'mining_reward')
+    __slots__ = ('computed', '_tokens_operation_present', '_last_block_timestamp', 'mining_reward', 'txid_index')
 
-    def __init__(self, transactions: List[Transaction], compute: bool=False, check_txs: bool=False, last_block_timestamp=0, mining_reward: int=0):
+    def __init__(self, transactions: Union[List[Transaction], TransactionBatch], compute: bool=False, check_txs: bool=False, last_block_timestamp=0, mining_reward: int=0,
+                 txid_index=None):
         """Default constructor with list of binary, non verbose,
-        Transactions instances, mining transaction at the end."""
+        Transactions instances, mining transaction at the end.
+        If the ledger TxidIndex is given, fast checks also reject transactions already in the ledger."""
         super().__init__(transactions)
+        self.txid_index = txid_index
         self._last_block_timestamp = last_block_timestamp
         self._tokens_operation_present = None
         self.computed = False
@@ -35,6 +39,14 @@ class Block(TransactionsList):
             self._check_txs_fast()
             pass
 
+    @classmethod
+    def from_legacy_block(cls, legacy_block: list, check_txs: bool=False, last_block_timestamp=0) -> "Block":
+        """Decodes a legacy block: a list of legacy - mempool like - transactions lists"""
+        tx_list = [Transaction.from_legacy_params(timestamp=tx[0], address=tx[1], recipient=tx[2], amount=tx[3],
+                                                  signature=tx[4], public_key=tx[5], operation=tx[6],
+                                                  openfield=tx[7]) for tx in legacy_block]
+        return cls(tx_list, check_txs=check_txs, last_block_timestamp=last_block_timestamp)
+
     def _compute(self):
         # Update tokens_operation_present, without tx checks.
         self._tokens_operation_present = False
@@ -74,6 +86,10 @@ class Block(TransactionsList):
                 raise ValueError("Transaction older than 24h not allowed.")
         if len(self.transactions) != len(signature_list):
             raise ValueError("There are duplicate signatures in this block, rejected")
+        if self.txid_index is not None:
+            for transaction in self.transactions:
+                if transaction.signature in self.txid_index:
+                    raise ValueError("Transaction already in ledger, rejected")
 
     def validate_mid(self):
         """More intensive checks"""
@@ -85,27 +101,38 @@ class Block(TransactionsList):
             if not address_validate(transaction.recipient):
                 raise ValueError("Not a valid recipient address")
 
-    def validate_heavy(self):
-        """More intensive checks - sigs checks"""
+    def signature_items(self) -> list:
+        """Checks the signing buffers, returns what is needed to verify the signatures"""
+        items = []
         for transaction in self.transactions:
             # EGG_EVO: Temp coherence control for db V2. TODO: Remove after more tests
+            # Wire decoded transactions have no legacy source to compare with: legacy_buffer is None.
             buffer2 = transaction.to_buffer_for_signing()
-            if transaction.legacy_buffer != buffer2:
+            if transaction.legacy_buffer is not None and transaction.legacy_buffer != buffer2:
                 print(f"Amount '{transaction.temp_amount}' Int {transaction.amount}")
                 print("Legacy ", transaction.legacy_buffer)
                 print("Buffer2", buffer2)
 
                 raise ValueError("Buffer mismatch DB V2")
+            items.append(signature_item(transaction, buffer2))
+        return items
+
+    def validate_heavy(self, verifier=None, cache=None):
+        """More intensive checks - sigs checks
+        With a SignatureVerifier, signatures are checked in parallel. Raises on the first invalid one anyway.
+        With a SignatureCache, signatures already verified - by the mempool for instance - are skipped.
+        A verifier uses its own cache."""
+        items = self.signature_items()
+        if verifier is not None:
+            verifier.check(items)
+            return
+        for item in items:
+            if cache is not None and cache.verified(item):
+                continue
             # Will raise if error - also includes reconstruction of address from pubkey to make sure it matches
-            # TODO: add a "raw" method in polysign so we avoid encode/recode
-            """
-            SignerFactory.verify_bis_signature(b64encode(transaction.signature).decode('utf-8'),
-                                               b64encode(transaction.public_key).decode('utf-8'),
-                                               buffer2, transaction.address)
-            """
-            SignerFactory.verify_bis_signature_raw(transaction.signature,
-                                               transaction.public_key,
-                                               buffer2, transaction.address)
+            verify_signature(*item)
+            if cache is not None:
+                cache.add(item)
             # TODO: node log
             # print(f"Valid signature from {transaction.address} to {transaction.recipient} amount {Transaction.int_to_f8(transaction.amount)}")
             """
@@ -136,6 +163,9 @@ class Block(TransactionsList):
         return self.transactions[-1].block_height
 
     def set_height(self, height: int) -> None:
+        if isinstance(self.transactions, TransactionBatch):
+            self.transactions.set_height(height)
+            return
         for transaction in self.transactions:
             transaction.block_height = height
 
@@ -145,8 +175,14 @@ class Block(TransactionsList):
     """
 
     def set_reward(self, reward: int) -> None:
+        if isinstance(self.transactions, TransactionBatch):
+            self.transactions.set_reward(reward)
+            return
         self.transactions[-1].reward = reward
 
     def set_hash(self, block_hash: bytes) -> None:
+        if isinstance(self.transactions, TransactionBatch):
+            self.transactions.set_hash(block_hash)
+            return
         for transaction in self.transactions:
             transaction.block_hash = block_hash
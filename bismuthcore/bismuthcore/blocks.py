@@ -2,12 +2,14 @@
 Bismuth core Blocks Class
 """
 
-from bismuthcore.transaction import Transaction
+from bismuthcore.transaction import WIRE_COUNT
 from bismuthcore.block import Block
-from typing import List
-import sys
+from typing import Iterable, Iterator, List, Union
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
 
-__version__ = "0.0.1"
+__version__ = "0.0.5"
 
 
 class Blocks():
@@ -28,6 +30,18 @@ class Blocks():
         # TODO
         pass
 
+    def validate_heavy(self, verifier=None, cache=None):
+        """Sigs checks of all the blocks at once, so a SignatureVerifier pool gets the whole batch.
+        Raises on the first invalid signature, in blocks then transactions order."""
+        if verifier is None:
+            for block in self.blocks:
+                block.validate_heavy(cache=cache)
+            return
+        items = []
+        for block in self.blocks:
+            items.extend(block.signature_items())
+        verifier.check(items)
+
     @property
     def tx_count(self):
         if self._tx_count is None:
@@ -37,16 +51,68 @@ class Blocks():
         return self._tx_count
 
     @classmethod
-    def from_legacy_block_data(cls, block_data: List[list], first_level_checks: bool=False, last_block_timestamp=0):
+    def from_protobuf(cls, protobuf: Union[bytes, bytearray, memoryview]):
+        """Create from a binary wire buffer, as produced by to_protobuf(). Does not copy the buffer."""
+        view = protobuf if type(protobuf) is memoryview else memoryview(protobuf)
+        if WIRE_COUNT.size > len(view):
+            raise ValueError("Truncated wire blocks count")
+        count, = WIRE_COUNT.unpack_from(view, 0)
+        offset = WIRE_COUNT.size
         blocks = []
-        for legacy_block in block_data:
-            tx_list = [Transaction.from_legacy_params(timestamp=tx[0], address=tx[1], recipient=tx[2], amount=tx[3],
-                                                      signature=tx[4], public_key=tx[5], operation=tx[6],
-                                                      openfield=tx[7]) for tx in legacy_block]
-            block = Block(tx_list, check_txs=first_level_checks, last_block_timestamp=last_block_timestamp)
+        for _ in range(count):
+            block, offset = Block.unpack_from(view, offset)
             blocks.append(block)
-        return cls(blocks, first_level_checks=first_level_checks)
+        return cls(blocks)
 
+    def to_protobuf(self, buffer: bytearray=None) -> bytearray:
+        """Exports to the binary wire format: blocks count, then every block as a transactions list.
+        If a bytearray buffer is given, appends to it."""
+        if buffer is None:
+            buffer = bytearray()
+        buffer += WIRE_COUNT.pack(len(self.blocks))
+        for block in self.blocks:
+            block.to_protobuf(buffer)
+        return buffer
 
+    @classmethod
+    def from_legacy_block_data(cls, block_data: List[list], first_level_checks: bool=False, last_block_timestamp=0,
+                               workers: int=1, executor: ProcessPoolExecutor=None):
+        blocks = list(cls.iter_legacy_block_data(block_data, first_level_checks=first_level_checks,
+                                                 last_block_timestamp=last_block_timestamp, workers=workers,
+                                                 executor=executor))
+        return cls(blocks, first_level_checks=first_level_checks)
 
+    @staticmethod
+    def iter_legacy_block_data(block_data: Iterable[list], first_level_checks: bool=False, last_block_timestamp=0,
+                               workers: int=1, executor: ProcessPoolExecutor=None) -> Iterator[Block]:
+        """Yields the decoded Blocks, in order, as soon as each one is ready.
 
+        With workers > 1 - or a process pool executor, to be reused across calls - blocks are decoded in parallel.
+        workers is then the number of blocks in flight.
+        At most one block per worker is in flight, so memory stays bounded whatever the batch size.
+        Decoding or check errors are raised when their block's turn comes.
+        """
+        if executor is None and workers <= 1:
+            for legacy_block in block_data:
+                yield Block.from_legacy_block(legacy_block, first_level_checks, last_block_timestamp)
+            return
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        elif workers <= 1:
+            # Size of the given pool is not known, assume it has one worker per cpu
+            workers = os.cpu_count() or 1
+        pending = deque()
+        try:
+            for legacy_block in block_data:
+                pending.append(executor.submit(Block.from_legacy_block, legacy_block, first_level_checks,
+                                               last_block_timestamp))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
@@ -5,7 +5,7 @@ Communication classes ancestors.
 from abc import ABC, abstractmethod
 from bismuthcore.helpers import base_app_log
 
-__version__ = '0.0.6'
+__version__ = '0.0.7'
 
 
 class ComClient(ABC):
@@ -75,3 +75,9 @@ class Connector(ABC):
     @abstractmethod
     async def send_legacy(self, data) -> bool:
         pass
+
+    async def send_legacy_blocks(self, transactions, address: str=None, recipient: str=None,
+                                 operation: str=None) -> bool:
+        """Sends transactions.to_blocks_dict(...) - transactions being a TransactionsList.
+        Backends able to stream override this to avoid building the dict."""
+        return await self.send_legacy(transactions.to_blocks_dict(address, recipient, operation))
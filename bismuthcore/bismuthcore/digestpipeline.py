@@ -0,0 +1,185 @@
+"""
+Staged block digest pipeline
+
+Blocks stream through decode -> fast checks -> address checks -> signature checks -> ledger write,
+one thread per stage and bounded queues in between. Cheap checks run ahead of the RSA work,
+so a block failing them is rejected without waiting for the signatures of the blocks before it.
+"""
+
+from queue import Queue
+from threading import Lock, Thread
+from time import time
+from typing import Callable, Iterable, List, Union
+
+from bismuthcore.block import Block
+
+__version__ = '0.0.2'
+
+
+# End of stream marker
+_DONE = None
+
+
+class DigestError(ValueError):
+    """A block was rejected. The blocks before it were all digested."""
+
+    def __init__(self, message: str, index: int, stage: str, written: int):
+        super().__init__(message)
+        # Index of the rejected block in the input, and the stage that rejected it
+        self.index = index
+        self.stage = stage
+        # Number of blocks written to the ledger
+        self.written = written
+
+
+class PipelineStage:
+    """A pipeline step, its input queue and its metrics"""
+
+    __slots__ = ('name', 'function', 'queue', 'count', 'seconds', 'max_queue_depth')
+
+    def __init__(self, name: str, function: Callable, queue_size: int):
+        self.name = name
+        self.function = function
+        self.queue = Queue(maxsize=queue_size)
+        # Blocks processed, and time spent processing them
+        self.count = 0
+        self.seconds = 0.0
+        self.max_queue_depth = 0
+
+    @property
+    def stats(self) -> dict:
+        return {"count": self.count, "seconds": self.seconds, "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth}
+
+
+class DigestPipeline:
+    """Digests a batch of blocks, in order, through bounded stages.
+
+    Input blocks can be Block instances, legacy block data - lists of legacy mempool like tx lists, as in
+    Blocks.from_legacy_block_data - or binary wire blocks. Wire blocks carry no legacy buffer: the db V2 coherence
+    control of Block.signature_items only applies to legacy input, the signatures are checked the same.
+    verifier is an optional SignatureVerifier, cache an optional SignatureCache, txid_index an optional TxidIndex
+    for the fast checks. write is called with every valid block, in order: for instance
+
+        def write(block):
+            writer.add_many(block.transactions)
+            writer.flush()
+
+    with a LedgerWriter. Setting heights and hashes is up to write, as it is to the node.
+    """
+
+    __slots__ = ('stages', 'verifier', 'cache', 'txid_index', 'write', 'last_block_timestamp', 'written',
+                 '_failure', '_lock')
+
+    def __init__(self, write: Callable[[Block], None]=None, verifier=None, cache=None, txid_index=None,
+                 last_block_timestamp: float=0, queue_size: int=4):
+        self.verifier = verifier
+        self.cache = cache
+        self.txid_index = txid_index
+        self.write = write
+        # Chained from block to block by the fast checks
+        self.last_block_timestamp = last_block_timestamp
+        self.written = 0
+        # (index, stage name, message) of the earliest rejected block
+        self._failure = None
+        self._lock = Lock()
+        self.stages = [PipelineStage('decode', self._decode, queue_size),
+                       PipelineStage('fast', self._fast, queue_size),
+                       PipelineStage('address', self._address, queue_size),
+                       PipelineStage('signature', self._signature, queue_size),
+                       PipelineStage('write', self._write, queue_size)]
+
+    def _decode(self, data: Union[Block, list, bytes, bytearray, memoryview]) -> Block:
+        if isinstance(data, Block):
+            return data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return Block.from_protobuf(data)
+        return Block.from_legacy_block(data)
+
+    def _fast(self, block: Block) -> Block:
+        block._last_block_timestamp = self.last_block_timestamp
+        block.txid_index = self.txid_index
+        block._check_txs_fast()
+        self.last_block_timestamp = block.miner_tx.timestamp
+        return block
+
+    def _address(self, block: Block) -> Block:
+        block.validate_mid()
+        return block
+
+    def _signature(self, block: Block) -> Block:
+        block.validate_heavy(self.verifier, self.cache)
+        return block
+
+    def _write(self, block: Block) -> Block:
+        if self.write is not None:
+            self.write(block)
+        self.written += 1
+        return block
+
+    def _stopped(self, index: int) -> bool:
+        """Blocks after a rejected one are dropped"""
+        failure = self._failure
+        return failure is not None and index > failure[0]
+
+    def _run_stage(self, position: int) -> None:
+        stage = self.stages[position]
+        next_queue = self.stages[position + 1].queue if position + 1 < len(self.stages) else None
+        while True:
+            stage.max_queue_depth = max(stage.max_queue_depth, stage.queue.qsize())
+            entry = stage.queue.get()
+            if entry is _DONE:
+                if next_queue is not None:
+                    next_queue.put(_DONE)
+                return
+            index, item = entry
+            if self._stopped(index):
+                continue
+            start = time()
+            try:
+                item = stage.function(item)
+            except Exception as e:
+                with self._lock:
+                    if self._failure is None or index < self._failure[0]:
+                        self._failure = (index, stage.name, str(e))
+                continue
+            finally:
+                stage.seconds += time() - start
+                stage.count += 1
+            if next_queue is not None:
+                next_queue.put((index, item))
+
+    def run(self, blocks: Iterable) -> int:
+        """Digests the blocks, returns how many were written. Raises DigestError on the first rejected block,
+        once the blocks before it went through."""
+        self._failure = None
+        self.written = 0
+        threads = [Thread(target=self._run_stage, args=(position, ), daemon=True)
+                   for position in range(len(self.stages))]
+        for thread in threads:
+            thread.start()
+        first_queue = self.stages[0].queue
+        try:
+            for index, block in enumerate(blocks):
+                if self._failure is not None:
+                    break
+                # Blocks when the pipeline is full, so memory stays bounded
+                first_queue.put((index, block))
+        finally:
+            # Even if blocks raised, so the stage threads end
+            first_queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+        if self._failure is not None:
+            index, stage, message = self._failure
+            raise DigestError(message, index, stage, self.written)
+        return self.written
+
+    @property
+    def stats(self) -> dict:
+        """Per stage processed blocks count, busy time, current and max queue depths"""
+        return {stage.name: stage.stats for stage in self.stages}
+
+    @property
+    def queue_depths(self) -> List[int]:
+        return [stage.queue.qsize() for stage in self.stages]
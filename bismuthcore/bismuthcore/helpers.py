@@ -3,8 +3,10 @@ Helper Class and functions
 """
 
 import logging
+import threading
 from abc import ABC, abstractmethod
 from base64 import b64decode
+from collections import OrderedDict
 from decimal import Decimal, getcontext, ROUND_HALF_EVEN
 from sqlite3 import Binary
 from sys import version_info
@@ -13,8 +15,9 @@ import requests
 from polysign.signerfactory import SignerFactory
 
 from bismuthcore.compat import quantize_eight
+from bismuthcore.transaction import f8_to_int as transaction_f8_to_int, int_to_f8 as transaction_int_to_f8
 
-__version__ = '0.0.8'
+__version__ = '0.0.11'
 
 
 K1E8 = 100000000
@@ -46,6 +49,60 @@ class BismuthBase:
         self.config = config
 
 
+class LRUCache:
+    """A bounded, thread safe, least recently used cache. Size is in entries."""
+
+    __slots__ = ('max_entries', 'hits', 'misses', 'evictions', '_data', '_lock')
+
+    def __init__(self, max_entries: int=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value, or default. Counts hits and misses."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        """Stores a value, evicting the least recently used entries above max_entries"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "max_entries": self.max_entries, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
 class Commands(ABC):
 
     commands = None
@@ -129,12 +186,31 @@ def sanitize_address(address: str) -> str:
     return str(address)[:56]
 
 
+# A few thousand addresses send and receive most of the transactions. Both verdicts are cached.
+ADDRESS_VALID_CACHE = LRUCache(100000)
+
+ADDRESS_RSA_CACHE = LRUCache(100000)
+
+# Longest polysign address. Longer - peer supplied - strings are checked without being cached.
+ADDRESS_CACHE_MAX_LEN = 59
+
+
+def _cached_check(cache: LRUCache, check, address: str) -> bool:
+    if len(address) > ADDRESS_CACHE_MAX_LEN:
+        return check(address)
+    result = cache.get(address)
+    if result is None:
+        result = bool(check(address))
+        cache.set(address, result)
+    return result
+
+
 def address_validate(address: str) -> bool:
-    return SignerFactory.address_is_valid(address)
+    return _cached_check(ADDRESS_VALID_CACHE, SignerFactory.address_is_valid, address)
 
 
 def address_is_rsa(address: str) -> bool:
-    return SignerFactory.address_is_rsa(address)
+    return _cached_check(ADDRESS_RSA_CACHE, SignerFactory.address_is_rsa, address)
 
 
 """
@@ -148,12 +224,13 @@ DECIMAL_1E8 = Decimal(100000000)
 
 def int_to_f8(an_int: int):
     """Helper function to convert an int amount - inner format - to legacy string 0.8f """
-    return str('{:.8f}'.format(Decimal(an_int) / DECIMAL_1E8))
+    # Decimal free version, shared with Transaction
+    return transaction_int_to_f8(an_int)
 
 
 def f8_to_int(a_str: str):
     """Helper function to convert a legacy string 0.8f to compact int format"""
-    return int(Decimal(a_str) * DECIMAL_1E8)
+    return transaction_f8_to_int(a_str)
 
 
 def native_tx_to_bin_sqlite(tx):
@@ -0,0 +1,76 @@
+"""
+Bin ledger - sqlite - schema
+"""
+
+__version__ = '0.0.3'
+
+
+# Public keys are stored once, transactions.public_key is the matching pubkeys.id, 0 if no public key.
+# txids indexes the transactions by a compact id, see txidindex.py
+# balances holds the per address totals of the transactions table, see balances.py
+SQL_CREATE_TABLES = ('''
+                     CREATE TABLE IF NOT EXISTS "misc" (
+                         `block_height`	INTEGER,
+                         `difficulty`	TEXT
+                     )''',
+                     '''CREATE TABLE IF NOT EXISTS "transactions" (
+                         `block_height`	INTEGER,
+                         `timestamp`	NUMERIC,
+                         `address`	BLOB(28),
+                         `recipient`	BLOB(28),
+                         `iamount`	INTEGER,
+                         `signature`	BLOB,
+                         `public_key`	INTEGER,
+                         `block_hash`	BLOB(28),
+                         `ifee`	INTEGER,
+                         `ireward`	INTEGER,
+                         `operation`	TEXT,
+                         `openfield`	TEXT
+                     )''',
+                     '''CREATE TABLE IF NOT EXISTS "pubkeys" (
+                         `id`	INTEGER PRIMARY KEY,
+                         `public_key`	BLOB UNIQUE
+                     )''',
+                     '''CREATE TABLE IF NOT EXISTS "txids" (
+                         `txid`	INTEGER,
+                         `block_height`	INTEGER
+                     )''',
+                     '''CREATE TABLE IF NOT EXISTS "balances" (
+                         `address`	TEXT PRIMARY KEY,
+                         `credit`	INTEGER,
+                         `debit`	INTEGER,
+                         `fees`	INTEGER,
+                         `rewards`	INTEGER
+                     )''',
+                     )
+
+# Index name, then its definition
+SQL_INDEXES = (('Timestamp Index', '`transactions` (`timestamp`)'),
+               ('Signature Index', '`transactions` (`signature`)'),
+               ('Reward Index', '`transactions` (`ireward`)'),
+               ('Recipient Index', '`transactions` (`recipient`)'),
+               ('Openfield Index', '`transactions` (`openfield`)'),
+               ('Fee Index', '`transactions` (`ifee`)'),
+               ('Block Height Index', '`transactions` (`block_height`)'),
+               ('Block Hash Index', '`transactions` (`block_hash`)'),
+               ('Amount Index', '`transactions` (`iamount`)'),
+               ('Address Index', '`transactions` (`address`)'),
+               ('Operation Index', '`transactions` (`operation`)'),
+               ('Txid Index', '`txids` (`txid`)'),
+               ('Txid Height Index', '`txids` (`block_height`)'),
+               )
+
+SQL_CREATE_INDEXES = tuple(f'CREATE INDEX IF NOT EXISTS `{name}` ON {definition}' for name, definition in SQL_INDEXES)
+
+SQL_DROP_INDEXES = tuple(f'DROP INDEX IF EXISTS `{name}`' for name, _ in SQL_INDEXES)
+
+SQL_CREATE = SQL_CREATE_TABLES + SQL_CREATE_INDEXES
+
+SQL_INSERT_TRANSACTION = "INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"
+
+
+def create(db, sql: tuple=SQL_CREATE) -> None:
+    """Runs the given - default to full schema - create statements"""
+    for line in sql:
+        db.execute(line)
+    db.commit()
@@ -0,0 +1,171 @@
+"""
+Bulk transactions writer for the bin ledger
+"""
+
+import gc
+from typing import Iterable
+
+from bismuthcore import balances
+from bismuthcore.ledgerschema import SQL_DROP_INDEXES, SQL_INDEXES, SQL_INSERT_TRANSACTION
+from bismuthcore.transaction import Transaction
+from bismuthcore.txidindex import SQL_INSERT as SQL_INSERT_TXID, txid
+
+__version__ = '0.0.4'
+
+
+class LedgerWriter:
+    """Inserts transactions into the transactions table, batch_size rows per executemany and commit.
+
+    In bulk mode - bootstrap import or resync - the indexes are dropped when writing starts
+    and rebuilt once at the end, rather than updated for every row. Use it for any sync of more than a few blocks:
+    with the indexes kept, index updates dominate and the writer runs at the pace of per row inserts.
+    With update_balances and update_txids, the balances and txids tables are updated
+    in the same sql transaction as every batch. A SignatureFilter, if given, is fed every transaction.
+    Use as a context manager, or call start() then close():
+
+        with LedgerWriter(db, bulk=True) as writer:
+            writer.add_many(transactions)
+    """
+
+    __slots__ = ('db', 'batch_size', 'bulk', 'public_keys', 'update_balances', 'update_txids', 'signature_filter', 'count',
+                 '_rows', '_deltas', '_txids', '_dropped', '_started')
+
+    def __init__(self, db, batch_size: int=10000, bulk: bool=False, public_keys=None, update_balances: bool=False,
+                 update_txids: bool=False, signature_filter=None):
+        """public_keys is an optional PublicKeyStore, for ledgers with deduplicated public keys."""
+        if batch_size < 1:
+            raise ValueError("batch_size has to be at least 1")
+        self.db = db
+        self.batch_size = batch_size
+        self.bulk = bulk
+        self.public_keys = public_keys
+        self.update_balances = update_balances
+        self.update_txids = update_txids
+        self.signature_filter = signature_filter
+        # Transactions written so far
+        self.count = 0
+        self._rows = []
+        # Balance changes of the pending rows
+        self._deltas = {}
+        # (txid, block_height) of the pending rows
+        self._txids = []
+        # (name, definition) of the indexes to rebuild after a bulk write
+        self._dropped = []
+        self._started = False
+
+    def start(self) -> None:
+        if self._started:
+            return
+        if self.bulk:
+            # All the indexes of the tables this db has, even if an interrupted bulk write already dropped them.
+            # A partial schema - no txids table - does not fail at close.
+            tables = set(row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            self._dropped = [(name, definition) for name, definition in SQL_INDEXES
+                             if definition.split(' ')[0].strip('`') in tables]
+            for sql in SQL_DROP_INDEXES:
+                self.db.execute(sql)
+            self.db.commit()
+        self._started = True
+
+    def add(self, transaction: Transaction) -> None:
+        if not self._started:
+            self.start()
+        self._rows.append(transaction.to_bin_tuple(sqlite_encode=True, public_keys=self.public_keys))
+        if self.update_balances:
+            balances.transaction_deltas((transaction, ), self._deltas)
+        if self.update_txids:
+            self._txids.append((txid(transaction.signature), transaction.block_height))
+        if self.signature_filter is not None:
+            # Before the commit: a false positive meanwhile is fine, a false negative is not.
+            self.signature_filter.digest((transaction, ), transaction.block_height)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, transactions: Iterable[Transaction]) -> None:
+        if self.update_balances or self.update_txids or self.signature_filter is not None:
+            for transaction in transactions:
+                self.add(transaction)
+            return
+        if not self._started:
+            self.start()
+        # Rows only: same as add(), without its per transaction checks.
+        public_keys = self.public_keys
+        batch_size = self.batch_size
+        # The pending rows are acyclic, but every batch of them would trigger full gc passes over the whole heap:
+        # as costly as the inserts themselves. Collections only run at flush time.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for transaction in transactions:
+                self._rows.append(transaction.to_bin_tuple(sqlite_encode=True, public_keys=public_keys))
+                if len(self._rows) >= batch_size:
+                    self.flush()
+                    if gc_enabled:
+                        gc.collect(0)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def add_rows(self, rows: Iterable[tuple]) -> None:
+        """Adds bin tuples, as from to_bin_tuple() with the public key itself, without Transaction objects.
+        Only writes the transactions table: not for a writer updating balances, txids or a signature filter."""
+        if self.update_balances or self.update_txids or self.signature_filter is not None:
+            raise ValueError("add_rows only writes the transactions table")
+        if not self._started:
+            self.start()
+        public_keys = self.public_keys
+        for row in rows:
+            if public_keys is not None:
+                row = row[:6] + (public_keys.id_for(row[6]), ) + row[7:]
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self.flush()
+
+    def flush(self) -> None:
+        """Writes and commits the pending rows"""
+        if not self._rows:
+            return
+        self.db.executemany(SQL_INSERT_TRANSACTION, self._rows)
+        if self._deltas:
+            balances.apply_deltas(self.db, self._deltas)
+        if self._txids:
+            self.db.executemany(SQL_INSERT_TXID, self._txids)
+        self.db.commit()
+        self.count += len(self._rows)
+        self._rows = []
+        self._deltas = {}
+        self._txids = []
+
+    def rollback(self) -> None:
+        """Drops the pending - not yet flushed - rows"""
+        self._rows = []
+        self._deltas = {}
+        self._txids = []
+        self.db.rollback()
+        if self.public_keys is not None:
+            self.public_keys.clear()
+
+    def close(self) -> None:
+        """Flushes the remaining rows, and rebuilds the indexes in bulk mode"""
+        self.flush()
+        self._rebuild_indexes()
+
+    def _rebuild_indexes(self) -> None:
+        if self.bulk and self._started:
+            for name, definition in self._dropped:
+                self.db.execute(f'CREATE INDEX IF NOT EXISTS `{name}` ON {definition}')
+            self.db.commit()
+            self._dropped = []
+        self._started = False
+
+    def __enter__(self) -> "LedgerWriter":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # Already flushed batches stay, but the ledger is never left without its indexes.
+            self.rollback()
+            self._rebuild_indexes()
@@ -8,24 +8,37 @@ import base64
 import hashlib
 import os
 import sqlite3
-import sys
 import threading
 import time
-
-# TODO: use polysign instead
-from Cryptodome.Hash import SHA
-from Cryptodome.PublicKey import RSA
-from Cryptodome.Signature import PKCS1_v1_5
+from decimal import Decimal
+from functools import partial
 
 import essentials
+from bismuthcore.balances import BalanceCache
 from bismuthcore.compat import quantize_two, quantize_eight
-from bismuthcore.helpers import fee_calculate
+from bismuthcore.helpers import fee_calculate_int
+from bismuthcore.legacy.mempoolstores import MemoryMempoolStore, SqliteMempoolStore
+# Also run against the ram mempool store by execute, fetchone and fetchall, see _store_query
+from bismuthcore.legacy.mempoolstores import (SQL_CREATE, SQL_PURGE, SQL_CLEAR, SQL_SIG_CHECK, SQL_DELETE_TX,
+                                              SQL_SELECT_ALL_TXS, SQL_SELECT_ALL_SIGS, SQL_STATUS,
+                                              SQL_SELECT_TX_TO_SEND, SQL_SELECT_TX_TO_SEND_SINCE)
+from bismuthcore.signatureverifier import ADDRESS_UNCHECKED, SIGNATURE_INVALID, SignatureVerifier, verify_legacy_item
+from bismuthcore.transaction import Transaction
 # import json
 
-__version__ = "0.0.5f"
+__version__ = "0.0.5o"
 
 # NOTE: Old version archived for comparison, not to be used.
 """
+0.0.5o - tx_to_send by merge sequence number per peer, set filtering of the peer txs
+0.0.5n - batch merge: cheap checks first, signatures verified in a pool out of the lock
+0.0.5m - int balance checks from pending debits and cached ledger balances
+0.0.5l - incremental mempool size
+0.0.5k - native in memory store for the ram mempool
+0.0.5j - parsed RSA keys cache
+0.0.5i - shared verified signatures cache
+0.0.5h - optional signature filter in front of ledger signature checks
+0.0.5g - txid index for ledger and mempool signature checks
 0.0.5f - use bismuthcore 1/n
 0.0.5e - add mergedts timestamp to tx for better handling of late txs
          quicker unfreeze
@@ -48,46 +61,53 @@ FREEZE_MIN = 5
 Common Sql requests
 """
 
-# Create mempool table
-SQL_CREATE = "CREATE TABLE IF NOT EXISTS transactions (" \
-             "timestamp TEXT, address TEXT, recipient TEXT, amount TEXT, signature TEXT, " \
-             "public_key TEXT, operation TEXT, openfield TEXT, mergedts INTEGER)"
-
-# Purge old txs that may be stuck
-SQL_PURGE = "DELETE FROM transactions WHERE timestamp <= strftime('%s', 'now', '-1 day')"
-
-# Delete all transactions
-SQL_CLEAR = "DELETE FROM transactions"
-
-# Check for presence of a given tx signature
-SQL_SIG_CHECK = 'SELECT timestamp FROM transactions WHERE signature = ?'
-
-# delete a single tx
-SQL_DELETE_TX = 'DELETE FROM transactions WHERE signature = ?'
-
-# Selects all tx from mempool - list fields so we don't send mergedts and keep compatibility
-SQL_SELECT_ALL_TXS = 'SELECT timestamp, address, recipient, amount, signature, public_key, operation, openfield FROM transactions'
-
 # Counts distinct senders from mempool
 SQL_COUNT_DISTINCT_SENDERS = 'SELECT COUNT(DISTINCT(address)) FROM transactions'
 
 # Counts distinct recipients from mempool
 SQL_COUNT_DISTINCT_RECIPIENTS = 'SELECT COUNT(DISTINCT(recipient)) FROM transactions'
 
-# A single requets for status info
-SQL_STATUS = 'SELECT COUNT(*) AS nb, SUM(LENGTH(openfield)) AS len, COUNT(DISTINCT(address)) as senders, COUNT(DISTINCT(recipient)) as recipients FROM transactions'
+# Writes run by the store with either mempool, so it keeps its size, pending debits and txids up to date
+STORE_WRITES = (SQL_CREATE, SQL_DELETE_TX, SQL_PURGE, SQL_CLEAR)
 
-# Select Tx to be sent to a peer
-SQL_SELECT_TX_TO_SEND = 'SELECT * FROM transactions ORDER BY amount DESC'
 
-# Select Tx to be sent to a peer since the given ts - what counts is the merged time, not the tx time.
-SQL_SELECT_TX_TO_SEND_SINCE = 'SELECT * FROM transactions where mergedts > ? ORDER BY amount DESC'
+class MergeCandidate:
+    """A received tx, normalized, with the outcome of the checks done before taking the merge lock"""
 
+    __slots__ = ('timestamp', 'address', 'recipient', 'amount', 'signature', 'public_key', 'operation', 'openfield',
+                 'tx_signed', 'signature_item', 'warning', 'result', 'error')
+
+    def __init__(self):
+        self.signature_item = None
+        self.tx_signed = None
+        # Message of a check that does not reject the tx
+        self.warning = None
+        # Rejection message
+        self.result = None
+        # Exception raised by the checks, raised again in turn so the merge stops at the same tx
+        self.error = None
 
-class Mempool:
-    """The mempool manager. Thread safe"""
 
-    def __init__(self, app_log, config=None, db_lock=None, testnet=False):
+class Mempool:
+    """The mempool manager. Thread safe
+
+    Transactions are held by a store: a native MemoryMempoolStore for the ram mempool,
+    a SqliteMempoolStore on mempool.db otherwise. With the former, execute, fetchone and fetchall only take
+    the SQL_* queries of this module, run against the store. With the latter, the STORE_WRITES go through
+    the store as well, and any other write resyncs it from the table.
+    """
+
+    def __init__(self, app_log, config=None, db_lock=None, testnet=False, txid_index=None, signature_filter=None,
+                 signature_cache=None, balance_cache=None, signature_verifier=None):
+        """txid_index is the optional TxidIndex of a bin ledger, to check for txs already in ledger.
+        signature_filter is the optional SignatureFilter of that ledger, that skips the db for most new txs.
+        signature_cache is the optional SignatureCache shared with block validation.
+        balance_cache is the optional BalanceCache of a bin ledger, reading its balances table.
+        Without it, ledger balances are summed from the legacy ledger, and cached the same way.
+        signature_verifier is the optional SignatureVerifier for merged batches, running verify_legacy_item.
+        By default, one verifying in the calling process, sharing signature_cache: a node that wants merges
+        checked in parallel passes its own, so the mempool does not start a pool of all the cpus next to
+        the one of block validation."""
         try:
             self.app_log = app_log
             self.config = config
@@ -101,8 +121,19 @@ class Mempool:
             self.peers_lock = threading.Lock()
             # ip: last time sent
             self.peers_sent = dict()
+            # ip: last merge sequence number sent, and the one of the txs selected but not sent yet
+            self.peers_sequence = dict()
+            self.peers_selected = dict()
             self.db = None
             self.cursor = None
+            self.store = None
+            self.txid_index = txid_index
+            self.signature_filter = signature_filter
+            self.signature_cache = signature_cache
+            self.balance_cache = balance_cache if balance_cache is not None else BalanceCache()
+            if signature_verifier is None:
+                signature_verifier = SignatureVerifier(workers=1, cache=signature_cache, function=verify_legacy_item)
+            self.signature_verifier = signature_verifier
 
             self.testnet = testnet
             if not self.testnet:
@@ -125,16 +156,10 @@ class Mempool:
         self.app_log.warning("Mempool Check")
         with self.lock:
             if self.ram:
-                self.db = sqlite3.connect(self.mempool_ram_file,
-                                          uri=True, timeout=1, isolation_level=None,
-                                          check_same_thread=False)
-                self.db.execute('PRAGMA journal_mode = WAL;')
-                self.db.execute("PRAGMA page_size = 4096;")
-                self.db.text_factory = str
-                self.cursor = self.db.cursor()
-                self.cursor.execute(SQL_CREATE)
-                self.db.commit()
-                self.app_log.warning("Status: In memory mempool file created")
+                # Native structure rather than a sqlite memory db. mempool_ram_file is not used anymore.
+                if self.store is None:
+                    self.store = MemoryMempoolStore()
+                self.app_log.warning("Status: In memory mempool created")
             else:
                 self.db = sqlite3.connect('mempool.db', timeout=1,
                                           check_same_thread=False)
@@ -152,9 +177,8 @@ class Mempool:
                                               check_same_thread=False)
                     self.db.text_factory = str
                     self.cursor = self.db.cursor()
-                    self.execute(SQL_CREATE)
-                    self.commit()
                     self.app_log.warning("Status: Recreated mempool file")
+                self.store = SqliteMempoolStore(self.db)
 
     def execute(self, sql, param=None, cursor=None):
         """
@@ -164,20 +188,26 @@ class Mempool:
         :param cursor: optional. will use the locked shared cursor if None
         :return:
         """
+        if self.db is None or sql in STORE_WRITES:
+            self._store_query(sql, param)
+            return
         # TODO: add a try count and die if we lock
         while True:
             try:
                 if not cursor:
                     cursor = self.cursor
                 if param:
-                    cursor._execute(sql, param)
+                    cursor.execute(sql, param)
                 else:
-                    cursor._execute(sql)
+                    cursor.execute(sql)
                 break
             except Exception as e:
                 self.app_log.warning("Database query: {} {}".format(cursor, sql))
                 self.app_log.warning("Database retry reason: {}".format(e))
                 time.sleep(0.1)
+        if not sql.lstrip().upper().startswith(("SELECT", "PRAGMA")):
+            # A write the store did not see
+            self.store.rebuild()
 
     def commit(self):
         """
@@ -185,6 +215,8 @@ class Mempool:
         :return:
         """
         # no lock on _execute and commit. locks are on full atomic operations only
+        if self.db is None:
+            return
         while True:
             try:
                 self.db.commit()
@@ -201,6 +233,13 @@ class Mempool:
         :param write: if the requests involves write, set to True to request a Lock
         :return:
         """
+        if self.db is None or sql in STORE_WRITES:
+            if write:
+                with self.lock:
+                    rows = self._store_query(sql, param)
+            else:
+                rows = self._store_query(sql, param)
+            return rows[0] if rows else None
         if write:
             with self.lock:
                 self.execute(sql, param)
@@ -218,6 +257,11 @@ class Mempool:
         :param write: if the requests involves write, set to True to request a Lock
         :return:
         """
+        if self.db is None or sql in STORE_WRITES:
+            if write:
+                with self.lock:
+                    return self._store_query(sql, param)
+            return self._store_query(sql, param)
         if write:
             with self.lock:
                 self.execute(sql, param)
@@ -227,17 +271,52 @@ class Mempool:
             self.execute(sql, param, cursor)
             return cursor.fetchall()
 
+    def _store_query(self, sql, param=None):
+        """
+        Runs one of the SQL_* queries against the store, for the ram mempool that has no db and for the STORE_WRITES
+        :param sql: one of the SQL_* queries
+        :param param:
+        :return: the rows the query would have returned
+        """
+        if sql == SQL_SELECT_ALL_TXS:
+            return self.store.txs()
+        if sql == SQL_SELECT_ALL_SIGS:
+            return [(row[4], ) for row in self.store.txs()]
+        if sql == SQL_STATUS:
+            return [self.store.status()]
+        if sql == SQL_COUNT_DISTINCT_SENDERS:
+            return [(self.store.status()[2], )]
+        if sql == SQL_COUNT_DISTINCT_RECIPIENTS:
+            return [(self.store.status()[3], )]
+        if sql == SQL_SIG_CHECK:
+            row = self.store.get(param[0])
+            return [(row[0], )] if row is not None else []
+        if sql == SQL_SELECT_TX_TO_SEND:
+            return self.store.to_send()
+        if sql == SQL_SELECT_TX_TO_SEND_SINCE:
+            return self.store.to_send(param[0])
+        if sql == SQL_DELETE_TX:
+            self.store.delete(param[0])
+        elif sql == SQL_PURGE:
+            self.store.purge()
+        elif sql == SQL_CLEAR:
+            self.store.clear()
+        elif sql != SQL_CREATE:
+            raise ValueError("Ram mempool only runs the mempool SQL_* queries, not {}".format(sql))
+        return []
+
     def vacuum(self):
         """
         Maintenance
         :return:
         """
         with self.lock:
-            self.execute("VACUUM")
+            self.store.vacuum()
 
     def close(self):
-        if self.db:
-            self.db.close()
+        if self.store:
+            self.store.close()
+        self.signature_verifier.close()
 
     def purge(self):
         """
@@ -247,8 +326,7 @@ class Mempool:
         while self.lock.locked():
             time.sleep(0.5)
         with self.lock:
-            self.execute(SQL_PURGE)
-            self.commit()
+            self.store.purge()
 
     def clear(self):
         """
@@ -256,8 +334,7 @@ class Mempool:
         :return:
         """
         with self.lock:
-            self.execute(SQL_CLEAR)
-            self.commit()
+            self.store.clear()
 
     def delete_transaction(self, signature):
         """
@@ -265,8 +342,7 @@ class Mempool:
         :return:
         """
         with self.lock:
-            self.execute(SQL_DELETE_TX, (signature,))
-            self.commit()
+            self.store.delete(signature)
 
     def sig_check(self, signature):
         """
@@ -274,7 +350,36 @@ class Mempool:
         :param signature:
         :return: boolean
         """
-        return bool(self.fetchone(SQL_SIG_CHECK, (signature,)))
+        return self.store.contains(signature)
+
+    def ledger_balance(self, c, address):
+        """
+        Balance of an address in the legacy ledger, summed from its whole history
+        :param c: legacy ledger cursor
+        :param address:
+        :return: int units
+        """
+        credit = 0
+        for entry in essentials.execute_param_c(c, "SELECT amount FROM transactions WHERE recipient = ?",
+                                                (address,), self.app_log):
+            credit = quantize_eight(credit) + quantize_eight(entry[0])
+
+        debit_ledger = 0
+        for entry in essentials.execute_param_c(c, "SELECT amount FROM transactions WHERE address = ?",
+                                                (address,), self.app_log):
+            debit_ledger = quantize_eight(debit_ledger) + quantize_eight(entry[0])
+
+        fees = 0
+        for entry in essentials.execute_param_c(c, "SELECT fee FROM transactions WHERE address = ?",
+                                                (address,), self.app_log):
+            fees = quantize_eight(fees) + quantize_eight(entry[0])
+
+        rewards = 0
+        for entry in essentials.execute_param_c(c, "SELECT sum(reward) FROM transactions WHERE recipient = ?",
+                                                (address,), self.app_log):
+            rewards = quantize_eight(rewards) + quantize_eight(entry[0])
+
+        return Transaction.f8_to_int(quantize_eight(credit - debit_ledger - fees + rewards))
 
     def status(self):
         """
@@ -291,26 +396,30 @@ class Mempool:
             with self.peers_lock:
                 self.peers_sent = {peer: self.peers_sent[peer] for peer in self.peers_sent if
                                    self.peers_sent[peer] > limit}
+                # Forgotten peers are sent the whole mempool again, as new ones
+                self.peers_sequence = {peer: sequence for peer, sequence in self.peers_sequence.items()
+                                       if peer in self.peers_sent}
+                self.peers_selected = {peer: sequence for peer, sequence in self.peers_selected.items()
+                                       if peer in self.peers_sent}
             self.app_log.warning(
                 "Status: MEMPOOL Live = {}".format(", ".join(set(self.peers_sent.keys()) - set(frozen))))
-            status = self.fetchall(SQL_STATUS)
-            count, open_len, senders, recipients = status[0]
+            status = self.store.status()
+            count, open_len, senders, recipients = status
             self.app_log.warning(
                 "Status: MEMPOOL {} Txs from {} senders to {} distinct recipients. Openfield len {}".
                     format(count, senders, recipients, open_len))
-            return status[0]
+            return status
         except:
             return 0
 
     def size(self):
         """
-        Curent size of the mempool in Mo
+        Curent size of the mempool in Mo: sys.getsizeof(str(txs)), txs being all the mempool txs.
+        Tracked by the store on every change rather than recomputed. Exact, see MempoolSize.
         :return:
         """
         try:
-            mempool_txs = self.fetchall(SQL_SELECT_ALL_TXS)
-            mempool_size = sys.getsizeof(str(mempool_txs)) / 1000000.0
-            return mempool_size
+            return self.store.size() / 1000000.0
         except:
             return 0
 
@@ -322,6 +431,10 @@ class Mempool:
         """
         # TODO: have a purge
         when = time.time()
+        with self.peers_lock:
+            # What tx_to_send selected is now sent
+            if peer_ip in self.peers_selected:
+                self.peers_sequence[peer_ip] = self.peers_selected.pop(peer_ip)
         if peer_ip in self.peers_sent:
             # can be frozen, no need to lock and update, time is already in the future.
             if self.peers_sent[peer_ip] > when:
@@ -348,28 +461,26 @@ class Mempool:
 
     def tx_to_send(self, peer_ip, peer_txs=None):
         """
-        Selects the Tx to be sent to a given peer
+        Selects the Tx to be sent to a given peer: the ones merged since the last send to that peer, by merge
+        sequence number - no clock involved. The peer is considered up to date once sent() is called.
         :param peer_ip:
+        :param peer_txs: txs the peer sent us, not sent back
         :return:
         """
         if DEBUG_DO_NOT_SEND_TX:
-            all = self.fetchall(SQL_SELECT_TX_TO_SEND)
+            all = self.store.to_send()
             tx_count = len(all)
             tx_list = [tx[1] + ' ' + tx[2] + ' : ' + str(tx[3]) for tx in all]
             # print("I have {} txs for {} but won't send: {}".format(tx_count, peer_ip, "\n".join(tx_list)))
             print("I have {} txs for {} but won't send".format(tx_count, peer_ip))
             return []
-        # Get our raw txs
-        if peer_ip not in self.peers_sent:
-            # new peer, never seen, send all
-            raw = self.fetchall(SQL_SELECT_TX_TO_SEND)
-        else:
-            # add some margin to account for tx in the future, 5 sec ?
-            last_sent = self.peers_sent[peer_ip] - 5
-            raw = self.fetchall(SQL_SELECT_TX_TO_SEND_SINCE, (last_sent,))
+        # Get our raw txs. New peer, never seen: 0, send all
+        raw, sequence = self.store.to_send_after(self.peers_sequence.get(peer_ip, 0))
+        with self.peers_lock:
+            self.peers_selected[peer_ip] = sequence
         # Now filter out the tx we got from the peer
         if peer_txs:
-            peers_sig = [tx[4] for tx in peer_txs]
+            peers_sig = {tx[4] for tx in peer_txs}
             # TEMP
             # print("raw for", peer_ip, len(raw))
             # print("peers_sig", peer_ip, len(peers_sig))
@@ -410,6 +521,88 @@ class Mempool:
         # Sorry, no space left for this tx type.
         return False
 
+    def precheck(self, transaction, time_now):
+        """
+        Checks of a received tx that need neither the mempool nor the ledger: format, addresses, age,
+        and what its signature check needs. Does not verify the signature itself, see verify_signatures.
+        :param transaction: legacy tx list
+        :param time_now: merge time reference
+        :return: MergeCandidate, its result set if rejected, its error set if the checks raised
+        """
+        candidate = MergeCandidate()
+        try:
+            candidate.timestamp = '%.2f' % (quantize_two(transaction[0]))
+            mempool_timestamp_float = float(transaction[0])  # limit Decimal where not needed
+            candidate.address = str(transaction[1])[:56]
+            candidate.recipient = str(transaction[2])[:56]
+            candidate.amount = '%.8f' % (quantize_eight(transaction[3]))  # convert scientific notation
+            mempool_amount_float = float(transaction[3])
+            candidate.signature = str(transaction[4])[:684]
+            candidate.public_key = str(transaction[5])[:1068]
+            if "b'" == candidate.public_key[:2]:
+                candidate.public_key = transaction[5][2:1070]
+            candidate.operation = str(transaction[6])[:30]
+            candidate.openfield = str(transaction[7])[:100000]
+
+            # Begin with the easy tests that do not require cpu or disk access
+            if mempool_amount_float < 0:
+                candidate.result = "Mempool: Negative balance spend attempt"
+            elif not essentials.address_validate(candidate.address):
+                candidate.result = "Mempool: Invalid address {}".format(candidate.address)
+            elif not essentials.address_validate(candidate.recipient):
+                candidate.result = "Mempool: Invalid recipient {}".format(candidate.recipient)
+            elif mempool_timestamp_float > time_now:
+                candidate.result = "Mempool: Future transaction rejected {}s".format(mempool_timestamp_float - time_now)
+            elif mempool_timestamp_float < time_now - REFUSE_OLDER_THAN:
+                # don't accept old txs, mempool needs to be harsher than ledger
+                candidate.result = "Mempool: Too old a transaction"
+            if candidate.result is not None:
+                return candidate
+
+            # Then more cpu heavy tests
+            hashed_address = hashlib.sha224(base64.b64decode(candidate.public_key)).hexdigest()
+            if candidate.address != hashed_address:
+                candidate.result = "Mempool: Attempt to spend from a wrong address {} instead of {}".format(
+                    candidate.address, hashed_address)
+                return candidate
+            # Crypto tests - more cpu hungry. A key that does not validate is reported, the key import decides.
+            try:
+                essentials.validate_pem(candidate.public_key)
+            except ValueError as e:
+                candidate.warning = "Mempool: Public key does not validate: {}".format(e)
+            try:
+                mempool_signature_dec = base64.b64decode(candidate.signature)
+                candidate.tx_signed = (candidate.timestamp, candidate.address, candidate.recipient, candidate.amount,
+                                       candidate.operation, candidate.openfield)
+                # Bin key, same cache keys as block validation
+                mempool_public_key_bin = Transaction.public_key_from_legacy(candidate.public_key)
+                candidate.signature_item = (mempool_signature_dec, mempool_public_key_bin,
+                                            str(candidate.tx_signed).encode("utf-8"), candidate.address)
+            except Exception as e:
+                candidate.result = "Mempool: Unexpected error checking sig: {}".format(e)
+        except Exception as e:
+            candidate.error = e
+        return candidate
+
+    def verify_signatures(self, candidates):
+        """
+        Verifies the signatures of the candidates not rejected yet, in one verifier call - a process pool.
+        Already verified signatures are skipped, new valid ones are added to the signature cache - unless their
+        address only matches the raw key, see ADDRESS_UNCHECKED: they are accepted, as before, but not cached.
+        :param candidates: MergeCandidate list, the result of the invalid ones is set
+        """
+        todo = [candidate for candidate in candidates if candidate.result is None and candidate.error is None]
+        for candidate, error in zip(todo, self.signature_verifier.verify(candidate.signature_item
+                                                                         for candidate in todo)):
+            if error is None or error[0] == ADDRESS_UNCHECKED:
+                continue
+            kind, reason = error
+            if kind == SIGNATURE_INVALID:
+                candidate.result = "Mempool: Wrong signature ({}) for data {} in mempool insert attempt".format(
+                    candidate.signature, candidate.tx_signed)
+            else:
+                candidate.result = "Mempool: Unexpected error checking sig: {}".format(reason)
+
     def merge(self, data, peer_ip, c, size_bypass=False, wait=False, revert=False):
         """
         Checks and merge the tx list in out mempool
@@ -460,8 +653,20 @@ class Mempool:
         mempool_result.append("Mempool merging started from {}".format(peer_ip))
         # Single time reference here for the whole merge.
         time_now = time.time()
-        # calculate current mempool size before adding txs
-        mempool_size = self.size()
+
+        block_list = data
+        try:
+            if not isinstance(block_list[0], list):  # convert to list of lists if only one tx and not handled
+                block_list = [block_list]
+            # The checks that need neither the mempool nor the ledger run for the whole batch first, out of the lock.
+            # Then the signatures of the txs still in are verified at once, by the verifier pool.
+            candidates = [self.precheck(transaction, time_now) for transaction in block_list]
+            self.verify_signatures(candidates)
+        except Exception as e:
+            self.app_log.warning("Mempool: Error processing: {} {}".format(data, e))
+            if self.config.debug_conf == 1:
+                raise
+            return mempool_result
 
         # TODO: we check main ledger db is not locked before beginning, but we don't lock? ok, see comment in node.py. since it's called from a lock, it would deadlock.
         # merge mempool
@@ -469,93 +674,56 @@ class Mempool:
         #    time.sleep(1)
         with self.lock:
             try:
-                block_list = data
-                if not isinstance(block_list[0], list):  # convert to list of lists if only one tx and not handled
-                    block_list = [block_list]
-
-                for transaction in block_list:
+                # calculate current mempool size before adding txs
+                mempool_size = self.size()
+                # Results in the same order, and with the same messages, as checking txs one at a time
+                for transaction, candidate in zip(block_list, candidates):
 
                     if size_bypass or self.space_left_for_tx(transaction, mempool_size):
                         # all transactions in the mempool need to be cycled to check for special cases,
                         # therefore no while/break loop here
-                        mempool_timestamp = '%.2f' % (quantize_two(transaction[0]))
-                        mempool_timestamp_float = float(transaction[0])  # limit Decimal where not needed
-                        mempool_address = str(transaction[1])[:56]
-                        mempool_recipient = str(transaction[2])[:56]
-                        mempool_amount = '%.8f' % (quantize_eight(transaction[3]))  # convert scientific notation
-                        mempool_amount_float = float(transaction[3])
-                        mempool_signature_enc = str(transaction[4])[:684]
-                        mempool_public_key_hashed = str(transaction[5])[:1068]
-                        if "b'" == mempool_public_key_hashed[:2]:
-                            mempool_public_key_hashed = transaction[5][2:1070]
-                        mempool_operation = str(transaction[6])[:30]
-                        mempool_openfield = str(transaction[7])[:100000]
-
-                        # Begin with the easy tests that do not require cpu or disk access
-                        if mempool_amount_float < 0:
-                            mempool_result.append("Mempool: Negative balance spend attempt")
-                            continue
-                        if not essentials.address_validate(mempool_address):
-                            mempool_result.append("Mempool: Invalid address {}".format(mempool_address))
-                            continue
-                        if not essentials.address_validate(mempool_recipient):
-                            mempool_result.append("Mempool: Invalid recipient {}".format(mempool_recipient))
-                            continue
-                        if mempool_timestamp_float > time_now:
-                            mempool_result.append("Mempool: Future transaction rejected {}s".
-                                                  format(mempool_timestamp_float - time_now))
-                            continue
-                        if mempool_timestamp_float < time_now - REFUSE_OLDER_THAN:
-                            # don't accept old txs, mempool needs to be harsher than ledger
-                            mempool_result.append("Mempool: Too old a transaction")
-                            continue
-
-                        # Then more cpu heavy tests
-                        hashed_address = hashlib.sha224(base64.b64decode(mempool_public_key_hashed)).hexdigest()
-                        if mempool_address != hashed_address:
-                            mempool_result.append("Mempool: Attempt to spend from a wrong address {} instead of {}"
-                                                  .format(mempool_address, hashed_address))
-                            continue
-                        # Crypto tests - more cpu hungry
-                        try:
-                            essentials.validate_pem(mempool_public_key_hashed)
-                        except ValueError as e:
-                            mempool_result.append("Mempool: Public key does not validate: {}".format(e))
-                        # recheck sig
-                        try:
-                            mempool_public_key = RSA.importKey(base64.b64decode(mempool_public_key_hashed))
-                            mempool_signature_dec = base64.b64decode(mempool_signature_enc)
-                            verifier = PKCS1_v1_5.new(mempool_public_key)
-                            tx_signed = (mempool_timestamp, mempool_address, mempool_recipient, mempool_amount,
-                                         mempool_operation, mempool_openfield)
-                            my_hash = SHA.new(str(tx_signed).encode("utf-8"))
-                            if not verifier.verify(my_hash, mempool_signature_dec):
-                                mempool_result.append("Mempool: Wrong signature ({}) for data {} in mempool insert attempt".
-                                                      format(mempool_signature_enc, tx_signed))
-                                continue
-                        except Exception as e:
-                            mempool_result.append("Mempool: Unexpected error checking sig: {}".format(e))
+                        if candidate.error is not None:
+                            raise candidate.error
+                        if candidate.warning is not None:
+                            mempool_result.append(candidate.warning)
+                        if candidate.result is not None:
+                            mempool_result.append(candidate.result)
                             continue
+                        mempool_timestamp = candidate.timestamp
+                        mempool_address = candidate.address
+                        mempool_recipient = candidate.recipient
+                        mempool_amount = candidate.amount
+                        mempool_signature_enc = candidate.signature
+                        mempool_public_key_hashed = candidate.public_key
+                        mempool_operation = candidate.operation
+                        mempool_openfield = candidate.openfield
 
                         # Only now, process the tests requiring db access
                         mempool_in = self.sig_check(mempool_signature_enc)
 
                         # Temp: get last block for HF reason
-                        essentials.execute_param_c(c, "SELECT block_height FROM transactions WHERE 1 ORDER by block_height DESC limit ?",
+                        # Its hash too: (height, hash) is the ledger tip cached balances are valid for.
+                        essentials.execute_param_c(c, "SELECT block_height, block_hash FROM transactions WHERE 1 ORDER by block_height DESC limit ?",
                                                    (1,), self.app_log)
-                        last_block = c.fetchone()[0]
+                        ledger_tip = tuple(c.fetchone())
+                        last_block = ledger_tip[0]
                         # reject transactions which are already in the ledger
                         # TODO: not clean, will need to have ledger as a module too.
-                        # TODO: need better txid index, this is very sloooooooow
-                        essentials.execute_param_c(c, "SELECT timestamp FROM transactions WHERE signature = ?",
-                                                   (mempool_signature_enc,), self.app_log)
-                        ledger_in = bool(c.fetchone())
+                        if self.signature_filter is not None:
+                            # ledger timestamp of the tx, or None. Uses the txid index on filter match.
+                            ledger_in = self.signature_filter.lookup(mempool_signature_enc)
+                        elif self.txid_index is not None:
+                            # ledger timestamp of the tx, or None
+                            ledger_in = self.txid_index.lookup(mempool_signature_enc)
+                        else:
+                            essentials.execute_param_c(c, "SELECT timestamp FROM transactions WHERE signature = ?",
+                                                       (mempool_signature_enc,), self.app_log)
+                            ledger_in = bool(c.fetchone())
                         # remove from mempool if it's in both ledger and mempool already
                         if mempool_in and ledger_in:
                             try:
                                 # Do not lock, we already have the lock for the whole merge.
-                                self.execute(SQL_DELETE_TX, (mempool_signature_enc,))
-                                self.commit()
+                                self.store.delete(mempool_signature_enc)
                                 mempool_result.append("Mempool: Transaction deleted from our mempool")
                             except:  # experimental try and except
                                 mempool_result.append("Mempool: Transaction was not present in the pool anymore")
@@ -582,63 +750,30 @@ class Mempool:
 
                         # verify balance
                         mempool_result.append("Mempool: Received address: {}".format(mempool_address))
-                        # include mempool fees
-                        result = self.fetchall("SELECT amount, openfield, operation FROM transactions WHERE address = ?",
-                                               (mempool_address,))
-                        debit_mempool = 0
-                        if result:
-                            for x in result:
-                                debit_tx = quantize_eight(x[0])
-                                fee = fee_calculate(x[1], x[2], last_block)
-                                debit_mempool = quantize_eight(debit_mempool + debit_tx + fee)
-
-                        credit = 0
-                        for entry in essentials.execute_param_c(c,
-                                                                "SELECT amount FROM transactions WHERE recipient = ?",
-                                                                (mempool_address,), self.app_log):
-                            credit = quantize_eight(credit) + quantize_eight(entry[0])
-
-                        debit_ledger = 0
-                        for entry in essentials.execute_param_c(c,
-                                                                "SELECT amount FROM transactions WHERE address = ?",
-                                                                (mempool_address,), self.app_log):
-                            debit_ledger = quantize_eight(debit_ledger) + quantize_eight(entry[0])
-                        debit = debit_ledger + debit_mempool
-
-                        fees = 0
-                        for entry in essentials.execute_param_c(c,
-                                                                "SELECT fee FROM transactions WHERE address = ?",
-                                                                (mempool_address,), self.app_log):
-                            fees = quantize_eight(fees) + quantize_eight(entry[0])
-
-                        rewards = 0
-                        for entry in essentials.execute_param_c(c,
-                                                                "SELECT sum(reward) FROM transactions WHERE recipient = ?",
-                                                                (mempool_address,), self.app_log):
-                            rewards = quantize_eight(rewards) + quantize_eight(entry[0])
-
-                        balance = quantize_eight(credit - debit - fees + rewards - quantize_eight(mempool_amount))
-                        balance_pre = quantize_eight(credit - debit_ledger - fees + rewards)
-
-                        fee = fee_calculate(mempool_openfield, mempool_operation, last_block)
-
-                        if quantize_eight(mempool_amount) > quantize_eight(balance_pre): #mp amount is already included in "balance" var! also, that tx might already be in the mempool
+                        # Ledger balance: a single lookup, cached until the ledger tip changes
+                        balance_pre = self.balance_cache.get(
+                            mempool_address, ledger_tip,
+                            None if self.balance_cache.lookup is not None else partial(self.ledger_balance, c))
+                        # Amounts and fees of the txs of that address already in the mempool, tracked by the store
+                        debit_mempool = self.store.pending_debit(mempool_address)
+                        amount = Transaction.f8_to_int(mempool_amount)
+                        fee = fee_calculate_int(mempool_openfield, mempool_operation, last_block)
+
+                        if amount > balance_pre:  # pending debits are only accounted for in the fee check
                             mempool_result.append("Mempool: Sending more than owned")
                             continue
-                        if quantize_eight(balance) - quantize_eight(fee) < 0:
+                        if balance_pre - debit_mempool - amount - fee < 0:
                             mempool_result.append("Mempool: Cannot afford to pay fees")
                             continue
 
                         # Pfew! we can finally insert into mempool - all is str, type converted and enforced above
-                        self.execute("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?)",
-                                     (mempool_timestamp, mempool_address, mempool_recipient, mempool_amount,
-                                      mempool_signature_enc, mempool_public_key_hashed, mempool_operation,
-                                      mempool_openfield, int(time_now)))
+                        self.store.insert((mempool_timestamp, mempool_address, mempool_recipient, mempool_amount,
+                                           mempool_signature_enc, mempool_public_key_hashed, mempool_operation,
+                                           mempool_openfield, int(time_now)))
                         mempool_result.append("Mempool updated with a received transaction from {}".format(peer_ip))
                         mempool_result.append("Success")
-                        self.commit()  # Save (commit) the changes to mempool db
 
-                        mempool_size += sys.getsizeof(str(transaction)) / 1000000.0
+                        mempool_size = self.size()
                     else:
                         mempool_result.append("Local mempool is already full for this tx type, skipping merging")
                         # self.app_log.warning("Local mempool is already full for this tx type, skipping merging")
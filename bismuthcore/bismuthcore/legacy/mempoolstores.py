@@ -0,0 +1,471 @@
+"""
+Mempool storage backends
+
+The Mempool checks and merges transactions, a store holds them. Rows are legacy mempool tuples:
+timestamp, address, recipient, amount, signature, public_key, operation, openfield - all str - and mergedts, int.
+
+SqliteMempoolStore is the historical SQL table, for the on disk mempool.db.
+MemoryMempoolStore is a native structure for the ram mempool: dict by signature, per address indexes
+and merge sequence numbers.
+Both keep the pending debit - amounts and fees of the txs in the mempool - of every sender, in integer units.
+Both stamp every insert with a strictly increasing sequence number: peers are sent the txs after the last one they got.
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from bismuthcore.helpers import fee_calculate_int
+from bismuthcore.transaction import Transaction
+from bismuthcore.txidindex import TxidSet
+
+__version__ = '0.0.4'
+
+
+# Create mempool table
+SQL_CREATE = "CREATE TABLE IF NOT EXISTS transactions (" \
+             "timestamp TEXT, address TEXT, recipient TEXT, amount TEXT, signature TEXT, " \
+             "public_key TEXT, operation TEXT, openfield TEXT, mergedts INTEGER)"
+
+# Signature lookups - checks, deletes and sequence selections - do not scan the table
+SQL_CREATE_SIGNATURE_INDEX = "CREATE INDEX IF NOT EXISTS signature_index ON transactions (signature)"
+
+SQL_INSERT = "INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?)"
+
+# Purge old txs that may be stuck
+SQL_PURGE = "DELETE FROM transactions WHERE timestamp <= strftime('%s', 'now', '-1 day')"
+
+# Delete all transactions
+SQL_CLEAR = "DELETE FROM transactions"
+
+# Check for presence of a given tx signature
+SQL_SIG_CHECK = 'SELECT timestamp FROM transactions WHERE signature = ?'
+
+# delete a single tx
+SQL_DELETE_TX = 'DELETE FROM transactions WHERE signature = ?'
+
+# Selects all tx from mempool - list fields so we don't send mergedts and keep compatibility
+SQL_SELECT_ALL_TXS = 'SELECT timestamp, address, recipient, amount, signature, public_key, operation, openfield FROM transactions'
+
+# Selects all tx signatures from mempool
+SQL_SELECT_ALL_SIGS = 'SELECT signature FROM transactions'
+
+# A single requets for status info
+SQL_STATUS = 'SELECT COUNT(*) AS nb, SUM(LENGTH(openfield)) AS len, COUNT(DISTINCT(address)) as senders, COUNT(DISTINCT(recipient)) as recipients FROM transactions'
+
+# Select Tx to be sent to a peer
+SQL_SELECT_TX_TO_SEND = 'SELECT * FROM transactions ORDER BY amount DESC'
+
+# Select Tx to be sent to a peer since the given ts - what counts is the merged time, not the tx time.
+SQL_SELECT_TX_TO_SEND_SINCE = 'SELECT * FROM transactions where mergedts > ? ORDER BY amount DESC'
+
+# Debits of an address
+SQL_ADDRESS_TXS = "SELECT amount, openfield, operation FROM transactions WHERE address = ?"
+
+# Select txs by signature, IN () chunks
+SQL_SELECT_SIGS = "SELECT * FROM transactions WHERE signature IN ({})"
+SIGS_CHUNK = 500
+
+# Purge age, in seconds
+PURGE_AGE = 24 * 60 * 60
+
+# Bytes per char, and sys.getsizeof() of a str with no chars, for every str storage kind: ascii, latin-1, ucs-2, ucs-4
+STR_KINDS = tuple((width, sys.getsizeof(sample) - width) for width, sample in
+                  ((1, 'a'), (1, '\xe9'), (2, '\u0100'), (4, '\U00010000')))
+
+
+def str_kind(text: str) -> int:
+    """Storage kind of a str, as an index in STR_KINDS"""
+    highest = ord(max(text)) if text else 0
+    return 0 if highest < 0x80 else 1 if highest < 0x100 else 2 if highest < 0x10000 else 3
+
+
+def row_debit(row: tuple) -> int:
+    """Amount and fee of a mempool tx, in integer units"""
+    return Transaction.f8_to_int(row[3]) + fee_calculate_int(row[7], row[6])
+
+
+def add_debit(debits: Dict[str, int], address: str, debit: int) -> None:
+    """Adds - or removes, if negative - a debit to the address pending total. Addresses with none are dropped."""
+    total = debits.get(address, 0) + debit
+    if total:
+        debits[address] = total
+    else:
+        del debits[address]
+
+
+class MempoolSize:
+    """Incremental sys.getsizeof(str(txs)), txs being the list of mempool txs without mergedts.
+
+    That is what Mempool.size() used to compute from all the txs. Kept exact: it counts the chars of every tx repr,
+    and how many txs need every str storage kind, since the widest one sets the bytes per char of the whole str.
+    """
+
+    __slots__ = ('count', 'chars', 'kinds')
+
+    def __init__(self):
+        self.count = 0
+        # Chars of the tx reprs
+        self.chars = 0
+        # Number of txs per str storage kind
+        self.kinds = [0] * len(STR_KINDS)
+
+    def add(self, row: tuple) -> None:
+        text = repr(tuple(row[:8]))
+        self.count += 1
+        self.chars += len(text)
+        self.kinds[str_kind(text)] += 1
+
+    def remove(self, row: tuple) -> None:
+        text = repr(tuple(row[:8]))
+        self.count -= 1
+        self.chars -= len(text)
+        self.kinds[str_kind(text)] -= 1
+
+    def clear(self) -> None:
+        self.count = 0
+        self.chars = 0
+        self.kinds = [0] * len(STR_KINDS)
+
+    @property
+    def bytes(self) -> int:
+        kind = max((kind for kind, count in enumerate(self.kinds) if count), default=0)
+        width, empty = STR_KINDS[kind]
+        # "[" + ", ".join(reprs) + "]"
+        length = 2 + self.chars + 2 * max(self.count - 1, 0)
+        return empty + width * length
+
+
+class SqliteMempoolStore:
+    """Mempool rows in the historical sqlite transactions table. Statements retry while the db is busy.
+
+    Signature checks go through an in memory TxidSet first, so most misses do not query the db.
+    Sequence numbers are kept in memory, signature -> sequence in merge order: txs found in the table at startup
+    are numbered in table order.
+    """
+
+    __slots__ = ('db', 'cursor', 'txids', 'lock', 'sequence', '_sequences', '_size', '_debits')
+
+    def __init__(self, db):
+        self.db = db
+        self.cursor = db.cursor()
+        self.cursor.execute(SQL_CREATE)
+        self.cursor.execute(SQL_CREATE_SIGNATURE_INDEX)
+        self.db.commit()
+        # Guards the sequence numbers, the db has its own locking
+        self.lock = threading.Lock()
+        # Last merge sequence number
+        self.sequence = 0
+        # Walked backwards by to_send_after: dict views are only reversible from python 3.8
+        self._sequences = OrderedDict()  # type: Dict[str, int]
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Signatures, size, pending debits and sequence numbers from the table,
+        for startup and after writes made to the table without the store"""
+        self._size = MempoolSize()
+        self._debits = {}
+        rows = self.txs()
+        for row in rows:
+            self._size.add(row)
+            add_debit(self._debits, row[1], row_debit(row))
+        self.txids = TxidSet(row[4] for row in rows)
+        with self.lock:
+            signatures = {row[4] for row in rows}
+            # Known txs keep their number, others are new
+            self._sequences = OrderedDict((signature, sequence) for signature, sequence in self._sequences.items()
+                                          if signature in signatures)
+            for row in rows:
+                if row[4] not in self._sequences:
+                    self.sequence += 1
+                    self._sequences[row[4]] = self.sequence
+
+    def _execute(self, sql: str, params: tuple=(), cursor=None):
+        cursor = self.cursor if cursor is None else cursor
+        while True:
+            try:
+                return cursor.execute(sql, params)
+            except sqlite3.OperationalError:
+                # Busy or locked
+                time.sleep(0.1)
+
+    def _fetchall(self, sql: str, params: tuple=()) -> list:
+        # Own cursor, so reads do not interfere with the shared one
+        return self._execute(sql, params, self.db.cursor()).fetchall()
+
+    def _commit(self) -> None:
+        while True:
+            try:
+                self.db.commit()
+                return
+            except sqlite3.OperationalError:
+                time.sleep(0.1)
+
+    def insert(self, row: tuple) -> None:
+        self._execute(SQL_INSERT, row)
+        self._commit()
+        self.txids.add(row[4])
+        self._size.add(row)
+        add_debit(self._debits, row[1], row_debit(row))
+        with self.lock:
+            self._sequences.pop(row[4], None)
+            self.sequence += 1
+            self._sequences[row[4]] = self.sequence
+
+    def contains(self, signature: str) -> bool:
+        if not self.txids.may_contain(signature):
+            return False
+        return bool(self._fetchall(SQL_SIG_CHECK, (signature, )))
+
+    def delete(self, signature: str) -> bool:
+        """True if the tx was there"""
+        if not self.txids.may_contain(signature):
+            return False
+        # Read before delete, for the size and debits
+        rows = self._fetchall(SQL_SELECT_ALL_TXS + " WHERE signature = ?", (signature, ))
+        self._execute(SQL_DELETE_TX, (signature, ))
+        self._commit()
+        for row in rows:
+            self.txids.discard(signature)
+            self._size.remove(row)
+            add_debit(self._debits, row[1], -row_debit(row))
+        if rows:
+            with self.lock:
+                self._sequences.pop(signature, None)
+        return bool(rows)
+
+    def clear(self) -> None:
+        self._execute(SQL_CLEAR)
+        self._commit()
+        self.txids.clear()
+        self._size.clear()
+        self._debits.clear()
+        with self.lock:
+            self._sequences.clear()
+
+    def purge(self) -> None:
+        """Drops txs older than PURGE_AGE"""
+        self._execute(SQL_PURGE)
+        self._commit()
+        # Purged txs are not known, rebuild.
+        self.rebuild()
+
+    def txs(self) -> List[tuple]:
+        """All txs, without mergedts"""
+        return self._fetchall(SQL_SELECT_ALL_TXS)
+
+    def status(self) -> tuple:
+        """(tx count, openfield total length, distinct senders, distinct recipients)"""
+        return self._fetchall(SQL_STATUS)[0]
+
+    def to_send(self, since: float=None) -> List[tuple]:
+        """Txs merged after since - all if None - by decreasing amount"""
+        if since is None:
+            return self._fetchall(SQL_SELECT_TX_TO_SEND)
+        return self._fetchall(SQL_SELECT_TX_TO_SEND_SINCE, (since, ))
+
+    def to_send_after(self, sequence: int) -> Tuple[List[tuple], int]:
+        """Txs merged after the sequence number, by decreasing amount then merge order, and the last sequence number.
+        Only the new txs are read."""
+        with self.lock:
+            sequences = {}
+            for signature in reversed(self._sequences):
+                tx_sequence = self._sequences[signature]
+                if tx_sequence <= sequence:
+                    break
+                sequences[signature] = tx_sequence
+            last = self.sequence
+        signatures = list(sequences)
+        rows = []
+        for index in range(0, len(signatures), SIGS_CHUNK):
+            chunk = signatures[index:index + SIGS_CHUNK]
+            rows.extend(self._fetchall(SQL_SELECT_SIGS.format(','.join('?' * len(chunk))), tuple(chunk)))
+        rows.sort(key=lambda row: (-Transaction.f8_to_int(row[3]), sequences[row[4]]))
+        return rows, last
+
+    def address_txs(self, address: str) -> List[tuple]:
+        """(amount, openfield, operation) of the txs sent by address"""
+        return self._fetchall(SQL_ADDRESS_TXS, (address, ))
+
+    def pending_debit(self, address: str) -> int:
+        """Amounts and fees of the txs sent by address, in integer units"""
+        return self._debits.get(address, 0)
+
+    def size(self) -> int:
+        """sys.getsizeof(str(self.txs())), see MempoolSize"""
+        return self._size.bytes
+
+    def vacuum(self) -> None:
+        self._execute("VACUUM")
+
+    def __len__(self) -> int:
+        return self.status()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class MempoolEntry:
+    """A mempool tx, its merge sequence number, int amount and int debit - amount and fee"""
+
+    __slots__ = ('row', 'sequence', 'amount', 'debit')
+
+    def __init__(self, row: tuple, sequence: int):
+        self.row = row
+        self.sequence = sequence
+        self.amount = Transaction.f8_to_int(row[3])
+        self.debit = self.amount + fee_calculate_int(row[7], row[6])
+
+
+class MemoryMempoolStore:
+    """Native in memory mempool store. Thread safe, every method holds the store lock for its own duration.
+
+    - txs: signature -> MempoolEntry, in merge order
+    - senders and recipients: address -> signatures, in merge order
+    - debits: address -> pending debit of its txs
+    Sequence numbers strictly increase with every insert, mergedts follows the merge clock.
+    """
+
+    __slots__ = ('lock', 'sequence', '_txs', '_senders', '_recipients', '_debits', '_openfield_length', '_size')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Last merge sequence number
+        self.sequence = 0
+        # In merge order, also walked backwards, see SqliteMempoolStore._sequences
+        self._txs = OrderedDict()  # type: Dict[str, MempoolEntry]
+        self._senders = {}  # type: Dict[str, Dict[str, None]]
+        self._recipients = {}  # type: Dict[str, Dict[str, None]]
+        self._debits = {}  # type: Dict[str, int]
+        self._openfield_length = 0
+        self._size = MempoolSize()
+
+    @staticmethod
+    def _index_add(index: Dict[str, Dict[str, None]], address: str, signature: str) -> None:
+        signatures = index.get(address)
+        if signatures is None:
+            index[address] = {signature: None}
+        else:
+            signatures[signature] = None
+
+    @staticmethod
+    def _index_remove(index: Dict[str, Dict[str, None]], address: str, signature: str) -> None:
+        signatures = index[address]
+        del signatures[signature]
+        if not signatures:
+            del index[address]
+
+    def insert(self, row: tuple) -> None:
+        """Adds a tx. A signature already there is replaced."""
+        signature = row[4]
+        with self.lock:
+            if signature in self._txs:
+                self._remove(signature)
+            self.sequence += 1
+            entry = MempoolEntry(tuple(row), self.sequence)
+            self._txs[signature] = entry
+            self._index_add(self._senders, row[1], signature)
+            self._index_add(self._recipients, row[2], signature)
+            add_debit(self._debits, row[1], entry.debit)
+            self._openfield_length += len(row[7])
+            self._size.add(row)
+
+    def _remove(self, signature: str) -> Optional[MempoolEntry]:
+        entry = self._txs.pop(signature, None)
+        if entry is not None:
+            row = entry.row
+            self._index_remove(self._senders, row[1], signature)
+            self._index_remove(self._recipients, row[2], signature)
+            add_debit(self._debits, row[1], -entry.debit)
+            self._openfield_length -= len(row[7])
+            self._size.remove(row)
+        return entry
+
+    def contains(self, signature: str) -> bool:
+        return signature in self._txs
+
+    def get(self, signature: str) -> Optional[tuple]:
+        entry = self._txs.get(signature)
+        return None if entry is None else entry.row
+
+    def delete(self, signature: str) -> bool:
+        """True if the tx was there"""
+        with self.lock:
+            return self._remove(signature) is not None
+
+    def clear(self) -> None:
+        with self.lock:
+            self._txs.clear()
+            self._senders.clear()
+            self._recipients.clear()
+            self._debits.clear()
+            self._openfield_length = 0
+            self._size.clear()
+
+    def purge(self) -> None:
+        """Drops txs older than PURGE_AGE"""
+        limit = time.time() - PURGE_AGE
+        with self.lock:
+            for signature in [signature for signature, entry in self._txs.items() if float(entry.row[0]) <= limit]:
+                self._remove(signature)
+
+    def txs(self) -> List[tuple]:
+        """All txs, without mergedts, in merge order"""
+        with self.lock:
+            return [entry.row[:8] for entry in self._txs.values()]
+
+    def status(self) -> tuple:
+        """(tx count, openfield total length, distinct senders, distinct recipients)"""
+        with self.lock:
+            count = len(self._txs)
+            # Same as the SQL SUM() of no rows
+            return count, self._openfield_length if count else None, len(self._senders), len(self._recipients)
+
+    def to_send(self, since: float=None) -> List[tuple]:
+        """Txs merged after since - all if None - by decreasing amount, then merge order"""
+        with self.lock:
+            entries = list(self._txs.values())
+        if since is not None:
+            entries = [entry for entry in entries if entry.row[8] > since]
+        entries.sort(key=lambda entry: (-entry.amount, entry.sequence))
+        return [entry.row for entry in entries]
+
+    def to_send_after(self, sequence: int) -> Tuple[List[tuple], int]:
+        """Txs merged after the sequence number, by decreasing amount then merge order, and the last sequence number.
+        Only the new txs are walked: entries are in merge order."""
+        with self.lock:
+            entries = []
+            for signature in reversed(self._txs):
+                entry = self._txs[signature]
+                if entry.sequence <= sequence:
+                    break
+                entries.append(entry)
+            last = self.sequence
+        entries.sort(key=lambda entry: (-entry.amount, entry.sequence))
+        return [entry.row for entry in entries], last
+
+    def address_txs(self, address: str) -> List[tuple]:
+        """(amount, openfield, operation) of the txs sent by address"""
+        with self.lock:
+            signatures = self._senders.get(address, ())
+            return [(row[3], row[7], row[6]) for row in (self._txs[signature].row for signature in signatures)]
+
+    def pending_debit(self, address: str) -> int:
+        """Amounts and fees of the txs sent by address, in integer units"""
+        return self._debits.get(address, 0)
+
+    def size(self) -> int:
+        """sys.getsizeof(str(self.txs())), see MempoolSize"""
+        return self._size.bytes
+
+    def vacuum(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._txs)
+
+    def close(self) -> None:
+        self.clear()
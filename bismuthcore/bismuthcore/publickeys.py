@@ -0,0 +1,72 @@
+"""
+Public keys deduplication table for the bin ledger format
+"""
+
+from sqlite3 import Binary
+
+from bismuthcore.helpers import LRUCache
+
+__version__ = '0.0.1'
+
+
+SQL_KEY_ID = "SELECT id FROM pubkeys WHERE public_key = ?"
+
+SQL_KEY_FROM_ID = "SELECT public_key FROM pubkeys WHERE id = ?"
+
+SQL_INSERT_KEY = "INSERT INTO pubkeys (public_key) VALUES (?)"
+
+
+class PublicKeyStore:
+    """Maps bin public keys to their compact integer id in the pubkeys table, and back.
+
+    Every public key is stored once in the ledger, transactions only hold its id - 0 for no public key.
+    A few active addresses send most of the transactions, so both ways go through an in memory LRU.
+    New keys are inserted in the current sql transaction of the db: call clear() if it's rolled back.
+    """
+
+    __slots__ = ('db', 'ids', 'keys')
+
+    def __init__(self, db, max_entries: int=10000):
+        self.db = db
+        # public_key -> id
+        self.ids = LRUCache(max_entries)
+        # id -> public_key
+        self.keys = LRUCache(max_entries)
+
+    def id_for(self, public_key: bytes) -> int:
+        """Id of the given public key, inserted in the pubkeys table if it's not there yet."""
+        if not public_key:
+            return 0
+        key_id = self.ids.get(public_key)
+        if key_id is not None:
+            return key_id
+        row = self.db.execute(SQL_KEY_ID, (Binary(public_key), )).fetchone()
+        if row:
+            key_id = row[0]
+        else:
+            key_id = self.db.execute(SQL_INSERT_KEY, (Binary(public_key), )).lastrowid
+        self._remember(bytes(public_key), key_id)
+        return key_id
+
+    def key_for(self, key_id: int) -> bytes:
+        """Public key matching the given id. Raises ValueError if unknown."""
+        if not key_id:
+            return b''
+        public_key = self.keys.get(key_id)
+        if public_key is not None:
+            return public_key
+        row = self.db.execute(SQL_KEY_FROM_ID, (key_id, )).fetchone()
+        if not row:
+            raise ValueError(f"Unknown public key id {key_id}")
+        public_key = bytes(row[0])
+        self._remember(public_key, key_id)
+        return public_key
+
+    def _remember(self, public_key: bytes, key_id: int) -> None:
+        self.ids.set(public_key, key_id)
+        self.keys.set(key_id, public_key)
+
+    def clear(self) -> None:
+        """Empties the in memory caches, to be called if the db transaction that inserted keys was rolled back."""
+        self.ids.clear()
+        self.keys.clear()
@@ -0,0 +1,298 @@
+"""
+Memory mapped segment files, for finalized - immutable - block ranges
+
+A segment is an append only data file of block records, and a fixed size height -> offset index file next to it.
+Block records are the binary wire format of TransactionsList.to_protobuf(), so reading a block only maps its pages:
+transactions are decoded one at a time, on access, through a read-only TransactionsList view.
+
+Data file: SEGMENT_HEADER, then for every block SEGMENT_RECORD (height, payload length) and the payload.
+Index file, path + '.idx': one SEGMENT_INDEX entry (height, record offset) per block, heights strictly increasing.
+"""
+
+import mmap
+import os
+import sys
+from bisect import bisect_left
+from struct import Struct
+from typing import Iterator, List, Union
+
+from bismuthcore.transaction import Transaction, WIRE_COUNT
+from bismuthcore.transactionslist import TransactionsList
+
+__version__ = '0.0.1'
+
+
+SEGMENT_MAGIC = b'BSG1'
+SEGMENT_HEADER = Struct('<4sB3x')
+SEGMENT_VERSION = 1
+SEGMENT_RECORD = Struct('<qI')
+SEGMENT_INDEX = Struct('<qQ')
+# Every wire transaction starts with its own record length
+WIRE_LENGTH = Struct('<I')
+
+
+def index_path(path: str) -> str:
+    return path + '.idx'
+
+
+class SegmentWriter:
+    """Appends blocks to a segment, creating it if needed.
+
+    A block record is written before its index entry, so a crash leaves at most a partial record or entry:
+    both are truncated away when the segment is opened again for writing.
+    """
+
+    __slots__ = ('path', 'last_height', 'count', '_data', '_index')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.last_height = None
+        self.count = 0
+        self._recover()
+        self._data = open(path, 'ab')
+        self._index = open(index_path(path), 'ab')
+        if self._data.tell() == 0:
+            self._data.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION))
+            self._data.flush()
+
+    def _recover(self) -> None:
+        """Drops the trailing record or index entry an interrupted append may have left"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < SEGMENT_HEADER.size:
+            # New segment, or one interrupted before its header was complete: header and index are written again
+            with open(self.path, 'wb'), open(index_path(self.path), 'wb'):
+                pass
+            return
+        if not os.path.exists(index_path(self.path)):
+            self._rebuild_index()
+        data_size = os.path.getsize(self.path)
+        end = SEGMENT_HEADER.size
+        valid = 0
+        with open(self.path, 'r+b') as data, open(index_path(self.path), 'r+b') as index:
+            Segment.check_header(data.read(SEGMENT_HEADER.size))
+            entries = index.read()
+            for position in range(len(entries) // SEGMENT_INDEX.size):
+                height, offset = SEGMENT_INDEX.unpack_from(entries, position * SEGMENT_INDEX.size)
+                data.seek(offset)
+                record = data.read(SEGMENT_RECORD.size)
+                if len(record) < SEGMENT_RECORD.size:
+                    break
+                record_height, length = SEGMENT_RECORD.unpack(record)
+                if record_height != height or offset + SEGMENT_RECORD.size + length > data_size:
+                    break
+                end = offset + SEGMENT_RECORD.size + length
+                valid += 1
+                self.last_height = height
+            index.truncate(valid * SEGMENT_INDEX.size)
+            if data_size > end:
+                data.truncate(end)
+        self.count = valid
+
+    def _rebuild_index(self) -> None:
+        """Writes the index of a data file back from its records, up to the first partial or out of order one"""
+        data_size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as data, open(index_path(self.path), 'wb') as index:
+            Segment.check_header(data.read(SEGMENT_HEADER.size))
+            offset = SEGMENT_HEADER.size
+            last_height = None
+            while True:
+                record = data.read(SEGMENT_RECORD.size)
+                if len(record) < SEGMENT_RECORD.size:
+                    break
+                height, length = SEGMENT_RECORD.unpack(record)
+                if offset + SEGMENT_RECORD.size + length > data_size or \
+                        (last_height is not None and height <= last_height):
+                    break
+                index.write(SEGMENT_INDEX.pack(height, offset))
+                last_height = height
+                offset += SEGMENT_RECORD.size + length
+                data.seek(offset)
+
+    def append(self, transactions: Union[TransactionsList, List[Transaction]], block_height: int=None) -> None:
+        """Appends a block. Its height defaults to the one of its last - mining - transaction."""
+        if not isinstance(transactions, TransactionsList):
+            transactions = TransactionsList(transactions)
+        if block_height is None:
+            block_height = transactions.transactions[-1].block_height
+        if self.last_height is not None and block_height <= self.last_height:
+            raise ValueError(f"Block {block_height} is not after the segment last block {self.last_height}")
+        payload = transactions.to_protobuf()
+        offset = self._data.tell()
+        self._data.write(SEGMENT_RECORD.pack(block_height, len(payload)))
+        self._data.write(payload)
+        self._data.flush()
+        self._index.write(SEGMENT_INDEX.pack(block_height, offset))
+        self.last_height = block_height
+        self.count += 1
+
+    def flush(self) -> None:
+        """Flushes and syncs both files to disk"""
+        for f in (self._data, self._index):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self) -> None:
+        if self._data is not None:
+            self.flush()
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+
+    def __enter__(self) -> "SegmentWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class SegmentTransactions:
+    """Transactions of a mapped segment range, decoded on access. Supports len(), indexing and iteration."""
+
+    __slots__ = ('_view', '_offsets')
+
+    def __init__(self, view: memoryview, offsets: List[int]):
+        self._view = view
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> Transaction:
+        return Transaction.unpack_from(self._view, self._offsets[index])[0]
+
+    def __iter__(self) -> Iterator[Transaction]:
+        view = self._view
+        for offset in self._offsets:
+            yield Transaction.unpack_from(view, offset)[0]
+
+
+class SegmentView(TransactionsList):
+    """Read-only TransactionsList over segment blocks. Queries, index and exports work as usual."""
+
+    __slots__ = ()
+
+    @property
+    def transactions(self) -> SegmentTransactions:
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, transactions) -> None:
+        raise TypeError("Segment views are read-only")
+
+    def append(self, transaction: Transaction) -> None:
+        raise TypeError("Segment views are read-only")
+
+    def extend(self, transactions) -> None:
+        raise TypeError("Segment views are read-only")
+
+
+class Segment:
+    """Read-only memory mapped segment. Views are valid until close()."""
+
+    __slots__ = ('path', '_data_file', '_data', '_view', '_index', '_entries', '_heights', '_offsets')
+
+    def __init__(self, path: str):
+        self.path = path
+        # Index first: records are written before their index entry, so the data mapped next covers them all
+        # even with a writer appending meanwhile.
+        with open(index_path(path), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size // SEGMENT_INDEX.size * SEGMENT_INDEX.size
+            self._index = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        self._data_file = open(path, 'rb')
+        self.check_header(self._data_file.read(SEGMENT_HEADER.size))
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._data)
+        index = self._index if self._index is not None else b''
+        if sys.byteorder == 'little':
+            self._entries = memoryview(index).cast('q')
+            # Strided views over the index entries: heights, and record offsets
+            self._heights = self._entries[0::2]
+            self._offsets = self._entries[1::2]
+        else:
+            # Little endian entries can not be cast in place: unpacked once
+            self._entries = None
+            entries = list(SEGMENT_INDEX.iter_unpack(index))
+            self._heights = [height for height, _ in entries]
+            self._offsets = [offset for _, offset in entries]
+
+    @staticmethod
+    def check_header(header: bytes) -> None:
+        if len(header) < SEGMENT_HEADER.size:
+            raise ValueError("Not a segment file")
+        magic, version = SEGMENT_HEADER.unpack(header)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError("Not a segment file")
+
+    def __len__(self) -> int:
+        """Number of blocks"""
+        return len(self._heights)
+
+    @property
+    def first_height(self) -> int:
+        return self._heights[0] if len(self._heights) else None
+
+    @property
+    def last_height(self) -> int:
+        return self._heights[-1] if len(self._heights) else None
+
+    def _position(self, height: int) -> int:
+        """Position of the block in the index, -1 if not in the segment"""
+        heights = self._heights
+        if not len(heights):
+            return -1
+        position = height - heights[0]
+        if not 0 <= position < len(heights) or heights[position] != height:
+            # Not a contiguous range
+            position = bisect_left(heights, height)
+            if position >= len(heights) or heights[position] != height:
+                return -1
+        return position
+
+    def __contains__(self, height: int) -> bool:
+        return self._position(height) >= 0
+
+    def _block_offsets(self, position: int, offsets: List[int]) -> None:
+        """Appends the offsets of the transactions of the block to offsets, without decoding them"""
+        view = self._view
+        record = self._offsets[position] + SEGMENT_RECORD.size
+        count, = WIRE_COUNT.unpack_from(view, record)
+        offset = record + WIRE_COUNT.size
+        for _ in range(count):
+            offsets.append(offset)
+            offset += WIRE_LENGTH.unpack_from(view, offset)[0]
+
+    def block(self, height: int) -> SegmentView:
+        """Transactions of a single block. Raises ValueError if the block is not in the segment."""
+        position = self._position(height)
+        if position < 0:
+            raise ValueError(f"Block {height} not in segment")
+        offsets = []
+        self._block_offsets(position, offsets)
+        return SegmentView(SegmentTransactions(self._view, offsets))
+
+    def blocks(self, start: int, end: int) -> SegmentView:
+        """Transactions of the blocks with start <= height < end"""
+        heights = self._heights
+        offsets = []
+        for position in range(bisect_left(heights, start), bisect_left(heights, end)):
+            self._block_offsets(position, offsets)
+        return SegmentView(SegmentTransactions(self._view, offsets))
+
+    def close(self) -> None:
+        """Views of the segment must not be used afterwards"""
+        if self._data is not None:
+            if self._entries is not None:
+                for view in (self._heights, self._offsets, self._entries):
+                    view.release()
+            self._view.release()
+            self._data.close()
+            if self._index is not None:
+                self._index.close()
+            self._data_file.close()
+            self._data = None
+
+    def __enter__(self) -> "Segment":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,221 @@
+"""
+Probabilistic membership filter over the ledger signatures
+
+Nearly every transaction relayed to a node is new, so the ledger signature lookup nearly always misses.
+A Bloom filter answers most of these "not in ledger" without touching the db.
+"""
+
+import math
+import os
+from hashlib import sha224
+from struct import Struct
+from typing import Iterable, Optional, Union
+
+from bismuthcore.transaction import Transaction
+from bismuthcore.txidindex import raw_signature
+
+__version__ = '0.0.1'
+
+
+# magic, hash count, size in bits, items count, removed items count, ledger height, block hash at that height
+FILE_HEADER = Struct('<4sBQQQq28s')
+
+FILE_MAGIC = b'BSF1'
+
+SQL_ALL_SIGNATURES = "SELECT signature FROM transactions"
+
+SQL_SIGNATURES_SINCE = "SELECT signature FROM transactions WHERE block_height > ? OR block_height < ?"
+
+SQL_COUNT_FROM_HEIGHT = "SELECT COUNT(*) FROM transactions WHERE block_height >= ? OR block_height <= ?"
+
+SQL_MAX_HEIGHT = "SELECT MAX(block_height) FROM transactions"
+
+SQL_BLOCK_HASH = "SELECT block_hash FROM transactions WHERE block_height = ? LIMIT 1"
+
+SQL_SIGNATURE = "SELECT timestamp FROM transactions WHERE signature = ?"
+
+
+class BloomFilter:
+    """Bit array Bloom filter over raw signatures.
+
+    Items can not be removed. remove() only counts them, so the expected false positive rate accounts for them:
+    rebuild the filter once too many items were removed.
+    """
+
+    __slots__ = ('size', 'hash_count', 'bits', 'count', 'removed')
+
+    def __init__(self, capacity: int=1000000, error_rate: float=0.001, size: int=0, hash_count: int=0):
+        """Sized for capacity items at error_rate, unless size (bits) and hash_count are given."""
+        if not size:
+            size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            hash_count = max(1, round(size / max(1, capacity) * math.log(2)))
+        self.size = size
+        self.hash_count = hash_count
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+        self.removed = 0
+
+    def _positions(self, item: bytes) -> Iterable[int]:
+        # Double hashing from a single digest
+        digest = sha224(item).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        size = self.size
+        return ((first + index * second) % size for index in range(self.hash_count))
+
+    def add(self, item: bytes) -> None:
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def remove(self, count: int=1) -> None:
+        """Records count items as gone from the set. They still test positive."""
+        self.removed += count
+
+    def __contains__(self, item: bytes) -> bool:
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def expected_false_positive_rate(self) -> float:
+        """Theoretical rate for the current fill, removed items counting as false positives."""
+        if not self.count:
+            return 0.0
+        rate = (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+        live = self.count - self.removed
+        # Out of the items that test positive, the removed ones are false positives too.
+        return min(1.0, rate + self.removed / max(1, live + self.removed) * (1 - rate))
+
+
+class SignatureFilter:
+    """Bloom filter over the signatures of a bin ledger - sqlite - db.
+
+    Built at startup - or loaded from disk then caught up with the ledger - and kept up to date
+    with digest() and rollback(). lookup() only queries the db if the filter says the signature may be there,
+    through the ledger TxidIndex if one is given.
+    """
+
+    __slots__ = ('db', 'txid_index', 'bloom', 'height', 'saved_hash', 'lookups', 'negatives', 'false_positives')
+
+    def __init__(self, db, bloom: BloomFilter=None, txid_index=None, height: int=0):
+        self.db = db
+        self.txid_index = txid_index
+        self.bloom = bloom if bloom is not None else BloomFilter()
+        # Last ledger height the filter accounts for
+        self.height = height
+        # Block hash at height when loaded from a file
+        self.saved_hash = bytes(28)
+        # Metrics
+        self.lookups = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    @classmethod
+    def build(cls, db, capacity: int=0, error_rate: float=0.001, txid_index=None) -> "SignatureFilter":
+        """Builds from all the ledger signatures, sized for twice the current ledger unless capacity is given."""
+        if not capacity:
+            capacity = 2 * db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        signature_filter = cls(db, BloomFilter(max(capacity, 1000), error_rate), txid_index)
+        for signature, in db.execute(SQL_ALL_SIGNATURES):
+            signature_filter.bloom.add(bytes(signature))
+        signature_filter.height = db.execute(SQL_MAX_HEIGHT).fetchone()[0] or 0
+        return signature_filter
+
+    @classmethod
+    def open(cls, db, path: str, error_rate: float=0.001, txid_index=None) -> "SignatureFilter":
+        """Loads the filter saved at path and catches up with the ledger, or builds it if it can not."""
+        try:
+            signature_filter = cls.load(db, path, txid_index)
+        except (OSError, ValueError):
+            return cls.build(db, error_rate=error_rate, txid_index=txid_index)
+        ledger_height = db.execute(SQL_MAX_HEIGHT).fetchone()[0] or 0
+        if ledger_height < signature_filter.height or signature_filter.block_hash() != signature_filter.saved_hash:
+            # The ledger was rolled back behind our back, we can't know what went away.
+            return cls.build(db, error_rate=error_rate, txid_index=txid_index)
+        height = signature_filter.height
+        for signature, in db.execute(SQL_SIGNATURES_SINCE, (height, -height)):
+            signature_filter.bloom.add(bytes(signature))
+        signature_filter.height = ledger_height
+        return signature_filter
+
+    @classmethod
+    def load(cls, db, path: str, txid_index=None) -> "SignatureFilter":
+        """Raises OSError if the file can't be read, ValueError if it is not a valid filter file."""
+        with open(path, 'rb') as fp:
+            header = fp.read(FILE_HEADER.size)
+            if len(header) != FILE_HEADER.size:
+                raise ValueError("Truncated signature filter file")
+            magic, hash_count, size, count, removed, height, block_hash = FILE_HEADER.unpack(header)
+            if magic != FILE_MAGIC:
+                raise ValueError("Not a signature filter file")
+            bloom = BloomFilter(size=size, hash_count=hash_count)
+            if fp.readinto(bloom.bits) != len(bloom.bits):
+                raise ValueError("Truncated signature filter file")
+        bloom.count = count
+        bloom.removed = removed
+        signature_filter = cls(db, bloom, txid_index, height)
+        signature_filter.saved_hash = block_hash
+        return signature_filter
+
+    def save(self, path: str) -> None:
+        """Atomically writes the filter to path"""
+        bloom = self.bloom
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as fp:
+            fp.write(FILE_HEADER.pack(FILE_MAGIC, bloom.hash_count, bloom.size, bloom.count, bloom.removed,
+                                      self.height, self.block_hash()))
+            fp.write(bloom.bits)
+        os.replace(temp_path, path)
+
+    def block_hash(self) -> bytes:
+        """Ledger block hash at the filter height, to tell on load if the ledger is still the one it was saved from."""
+        row = self.db.execute(SQL_BLOCK_HASH, (self.height, )).fetchone()
+        return bytes(row[0]).ljust(28, b'\x00') if row else bytes(28)
+
+    def digest(self, transactions: Iterable[Transaction], height: int=0) -> None:
+        """Adds the transactions of a digested block. Call before the block is committed."""
+        for transaction in transactions:
+            self.bloom.add(transaction.signature)
+        self.height = max(self.height, height)
+
+    def rollback(self, height: int) -> None:
+        """Accounts for the blocks from height on being removed. Call before they are deleted."""
+        removed = self.db.execute(SQL_COUNT_FROM_HEIGHT, (height, -height)).fetchone()[0]
+        self.bloom.remove(removed)
+        self.height = min(self.height, height - 1)
+
+    def lookup(self, signature: Union[str, bytes]) -> Optional[float]:
+        """Timestamp of the transaction with that signature in the ledger, None if there is none."""
+        raw = raw_signature(signature)
+        self.lookups += 1
+        if raw not in self.bloom:
+            self.negatives += 1
+            return None
+        if self.txid_index is not None:
+            timestamp = self.txid_index.lookup(raw)
+        else:
+            row = self.db.execute(SQL_SIGNATURE, (raw, )).fetchone()
+            timestamp = row[0] if row else None
+        if timestamp is None:
+            self.false_positives += 1
+        return timestamp
+
+    def __contains__(self, signature: Union[str, bytes]) -> bool:
+        return self.lookup(signature) is not None
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Observed rate: share of the signatures not in the ledger that still went to the db."""
+        misses = self.negatives + self.false_positives
+        return self.false_positives / misses if misses else 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {"items": self.bloom.count, "removed": self.bloom.removed, "bytes": len(self.bloom.bits),
+                "lookups": self.lookups, "db_skipped": self.negatives, "false_positives": self.false_positives,
+                "false_positive_rate": self.false_positive_rate,
+                "expected_false_positive_rate": self.bloom.expected_false_positive_rate}
@@ -0,0 +1,232 @@
+"""
+Parallel signature verification
+
+RSA signature checks dominate block digest time during sync. SignatureVerifier fans them out to a process pool.
+A transaction is also seen by the mempool before it lands in a block, and can be relayed again:
+SignatureCache remembers the signatures already verified so they are not checked twice.
+RSAKeyCache keeps the parsed keys of the few addresses that send most of the transactions.
+"""
+
+import os
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha224
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from Cryptodome.Hash import SHA
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Signature import PKCS1_v1_5
+from polysign.signer_rsa import SignerRSA
+from polysign.signerfactory import SignerFactory
+
+from bismuthcore.helpers import LRUCache, address_is_rsa
+from bismuthcore.transaction import Transaction
+
+__version__ = '0.0.4'
+
+
+# signature, public_key, buffer, address - all bin
+SignatureItem = Tuple[bytes, bytes, bytes, str]
+
+
+def signature_item(transaction: Transaction, buffer: bytes=None) -> SignatureItem:
+    """What needs to be sent to a worker to verify the signature of that transaction"""
+    if buffer is None:
+        buffer = transaction.to_buffer_for_signing()
+    return transaction.signature, transaction.public_key, buffer, transaction.address
+
+
+class RSAKeyCache:
+    """Bounded LRU of parsed RSA public keys: bin public key -> (verifier, address).
+
+    PEM parsing and key object construction are done once per key rather than once per signature.
+    Thread safe. Every process - pool workers included - has its own, see RSA_KEYS.
+    """
+
+    __slots__ = ('_cache', )
+
+    def __init__(self, max_entries: int=1000):
+        self._cache = LRUCache(max_entries)
+
+    def get(self, public_key: bytes) -> tuple:
+        """(PKCS1_v1_5 verifier, sha224 address) of the key. Raises ValueError if the key is not valid."""
+        entry = self._cache.get(public_key)
+        if entry is None:
+            # Same normalization as polysign, so addresses match
+            pem = SignerRSA.normalize_key(b64encode(public_key).decode('utf-8'))
+            SignerRSA.validate_pem(pem)
+            entry = (PKCS1_v1_5.new(RSA.importKey(pem)), sha224(pem.encode('utf-8')).hexdigest())
+            self._cache.set(bytes(public_key), entry)
+        return entry
+
+    def verify(self, signature: bytes, public_key: bytes, buffer: bytes, address: str) -> None:
+        """Same checks as SignerRSA.verify_bis_signature_raw. Returns None, raises ValueError if needed."""
+        verifier, key_address = self.get(public_key)
+        if not verifier.verify(SHA.new(buffer), signature):
+            raise ValueError(f"Invalid signature from {address}")
+        if address != key_address:
+            raise ValueError("Attempt to spend from a wrong address")
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    @property
+    def stats(self) -> dict:
+        return self._cache.stats
+
+
+# Process wide key cache, used by verify_signature
+RSA_KEYS = RSAKeyCache()
+
+
+def verify_signature(signature: bytes, public_key: bytes, buffer: bytes, address: str) -> None:
+    """Verifies a bin signature, RSA ones through RSA_KEYS. Returns None, raises ValueError if needed."""
+    if address_is_rsa(address):
+        RSA_KEYS.verify(signature, public_key, buffer, address)
+    else:
+        SignerFactory.verify_bis_signature_raw(signature, public_key, buffer, address)
+
+
+def verify_item(item: SignatureItem) -> Optional[str]:
+    """Verifies a single signature. Returns None if valid, the error message otherwise.
+    Runs in the pool workers, so it returns rather than raises."""
+    try:
+        verify_signature(*item)
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+    return None
+
+
+# verify_legacy_item results, besides None for a valid signature
+SIGNATURE_INVALID = 'signature'
+CHECK_ERROR = 'error'
+# Valid signature, but the sender is not the address of the normalized key, as verify_item requires:
+# accepted by the mempool, that checks the address on the raw key, and not cached for block validation.
+ADDRESS_UNCHECKED = 'address'
+
+
+def verify_legacy_item(item: SignatureItem) -> Optional[Tuple[str, str]]:
+    """The legacy mempool RSA check: key import, then the signature. The raw key address is checked apart,
+    beforehand, and so is the PEM - whose failure does not reject the tx.
+    Returns None if valid, otherwise (SIGNATURE_INVALID, ''), (ADDRESS_UNCHECKED, '') or (CHECK_ERROR, reason),
+    so the mempool keeps its own messages.
+    Only None results are cached, so a SignatureCache shared with block validation only holds what verify_item
+    would accept. Runs in the pool workers, so it returns rather than raises."""
+    try:
+        try:
+            verifier, key_address = RSA_KEYS.get(item[1])
+        except ValueError:
+            # Not a polysign valid key: imported as is, as the legacy mempool did, and never cached
+            verifier, key_address = PKCS1_v1_5.new(RSA.importKey(item[1])), None
+        if not verifier.verify(SHA.new(item[2]), item[0]):
+            return SIGNATURE_INVALID, ''
+    except Exception as e:
+        return CHECK_ERROR, str(e)
+    if item[3] != key_address:
+        return ADDRESS_UNCHECKED, ''
+    return None
+
+
+class SignatureCache:
+    """Bounded LRU set of verified signatures, shared by the mempool and block validation.
+
+    Entries are keyed by the signature, public key, buffer hash and address, hashed together to keep them small.
+    Only valid signatures are stored. Thread safe.
+    """
+
+    __slots__ = ('_cache', )
+
+    def __init__(self, max_entries: int=100000):
+        self._cache = LRUCache(max_entries)
+
+    @staticmethod
+    def key(item: SignatureItem) -> bytes:
+        signature, public_key, buffer, address = item
+        # Length prefixes so fields can not shift into each other
+        return sha224(len(signature).to_bytes(4, 'big') + signature + len(public_key).to_bytes(4, 'big')
+                      + public_key + sha224(buffer).digest() + address.encode('utf-8')).digest()
+
+    def verified(self, item: SignatureItem) -> bool:
+        """True if that signature was already verified. Counts hits and misses."""
+        return self._cache.get(self.key(item), False)
+
+    def add(self, item: SignatureItem) -> None:
+        """Records a signature that was verified as valid"""
+        self._cache.set(self.key(item), True)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def stats(self) -> dict:
+        """entries, max_entries, hits, misses and evictions counts"""
+        return self._cache.stats
+
+
+class SignatureVerifier:
+    """Verifies signatures with a pool of worker processes, results in submission order.
+
+    workers=0 uses all the cpus, workers=1 verifies in the calling process, without a pool.
+    The pool is started on first use and kept until close(), so it is to be created once and shared.
+    With a SignatureCache, already verified signatures are skipped and new valid ones are added to it.
+    function is the module level, picklable, check run on every item: verify_item, or verify_legacy_item.
+    """
+
+    __slots__ = ('workers', 'chunk_size', 'cache', 'function', '_executor')
+
+    def __init__(self, workers: int=0, chunk_size: int=8, cache: SignatureCache=None,
+                 function: Callable[[SignatureItem], Optional[str]]=verify_item):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        # Signatures sent to a worker at once, to amortize the inter process round trip.
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.function = function
+        self._executor = None
+
+    def verify(self, items: Iterable[SignatureItem]) -> List[Optional[str]]:
+        """Per item results: None if valid, the error - as returned by function - otherwise"""
+        items = list(items)
+        cache = self.cache
+        if cache is None:
+            return self._verify(items)
+        results = [None] * len(items)
+        todo = [index for index, item in enumerate(items) if not cache.verified(item)]
+        for index, error in zip(todo, self._verify([items[index] for index in todo])):
+            if error is None:
+                cache.add(items[index])
+            else:
+                results[index] = error
+        return results
+
+    def _verify(self, items: List[SignatureItem]) -> List[Optional[str]]:
+        if self.workers == 1 or len(items) < 2:
+            return [self.function(item) for item in items]
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(self.function, items, chunksize=self.chunk_size))
+
+    def verify_transactions(self, transactions: Iterable[Transaction]) -> List[Optional[str]]:
+        return self.verify([signature_item(transaction) for transaction in transactions])
+
+    def check(self, items: Iterable[SignatureItem]) -> None:
+        """Raises ValueError with the error of the first invalid signature, in items order"""
+        for error in self.verify(items):
+            if error is not None:
+                raise ValueError(error)
+
+    def check_transactions(self, transactions: Iterable[Transaction]) -> None:
+        self.check([signature_item(transaction) for transaction in transactions])
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "SignatureVerifier":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -15,7 +15,7 @@ from tornado.iostream import IOStream
 from tornado.tcpclient import TCPClient
 from tornado.tcpserver import TCPServer
 
-__version__ = '0.0.4'
+__version__ = '0.0.5'
 
 # Some systems do not support reuse_port
 REUSE_PORT = hasattr(socket, "SO_REUSEPORT")
@@ -256,3 +256,23 @@ class TornadoConnector(Connector):
                 self.stream = None
                 raise
         pass
+
+    async def send_legacy_blocks(self, transactions, address: str=None, recipient: str=None,
+                                 operation: str=None) -> bool:
+        """Streams the blocks dict json in chunks, same bytes as send_legacy(transactions.to_blocks_dict(...)).
+        The legacy header needs the length first, so the json is generated twice rather than held in memory.
+        The first pass keeps the memoized encodings for the second one, which frees them once written."""
+        if self.stream:
+            try:
+                length = 0
+                for chunk in transactions.iter_blocks_json(address, recipient, operation):
+                    length += len(chunk)
+                    # Let the loop serve other streams while measuring
+                    await asyncio.sleep(0)
+                await self.stream.write(str(length).encode("utf-8").zfill(10))
+                for chunk in transactions.iter_blocks_json(address, recipient, operation, clear_encoded=True):
+                    await self.stream.write(chunk.encode('utf-8'))
+            except Exception as e:
+                self.app_log.error(f"send_to_stream {e} for ip {self.ip}:{self.port}")
+                self.stream = None
+                raise
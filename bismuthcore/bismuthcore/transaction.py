@@ -5,19 +5,40 @@ Bismuth core transaction structure
 import json
 import os
 import sys
+from array import array
 from base64 import b64decode, b64encode
 from decimal import Decimal, getcontext, ROUND_HALF_EVEN
 from sqlite3 import Binary
+from struct import Struct
 from time import sleep
+from typing import Iterable, List, Tuple, Union
 
 from Cryptodome.Hash import SHA
 
 from bismuthcore.compat import quantize_two, quantize_eight
 
-__version__ = '0.0.12'
+__version__ = '0.0.17'
 
 # Multiplier to convert floats to int
 DECIMAL_1E8 = Decimal(100000000)
+K1E8 = 100000000
+
+# Largest int amount - exclusive - the fast converters handle. Above, Decimal precision could round.
+F8_MAX_INT = 10 ** 20
+# Longest "0.8f" string the fast converters parse.
+F8_MAX_LEN = 21
+
+# Binary wire format of a transaction, see Transaction.to_protobuf(). Little endian fixed size header:
+# record length (header included), block_height, timestamp, amount, fee, reward,
+# then byte lengths of address, recipient, signature, public_key, block_hash, operation, openfield.
+# Variable length fields follow, in that order, str fields utf-8 encoded.
+WIRE_HEADER = Struct('<IqdqqqHHHHHHI')
+# Longest address, recipient, signature, public_key, block_hash or operation the uint16 lengths allow
+WIRE_MAX_FIELD = 0xFFFF
+# Longest record the uint32 record length allows
+WIRE_MAX_RECORD = 0xFFFFFFFF
+# Count prefix of transactions or blocks lists
+WIRE_COUNT = Struct('<I')
 
 # Keys of the Json object
 TRANSACTION_KEYS = ('block_height', 'timestamp', 'address', 'recipient', 'amount', 'signature', 'public_key',
@@ -27,6 +48,67 @@ TRANSACTION_KEYS = ('block_height', 'timestamp', 'address', 'recipient', 'amount
 getcontext().rounding = ROUND_HALF_EVEN
 
 
+"""
+Amounts conversion
+"""
+
+
+def int_to_f8(an_int: int) -> str:
+    """Converts an int amount - inner format - to legacy string 0.8f.
+    Exact integer formatting, without Decimal, for the regular positive amounts.
+    Same result as f"{(Decimal(an_int) / DECIMAL_1E8):.8f}", which is still used for the other cases."""
+    if type(an_int) is int and 0 <= an_int < F8_MAX_INT:
+        return f"{an_int // K1E8}.{an_int % K1E8:08d}"
+    return f"{(Decimal(an_int) / DECIMAL_1E8):.8f}"
+
+
+def f8_to_int(a_str: str) -> int:
+    """Converts a legacy string 0.8f to compact int format.
+    Exact integer parsing, without Decimal, for the regular "x.xxxxxxxx" amounts.
+    Same result as int(Decimal(a_str) * DECIMAL_1E8), which - with its ROUND_HALF_EVEN context - is still used
+    for the other forms: less or more decimals, signs, exponents, spaces, floats."""
+    if type(a_str) is str:
+        if a_str[-9:-8] == '.' and len(a_str) <= F8_MAX_LEN:
+            digits = a_str.replace('.', '', 1)
+            if digits.isdecimal():
+                return int(digits)
+    elif type(a_str) is int and -F8_MAX_INT < a_str < F8_MAX_INT:
+        return a_str * K1E8
+    return int(Decimal(a_str) * DECIMAL_1E8)
+
+
+def int_to_f8_batch(ints: Iterable[int]) -> List[str]:
+    """Converts a whole column of int amounts to legacy strings. Same results as int_to_f8()"""
+    if not isinstance(ints, (list, tuple, array)):
+        ints = list(ints)
+    if ints and set(map(type, ints)) == {int} and min(ints) >= 0 and max(ints) < F8_MAX_INT:
+        # The whole column is in the fast range, convert without any per item check.
+        return [f"{an_int // K1E8}.{an_int % K1E8:08d}" for an_int in ints]
+    return [int_to_f8(an_int) for an_int in ints]
+
+
+def f8_to_int_batch(strs: Iterable[str]) -> List[int]:
+    """Converts a whole column of legacy string amounts to ints. Same results as f8_to_int()"""
+    if not isinstance(strs, (list, tuple)):
+        strs = list(strs)
+    if strs and set(map(type, strs)) == {str} and {a_str[-9:-8] for a_str in strs} == {'.'} \
+            and max(map(len, strs)) <= F8_MAX_LEN:
+        # The whole column is in the regular "x.xxxxxxxx" format, check all digits at once.
+        digits = [a_str.replace('.', '', 1) for a_str in strs]
+        if ''.join(digits).isdecimal():
+            return list(map(int, digits))
+    return [f8_to_int(a_str) for a_str in strs]
+
+
+def b64_str(data: bytes) -> str:
+    """b64 encoding, as str"""
+    return b64encode(data).decode('utf-8')
+
+
+def hex_str(data: bytes) -> str:
+    return data.hex()
+
+
 """
 Transaction
 """
@@ -38,7 +120,8 @@ class Transaction:
     # Inner storage is compact, binary form
 
     __slots__ = ('block_height', 'timestamp', 'address', 'recipient', 'amount', 'signature', 'public_key',
-                 'block_hash', 'fee', 'reward', 'operation', 'openfield', 'legacy_buffer', "temp_amount")
+                 'block_hash', 'fee', 'reward', 'operation', 'openfield', 'legacy_buffer', "temp_amount",
+                 '_signature_encoded', '_public_key_encoded', '_public_key_normalized', '_block_hash_hex')
 
     def __init__(self, block_height: int=0, timestamp: float=0, address: str='', recipient: str='',
                  amount: int=0, signature: bytes=b'', public_key: bytes=b'', block_hash: bytes=b'', fee: int=0,
@@ -57,8 +140,13 @@ class Transaction:
         self.reward = reward
         self.operation = operation
         self.openfield = openfield
-        self.legacy_buffer = legacy_buffer  # temp control v2 EGG_EVO
+        self.legacy_buffer = legacy_buffer  # temp control v2 EGG_EVO, None for wire decoded transactions
         self.temp_amount = temp_amount
+        # Memoized legacy encodings, as (bin source, encoded) tuples. See _encoded()
+        self._signature_encoded = None
+        self._public_key_encoded = None
+        self._public_key_normalized = None
+        self._block_hash_hex = None
         if sanitize:
             self._sanitize()
 
@@ -80,7 +168,7 @@ class Transaction:
     @staticmethod
     def int_to_f8(an_int: int) -> str:
         """Helper function to convert an int amount - inner format - to legacy string 0.8f """
-        return f"{(Decimal(an_int) / DECIMAL_1E8):.8f}"
+        return int_to_f8(an_int)
 
     @staticmethod
     def f8_to_int(a_str: str) -> int:
@@ -91,7 +179,7 @@ class Transaction:
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             print(exc_type, fname, exc_tb.tb_lineno)
             sleep(1)
-        return int(Decimal(a_str) * DECIMAL_1E8)
+        return f8_to_int(a_str)
 
     """
     Alternate constructors
@@ -135,26 +223,7 @@ class Transaction:
         legacy_buffer = str((f"{quantize_two(timestamp):0.2f}", address, recipient, f"{quantize_eight(amount):0.8f}",
                              operation, openfield)).encode("utf-8")
 
-        # public_key is double b64 encoded in legacy format.
-        # Could win even more storing the public_key decoded once more, but may generate more overhead at decode
-        # Postponed, since pubkeys do not need to be stored for every address every time
-        bin_public_key = b64decode(public_key[:1068]) if len(public_key) > 1 else b""
-        # print("bin public_key1", bin_public_key)
-        if len(bin_public_key) > 256:
-            # The previous decode attempt is not a reliable condition enough to detect an rsa sig.
-            # an ecdsa or ed25519 pubkey can be b64decodable...
-            try:
-                # RSA pubkeys
-                bin_public_key = bin_public_key.replace(b"\n-----END PUBLIC KEY-----", b"").replace(
-                    b"-----BEGIN PUBLIC KEY-----\n", b"")
-                # print("bin public_key2", bin_public_key)
-                bin_public_key = b64decode(bin_public_key[:1068])
-                # print("bin public_key3", bin_public_key)
-            except Exception:
-                pass
-        else:
-            # print("bin public_key4", bin_public_key)
-            pass
+        bin_public_key = cls.public_key_from_legacy(public_key)
         # signature is b64 encoded in legacy format.
         bin_signature = b64decode(signature[:684]) if len(signature) > 1 else b""
         # empty pubkey and signatures are stored as "0" and not "", why the len() > 1
@@ -229,12 +298,13 @@ class Transaction:
                    bin_block_hash, int_fee, int_reward, operation, openfield, sanitize)
 
     @classmethod
-    def from_v2(cls, tx: list, sanitize=False):
+    def from_v2(cls, tx: list, sanitize=False, public_keys=None):
         """
         Create from v2 - verbose - tuple/list.
         Call as tx = Transaction.from_v2(tx_list)
         If sanitize is False, then no check on fields len will take place.
         sanitize false is use for db reading, where data already has been sanitized at write time.
+        public_keys is the PublicKeyStore to resolve public keys ids with, for ledgers storing them deduplicated.
         """
         if len(tx) == 11:
             # tx list can omit the blockheight (like for mempool)
@@ -244,18 +314,54 @@ class Transaction:
          bin_public_key, bin_block_hash, int_fee, int_reward, operation, openfield) = tx
         # print("bin public_key3 v2", bin_public_key)
         # print("transaction.from v2", timestamp, type(timestamp))   # This is a float, good.
+        if public_keys is not None and type(bin_public_key) is int:
+            bin_public_key = public_keys.key_for(bin_public_key)
         return cls(block_height, timestamp, address, recipient, int_amount, bin_signature, bin_public_key,
                    bin_block_hash, int_fee, int_reward, operation, openfield, sanitize)
 
     @classmethod
-    def from_protobuf(cls, protobuf):
+    def from_protobuf(cls, protobuf: Union[bytes, bytearray, memoryview]):
         """
-        Create from a protobuf buffer.
+        Create from a binary wire buffer, as produced by to_protobuf().
         Call as tx = Transaction.from_protobuf(buffer)
+        Not an actual protobuf, but a length prefixed binary format. See WIRE_HEADER.
+        """
+        return cls.unpack_from(protobuf)[0]
+
+    @classmethod
+    def unpack_from(cls, buffer: Union[bytes, bytearray, memoryview], offset: int=0) -> Tuple["Transaction", int]:
+        """
+        Decodes a binary wire transaction at offset in the buffer, without copying the buffer.
+        Returns the transaction and the offset of the next record.
         """
-        raise AssertionError("TODO")
-        # TODO
-        return cls()
+        view = buffer if type(buffer) is memoryview else memoryview(buffer)
+        if offset + WIRE_HEADER.size > len(view):
+            raise ValueError("Truncated wire transaction header")
+        (record_length, block_height, timestamp, amount, fee, reward, address_length, recipient_length,
+         signature_length, public_key_length, block_hash_length, operation_length,
+         openfield_length) = WIRE_HEADER.unpack_from(view, offset)
+        end = offset + record_length
+        if end > len(view):
+            raise ValueError("Truncated wire transaction")
+        start = offset + WIRE_HEADER.size
+        address = str(view[start:start + address_length], 'utf-8')
+        start += address_length
+        recipient = str(view[start:start + recipient_length], 'utf-8')
+        start += recipient_length
+        signature = view[start:start + signature_length].tobytes()
+        start += signature_length
+        public_key = view[start:start + public_key_length].tobytes()
+        start += public_key_length
+        block_hash = view[start:start + block_hash_length].tobytes()
+        start += block_hash_length
+        operation = str(view[start:start + operation_length], 'utf-8')
+        start += operation_length
+        openfield = str(view[start:start + openfield_length], 'utf-8')
+        if start + openfield_length != end:
+            raise ValueError("Inconsistent wire transaction length")
+        # No legacy buffer to check the signing buffer against: None rather than b'', see Block.signature_items()
+        return cls(block_height, timestamp, address, recipient, amount, signature, public_key, block_hash,
+                   fee, reward, operation, openfield, sanitize=False, legacy_buffer=None), end
 
     @classmethod
     def from_json(cls, json_payload: str, sanitize=True):
@@ -333,21 +439,27 @@ class Transaction:
             if self.public_key == b"":
                 public_key = "0"  # Properly returns empty values, "0" to keep compatibility with legacy
             else:
-                public_key = b64encode(self.public_key).decode('utf-8')
+                public_key = None
                 if decode_pubkey:
                     try:
-                        public_key = b64decode(public_key).decode('utf-8')
+                        # Same as b64decode(b64encode(self.public_key)).decode('utf-8')
+                        public_key = self.public_key.decode('utf-8')
                     except Exception:
                         pass  # support new pubkey schemes
                 if normalize_pubkey and len(self.public_key) > 128:
                     # We have legacy rsa, renormalize and double encode
-                    public_key = b64encode(self.normalize_key(public_key).encode()).decode()
+                    if public_key is None:
+                        public_key = self.public_key_normalized
+                    else:
+                        public_key = b64encode(self.normalize_key(public_key).encode()).decode()
                     # public_key = self.normalize_key(public_key, glue="")
                     # non encoded, single line pubkey for json format.
                     # TODO: To Be confirmed for all cases - see test suite.
-            signature = b64encode(self.signature).decode('utf-8') if self.signature else ''
+                elif public_key is None:
+                    public_key = self.public_key_encoded
+            signature = self.signature_encoded if self.signature else ''
             # Properly returns empty values
-            block_hash = self.block_hash.hex()
+            block_hash = self.block_hash_hex
             return dict(zip(TRANSACTION_KEYS, (self.block_height, timestamp, self.address, self.recipient, amount,
                                                signature, public_key, block_hash, fee, reward,
                                                self.operation, self.openfield, 'Legacy')))
@@ -380,16 +492,13 @@ class Transaction:
             public_key = b''
             signature = b''
         else:
-            public_key = b64encode(self.public_key).decode('utf-8') if self.public_key else "0"
-            if len(self.public_key) > 128:
-                # We have legacy rsa, renormalize and double encode
-                public_key = b64encode(self.normalize_key(public_key).encode()).decode()
+            public_key = self.public_key_legacy
             # 0 to keep compatibility with legacy
-            signature = b64encode(self.signature).decode('utf-8') if self.signature else "0"
+            signature = self.signature_encoded if self.signature else "0"
         if simplified and self.block_height < 0:
             block_hash = b''
         else:
-            block_hash = self.block_hash.hex()
+            block_hash = self.block_hash_hex
         return (self.block_height, timestamp, self.address, self.recipient, amount, signature, public_key,
                 block_hash, fee, reward, self.operation, self.openfield)
 
@@ -402,15 +511,53 @@ class Transaction:
         chunks.append("-----END PUBLIC KEY-----")
         return glue.join(chunks)
 
+    @classmethod
+    def public_key_from_legacy(cls, public_key: str) -> bytes:
+        """Bin public key from its legacy tuple encoding. Reverse of public_key_to_legacy()"""
+        # public_key is double b64 encoded in legacy format.
+        # Could win even more storing the public_key decoded once more, but may generate more overhead at decode
+        # Postponed, since pubkeys do not need to be stored for every address every time
+        bin_public_key = b64decode(public_key[:1068]) if len(public_key) > 1 else b""
+        # print("bin public_key1", bin_public_key)
+        if len(bin_public_key) > 256:
+            # The previous decode attempt is not a reliable condition enough to detect an rsa sig.
+            # an ecdsa or ed25519 pubkey can be b64decodable...
+            try:
+                # RSA pubkeys
+                bin_public_key = bin_public_key.replace(b"\n-----END PUBLIC KEY-----", b"").replace(
+                    b"-----BEGIN PUBLIC KEY-----\n", b"")
+                # print("bin public_key2", bin_public_key)
+                bin_public_key = b64decode(bin_public_key[:1068])
+                # print("bin public_key3", bin_public_key)
+            except Exception:
+                pass
+        return bin_public_key
+
+    @classmethod
+    def public_key_to_legacy(cls, public_key: bytes) -> str:
+        """Legacy tuple encoding of a bin public key: b64, "0" if empty, normalized and double encoded if rsa."""
+        if not public_key:
+            # 0 to keep compatibility with legacy
+            return "0"
+        encoded = b64encode(public_key).decode('utf-8')
+        if len(public_key) > 128:
+            # We have legacy rsa, renormalize and double encode
+            encoded = b64encode(cls.normalize_key(encoded).encode()).decode()
+        return encoded
+
     def to_tuple_for_block_hash(self):
         # Needed for compatibility.
         # Block hash uses still another format for tx serialization.
-        public_key = b64encode(self.public_key).decode('utf-8') if self.public_key else "0"
         # 0 to keep compatibility with legacy
-        if len(public_key) > 128:  # RSA key, reformat - needed since part of block hash
-            public_key = b64encode(self.normalize_key(public_key).encode()).decode()
+        if not self.public_key:
+            public_key = "0"
+        elif len(self.public_key) > 96:
+            # b64 encoded len > 128: RSA key, reformat - needed since part of block hash
+            public_key = self.public_key_normalized
+        else:
+            public_key = self.public_key_encoded
         # TODO: make sure this is still ok for ecdsa and ed25519 (regnet, testnet)
-        signature = b64encode(self.signature).decode('utf-8') if self.signature else "0"
+        signature = self.signature_encoded if self.signature else "0"
         tuple_result = (f"{self.timestamp:.2f}", self.address, self.recipient, Transaction.int_to_f8(self.amount),
                         signature, public_key, self.operation, self.openfield)
         return tuple_result
@@ -425,28 +572,62 @@ class Transaction:
         """
         return buffer
 
-    def to_bin_tuple(self, sqlite_encode=False):
+    def to_bin_tuple(self, sqlite_encode=False, public_keys=None):
         """
         The transaction object as a bin tuple in the following order:
         'block_height', 'timestamp', 'address', 'recipient', 'amount', 'signature', 'public_key', 'block_hash',
         'fee', 'reward', 'operation', 'openfield'
 
         Bin format means amounts will be integers, and all content unencoded.
+        If a PublicKeyStore is given as public_keys, public_key is replaced by its id in the pubkeys table.
         """
+        if public_keys is not None:
+            public_key = public_keys.id_for(self.public_key)
+        elif sqlite_encode:
+            public_key = Binary(self.public_key)
+        else:
+            public_key = self.public_key
         if sqlite_encode:
             # sqlite needs .binary() to encode blobs
             return (self.block_height, self.timestamp, self.address, self.recipient, self.amount,
-                    Binary(self.signature), Binary(self.public_key), Binary(self.block_hash),
+                    Binary(self.signature), public_key, Binary(self.block_hash),
                     self.fee, self.reward, self.operation, self.openfield)
 
         return (self.block_height, self.timestamp, self.address, self.recipient, self.amount, self.signature,
-                self.public_key, self.block_hash, self.fee, self.reward, self.operation, self.openfield)
+                public_key, self.block_hash, self.fee, self.reward, self.operation, self.openfield)
 
-    def to_protobuf(self, buffer=None):
-        """Exports to protobuf
+    def to_protobuf(self, buffer: bytearray=None) -> Union[bytes, bytearray]:
+        """Exports to the binary wire format, see WIRE_HEADER.
+        If a bytearray buffer is given, the transaction is appended to it and the buffer is returned.
         """
-        raise AssertionError("TODO")
-        # TODO
+        address = self.address.encode('utf-8')
+        recipient = self.recipient.encode('utf-8')
+        operation = self.operation.encode('utf-8')
+        openfield = self.openfield.encode('utf-8')
+        for name, field in (('address', address), ('recipient', recipient), ('signature', self.signature),
+                            ('public_key', self.public_key), ('block_hash', self.block_hash),
+                            ('operation', operation)):
+            if len(field) > WIRE_MAX_FIELD:
+                raise ValueError("Wire {} too long: {} bytes, {} max".format(name, len(field), WIRE_MAX_FIELD))
+        record_length = WIRE_HEADER.size + len(address) + len(recipient) + len(self.signature) \
+            + len(self.public_key) + len(self.block_hash) + len(operation) + len(openfield)
+        if record_length > WIRE_MAX_RECORD:
+            raise ValueError("Wire transaction too long: {} bytes, {} max".format(record_length, WIRE_MAX_RECORD))
+        header = WIRE_HEADER.pack(record_length, self.block_height, self.timestamp, self.amount, self.fee,
+                                  self.reward, len(address), len(recipient), len(self.signature),
+                                  len(self.public_key), len(self.block_hash), len(operation), len(openfield))
+        if buffer is None:
+            return b''.join((header, address, recipient, self.signature, self.public_key, self.block_hash,
+                             operation, openfield))
+        buffer += header
+        buffer += address
+        buffer += recipient
+        buffer += self.signature
+        buffer += self.public_key
+        buffer += self.block_hash
+        buffer += operation
+        buffer += openfield
+        return buffer
 
     """
     Properties
@@ -486,6 +667,59 @@ class Transaction:
     def bis_reward(self) -> str:
         return self.int_to_f8(self.reward)
 
+    """
+    Memoized legacy encodings
+    """
+
+    @staticmethod
+    def _encoded(cached: tuple, source: bytes, encoder) -> tuple:
+        """Returns the (source, encoded) cache tuple, recomputed if the source field was reassigned since.
+        Bin fields are immutable bytes, and the cache holds a reference to its source: same object means same value.
+        Costs about 2 kB per memoized RSA transaction, use clear_encoded() to free.
+        """
+        if cached is None or cached[0] is not source:
+            cached = (source, encoder(source))
+        return cached
+
+    @property
+    def signature_encoded(self) -> str:
+        """b64 encoded signature"""
+        self._signature_encoded = self._encoded(self._signature_encoded, self.signature, b64_str)
+        return self._signature_encoded[1]
+
+    @property
+    def public_key_encoded(self) -> str:
+        """b64 encoded public key"""
+        self._public_key_encoded = self._encoded(self._public_key_encoded, self.public_key, b64_str)
+        return self._public_key_encoded[1]
+
+    @property
+    def public_key_normalized(self) -> str:
+        """Public key as legacy rsa, normalized pem then b64 encoded"""
+        cached = self._public_key_normalized
+        if cached is None or cached[0] is not self.public_key:
+            cached = (self.public_key, b64encode(self.normalize_key(b64_str(self.public_key)).encode()).decode())
+            self._public_key_normalized = cached
+        return self._public_key_normalized[1]
+
+    @property
+    def public_key_legacy(self) -> str:
+        """Public key as in legacy tuples, see public_key_to_legacy()"""
+        if not self.public_key:
+            return "0"
+        if len(self.public_key) > 128:
+            return self.public_key_normalized
+        return self.public_key_encoded
+
     @property
-    def signature_encoded(self):
-        return b64encode(self.signature).decode('utf-8')
+    def block_hash_hex(self) -> str:
+        """hex encoded block hash"""
+        self._block_hash_hex = self._encoded(self._block_hash_hex, self.block_hash, hex_str)
+        return self._block_hash_hex[1]
+
+    def clear_encoded(self) -> None:
+        """Frees the memoized encodings"""
+        self._signature_encoded = None
+        self._public_key_encoded = None
+        self._public_key_normalized = None
+        self._block_hash_hex = None
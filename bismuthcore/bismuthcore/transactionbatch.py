@@ -0,0 +1,167 @@
+"""
+Bismuth core TransactionBatch Class
+
+Columnar storage for large sets of transactions.
+"""
+
+from array import array
+from base64 import b64encode
+from typing import Iterable, Iterator, List
+
+from bismuthcore.transaction import Transaction, int_to_f8_batch
+
+__version__ = "0.0.2"
+
+# Numeric columns and the typecode of their array. Amounts are int64, timestamp is a double.
+NUMERIC_COLUMNS = (('block_height', 'q'), ('timestamp', 'd'), ('amount', 'q'), ('fee', 'q'), ('reward', 'q'))
+
+# Variable length columns, stored in offset indexed byte buffers. True for str fields, False for bytes fields.
+VARIABLE_COLUMNS = (('address', True), ('recipient', True), ('signature', False), ('public_key', False),
+                    ('block_hash', False), ('operation', True), ('openfield', True))
+
+
+class BytesColumn:
+    """Variable length values concatenated in a single buffer. Value i is buffer[offsets[i]:offsets[i + 1]]"""
+
+    __slots__ = ('buffer', 'offsets')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # One more offset than values, so every value has its start and end.
+        self.offsets = array('Q', [0])
+
+    def append(self, value: bytes) -> None:
+        self.buffer += value
+        self.offsets.append(len(self.buffer))
+
+    def set_all(self, value: bytes, count: int) -> None:
+        """Replaces the whole column by count times the same value"""
+        length = len(value)
+        self.buffer = bytearray(value * count)
+        self.offsets = array('Q', [length * index for index in range(count + 1)])
+
+    def __getitem__(self, index: int) -> bytearray:
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer) + self.offsets.itemsize * len(self.offsets)
+
+
+class TransactionBatch:
+    """A list of transactions, stored as columns rather than as Transaction objects.
+
+    Numeric fields are typed arrays, variable length fields are offset indexed byte buffers.
+    This avoids creating millions of objects - and the matching GC pressure - on sync or large imports.
+    Supports len(), indexing and iteration, so it can be used as the transactions of a TransactionsList or a Block:
+    transactions are then materialized one at a time, on access.
+    Temporary v2 control fields (legacy_buffer, temp_amount) are not stored.
+    """
+
+    __slots__ = ('block_height', 'timestamp', 'amount', 'fee', 'reward',
+                 'address', 'recipient', 'signature', 'public_key', 'block_hash', 'operation', 'openfield')
+
+    def __init__(self):
+        """Creates an empty batch"""
+        for name, typecode in NUMERIC_COLUMNS:
+            setattr(self, name, array(typecode))
+        for name, _ in VARIABLE_COLUMNS:
+            setattr(self, name, BytesColumn())
+
+    @classmethod
+    def from_transactions(cls, transactions: Iterable[Transaction]) -> "TransactionBatch":
+        """Builds a batch from Transaction instances"""
+        batch = cls()
+        batch.extend(transactions)
+        return batch
+
+    def append(self, transaction: Transaction) -> None:
+        self.block_height.append(transaction.block_height)
+        self.timestamp.append(transaction.timestamp)
+        self.amount.append(transaction.amount)
+        self.fee.append(transaction.fee)
+        self.reward.append(transaction.reward)
+        self.address.append(transaction.address.encode('utf-8'))
+        self.recipient.append(transaction.recipient.encode('utf-8'))
+        self.signature.append(transaction.signature)
+        self.public_key.append(transaction.public_key)
+        self.block_hash.append(transaction.block_hash)
+        self.operation.append(transaction.operation.encode('utf-8'))
+        self.openfield.append(transaction.openfield.encode('utf-8'))
+
+    def extend(self, transactions: Iterable[Transaction]) -> None:
+        for transaction in transactions:
+            self.append(transaction)
+
+    def to_transactions(self) -> List[Transaction]:
+        """Materializes all the transactions as a list of Transaction instances"""
+        return [self[index] for index in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.block_height)
+
+    def __getitem__(self, index: int) -> Transaction:
+        """Materializes a single Transaction"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TransactionBatch index out of range")
+        return Transaction(self.block_height[index], self.timestamp[index],
+                           self.address[index].decode('utf-8'), self.recipient[index].decode('utf-8'),
+                           self.amount[index], bytes(self.signature[index]), bytes(self.public_key[index]),
+                           bytes(self.block_hash[index]), self.fee[index], self.reward[index],
+                           self.operation[index].decode('utf-8'), self.openfield[index].decode('utf-8'),
+                           sanitize=False)
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_listoftuples(self, simplified=False) -> list:
+        """
+        The batch as a list of legacy tuples, same as Transaction.to_tuple() - built straight from the columns.
+        """
+        public_key_to_legacy = Transaction.public_key_to_legacy
+        # Amounts columns are converted at once
+        amounts = int_to_f8_batch(self.amount)
+        fees = int_to_f8_batch(self.fee)
+        rewards = int_to_f8_batch(self.reward)
+        result = []
+        for index in range(len(self)):
+            block_height = self.block_height[index]
+            if simplified:
+                public_key = b''
+                signature = b''
+            else:
+                public_key = public_key_to_legacy(self.public_key[index])
+                signature = self.signature[index]
+                # 0 to keep compatibility with legacy
+                signature = b64encode(signature).decode('utf-8') if signature else "0"
+            if simplified and block_height < 0:
+                block_hash = b''
+            else:
+                block_hash = self.block_hash[index].hex()
+            result.append((block_height, self.timestamp[index], self.address[index].decode('utf-8'),
+                           self.recipient[index].decode('utf-8'), amounts[index], signature,
+                           public_key, block_hash, fees[index], rewards[index],
+                           self.operation[index].decode('utf-8'), self.openfield[index].decode('utf-8')))
+        return result
+
+    def set_height(self, height: int) -> None:
+        self.block_height = array('q', [height] * len(self))
+
+    def set_hash(self, block_hash: bytes) -> None:
+        self.block_hash.set_all(block_hash, len(self))
+
+    def set_reward(self, reward: int) -> None:
+        """Reward of the last - mining - transaction"""
+        self.reward[-1] = reward
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the column buffers"""
+        total = sum(getattr(self, name).itemsize * len(getattr(self, name)) for name, _ in NUMERIC_COLUMNS)
+        return total + sum(getattr(self, name).nbytes for name, _ in VARIABLE_COLUMNS)
@@ -0,0 +1,92 @@
+"""
+Bismuth core lazy Transaction view over a ledger row
+"""
+
+from typing import Sequence
+
+from bismuthcore.transaction import Transaction
+
+__version__ = '0.0.1'
+
+
+def _column(position: int, doc: str) -> property:
+    return property(lambda self: self._row[position], doc=doc)
+
+
+class TransactionRow:
+    """Read-only view of a bin - v2 - ledger row, with the read API of Transaction.
+
+    Transaction.from_v2 copies the 12 columns into a Transaction. This keeps the row - tuple or sqlite3.Row - as is,
+    and reads fields from it on access: scans only needing a couple of fields skip building full objects.
+    Timestamp conversion and public key id resolution only happen when the field is read.
+    Use to_transaction() to get a regular, mutable, Transaction.
+    """
+
+    __slots__ = ('_row', '_public_keys',
+                 '_signature_encoded', '_public_key_encoded', '_public_key_normalized', '_block_hash_hex')
+
+    def __init__(self, row: Sequence, public_keys=None):
+        """row as read from the transactions table. A mempool like row without block height is accepted.
+        public_keys is the PublicKeyStore to resolve public keys ids with, for ledgers storing them deduplicated."""
+        if len(row) == 11:
+            row = (0, *row)
+        self._row = row
+        self._public_keys = public_keys
+        self._signature_encoded = None
+        self._public_key_encoded = None
+        self._public_key_normalized = None
+        self._block_hash_hex = None
+
+    block_height = _column(0, "Block height")
+    address = _column(2, "Sender address")
+    recipient = _column(3, "Recipient address")
+    amount = _column(4, "Amount, as int")
+    signature = _column(5, "Bin signature")
+    block_hash = _column(7, "Bin block hash")
+    fee = _column(8, "Fee, as int")
+    reward = _column(9, "Reward, as int")
+    operation = _column(10, "Operation")
+    openfield = _column(11, "Openfield")
+
+    @property
+    def timestamp(self) -> float:
+        return float(self._row[1])
+
+    @property
+    def public_key(self) -> bytes:
+        public_key = self._row[6]
+        if self._public_keys is not None and type(public_key) is int:
+            return self._public_keys.key_for(public_key)
+        return public_key
+
+    # Control fields of v2 decoded transactions, never set for ledger rows
+    legacy_buffer = b''
+    temp_amount = ''
+
+    def to_transaction(self) -> Transaction:
+        """Materializes the row as a regular Transaction"""
+        return Transaction.from_v2(list(self._row), public_keys=self._public_keys)
+
+    # Same read API as Transaction: its exporters and properties only use the fields above.
+    # Static methods are taken from the class dict, so they stay static.
+    int_to_f8 = vars(Transaction)['int_to_f8']
+    _encoded = vars(Transaction)['_encoded']
+    normalize_key = Transaction.normalize_key
+    to_dict = Transaction.to_dict
+    to_json = Transaction.to_json
+    to_tuple = Transaction.to_tuple
+    to_tuple_for_block_hash = Transaction.to_tuple_for_block_hash
+    to_buffer_for_signing = Transaction.to_buffer_for_signing
+    to_bin_tuple = Transaction.to_bin_tuple
+    to_protobuf = Transaction.to_protobuf
+    is_mining = Transaction.is_mining
+    checksum = Transaction.checksum
+    bis_amount = Transaction.bis_amount
+    bis_fee = Transaction.bis_fee
+    bis_reward = Transaction.bis_reward
+    signature_encoded = Transaction.signature_encoded
+    public_key_encoded = Transaction.public_key_encoded
+    public_key_normalized = Transaction.public_key_normalized
+    public_key_legacy = Transaction.public_key_legacy
+    block_hash_hex = Transaction.block_hash_hex
+    clear_encoded = Transaction.clear_encoded
@@ -3,22 +3,194 @@
 Bismuth core Block Class
 """
 
-from bismuthcore.transaction import Transaction
-from typing import List
+import json
+from bisect import bisect_left
+from heapq import merge
+from bismuthcore.transaction import Transaction, WIRE_COUNT
+from bismuthcore.transactionbatch import TransactionBatch
+from typing import Dict, Iterable, Iterator, List, TextIO, Union
 
-__version__ = "0.0.1"
+__version__ = "0.0.5"
+
+
+class TransactionsIndex:
+    """Positions of the transactions of a list, by sender address, by recipient and by operation.
+    Position lists are in increasing order."""
+
+    __slots__ = ('size', 'address', 'recipient', 'operation', '_operations')
+
+    def __init__(self, transactions: Union[List[Transaction], TransactionBatch]):
+        self.size = len(transactions)
+        self.address = {}  # type: Dict[str, List[int]]
+        self.recipient = {}  # type: Dict[str, List[int]]
+        self.operation = {}  # type: Dict[str, List[int]]
+        if isinstance(transactions, TransactionBatch):
+            # Straight from the columns, no Transaction object involved.
+            columns = ((transactions.address[i].decode('utf-8'), transactions.recipient[i].decode('utf-8'),
+                        transactions.operation[i].decode('utf-8')) for i in range(self.size))
+        else:
+            columns = ((transaction.address, transaction.recipient, transaction.operation)
+                       for transaction in transactions)
+        for position, (address, recipient, operation) in enumerate(columns):
+            self.address.setdefault(address, []).append(position)
+            self.recipient.setdefault(recipient, []).append(position)
+            self.operation.setdefault(operation, []).append(position)
+        # Distinct operations, sorted so a prefix matches a contiguous range
+        self._operations = sorted(self.operation)
+
+    def operation_prefix(self, prefix: str) -> List[int]:
+        """Positions of the transactions which operation starts with prefix"""
+        operations = self._operations
+        matches = []
+        for position in range(bisect_left(operations, prefix), len(operations)):
+            if not operations[position].startswith(prefix):
+                break
+            matches.append(self.operation[operations[position]])
+        if len(matches) == 1:
+            return matches[0]
+        return list(merge(*matches))
+
+    def involving(self, address: str) -> List[int]:
+        """Positions of the transactions sent or received by address"""
+        positions = []
+        for position in merge(self.address.get(address, []), self.recipient.get(address, [])):
+            # Transactions to self are in both lists
+            if not positions or positions[-1] != position:
+                positions.append(position)
+        return positions
 
 
 class TransactionsList:
-    """A generic list of transactions, from one or more blocks."""
+    """A generic list of transactions, from one or more blocks.
+
+    Address, recipient and operation queries go through a TransactionsIndex, built on first query.
+    Assigning transactions, append() and extend() drop it. If the inner list is changed in place otherwise,
+    call invalidate_index(). A length change alone is detected.
+    """
 
     # Inner storage is compact, binary form
-    __slots__ = ('transactions', )
+    __slots__ = ('_transactions', '_index')
 
-    def __init__(self, transactions: List[Transaction]):
+    def __init__(self, transactions: Union[List[Transaction], TransactionBatch]):
         """Default constructor with list of binary, non verbose,
-        Transactions instances, mining transaction at the end."""
-        self.transactions = transactions
+        Transactions instances, mining transaction at the end.
+        A columnar TransactionBatch can be used instead of the list."""
+        self._transactions = transactions
+        self._index = None
+
+    @property
+    def transactions(self) -> Union[List[Transaction], TransactionBatch]:
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, transactions: Union[List[Transaction], TransactionBatch]) -> None:
+        self._transactions = transactions
+        self._index = None
+
+    def append(self, transaction: Transaction) -> None:
+        self._transactions.append(transaction)
+        self._index = None
+
+    def extend(self, transactions: Iterable[Transaction]) -> None:
+        self._transactions.extend(transactions)
+        self._index = None
+
+    def invalidate_index(self) -> None:
+        """To be called after the transactions were modified in place"""
+        self._index = None
+
+    @property
+    def index(self) -> TransactionsIndex:
+        """The address, recipient and operation index, built on first use"""
+        if self._index is None or self._index.size != len(self._transactions):
+            self._index = TransactionsIndex(self._transactions)
+        return self._index
+
+    def positions(self, address: str=None, recipient: str=None, operation: str=None) -> List[int]:
+        """Increasing positions of the transactions matching all the given criteria:
+        sender address, recipient, and operation prefix. No criteria matches all transactions."""
+        candidates = []
+        index = self.index
+        if address is not None:
+            candidates.append(index.address.get(address, []))
+        if recipient is not None:
+            candidates.append(index.recipient.get(recipient, []))
+        if operation is not None:
+            candidates.append(index.operation_prefix(operation))
+        if not candidates:
+            return list(range(len(self._transactions)))
+        if len(candidates) == 1:
+            return list(candidates[0])
+        # Checks the other criteria on the smallest candidates list only
+        positions = min(candidates, key=len)
+        transactions = self._transactions
+        result = []
+        for position in positions:
+            transaction = transactions[position]
+            if (address is None or transaction.address == address) \
+                    and (recipient is None or transaction.recipient == recipient) \
+                    and (operation is None or transaction.operation.startswith(operation)):
+                result.append(position)
+        return result
+
+    def _selected(self, address: str=None, recipient: str=None, operation: str=None) -> Iterable[Transaction]:
+        """The transactions matching the criteria, in order"""
+        if address is None and recipient is None and operation is None:
+            return self._transactions
+        transactions = self._transactions
+        return (transactions[position] for position in self.positions(address, recipient, operation))
+
+    def filter(self, address: str=None, recipient: str=None, operation: str=None) -> "TransactionsList":
+        """A new TransactionsList with the transactions matching all the given criteria, see positions()"""
+        transactions = self._transactions
+        return TransactionsList([transactions[position]
+                                 for position in self.positions(address, recipient, operation)])
+
+    def involving(self, address: str) -> "TransactionsList":
+        """A new TransactionsList with the transactions sent or received by address"""
+        transactions = self._transactions
+        return TransactionsList([transactions[position] for position in self.index.involving(address)])
+
+    @classmethod
+    def from_batch(cls, batch: TransactionBatch):
+        """Materializes a TransactionBatch as a list of Transaction instances"""
+        return cls(batch.to_transactions())
+
+    def to_batch(self) -> TransactionBatch:
+        """Columnar copy of the transactions"""
+        if isinstance(self.transactions, TransactionBatch):
+            return self.transactions
+        return TransactionBatch.from_transactions(self.transactions)
+
+    @classmethod
+    def from_protobuf(cls, protobuf: Union[bytes, bytearray, memoryview]):
+        """Create from a binary wire buffer, as produced by to_protobuf()"""
+        return cls.unpack_from(protobuf)[0]
+
+    @classmethod
+    def unpack_from(cls, buffer: Union[bytes, bytearray, memoryview], offset: int=0) -> tuple:
+        """Decodes binary wire transactions at offset in the buffer, without copying the buffer.
+        Returns the instance and the offset of the next record."""
+        view = buffer if type(buffer) is memoryview else memoryview(buffer)
+        if offset + WIRE_COUNT.size > len(view):
+            raise ValueError("Truncated wire transactions count")
+        count, = WIRE_COUNT.unpack_from(view, offset)
+        offset += WIRE_COUNT.size
+        transactions = []
+        for _ in range(count):
+            transaction, offset = Transaction.unpack_from(view, offset)
+            transactions.append(transaction)
+        return cls(transactions), offset
+
+    def to_protobuf(self, buffer: bytearray=None) -> bytearray:
+        """Exports all the transactions to the binary wire format: count, then transactions.
+        Encodes in a single buffer. If a bytearray buffer is given, appends to it."""
+        if buffer is None:
+            buffer = bytearray()
+        buffer += WIRE_COUNT.pack(len(self.transactions))
+        for transaction in self.transactions:
+            transaction.to_protobuf(buffer)
+        return buffer
 
     def to_listofdicts(self, legacy: bool=False, decode_pubkey: bool=False) -> list:
         """
@@ -36,18 +208,22 @@ class TransactionsList:
         The block as a list of Transactions, converted to legacy tuples.
         :return:
         """
+        if isinstance(self.transactions, TransactionBatch):
+            # Straight from the columns, no Transaction object involved.
+            return self.transactions.to_listoftuples(simplified=simplified)
         return [transaction.to_tuple(simplified=simplified) for transaction in self.transactions]
 
-    def to_blocks_dict(self) -> dict:
+    def to_blocks_dict(self, address: str=None, recipient: str=None, operation: str=None) -> dict:
         """a Block instance can also be a list of transactions from several different blocks.
-        This formatter - ported from ApiHandler - does convert to a dict, heights as key"""
+        This formatter - ported from ApiHandler - does convert to a dict, heights as key.
+        Optional criteria - see positions() - only keep the matching transactions, through the index."""
         # This is a specific format which use and specifics should be documented.
         tx_list = []
         block = {}
         blocks = {}
         # Egg: mostly kept the previous logic
         old = None
-        for transaction_object in self.transactions:
+        for transaction_object in self._selected(address, recipient, operation):
             transaction = transaction_object.to_dict(legacy=True, decode_pubkey=True)
             height = transaction['block_height']
             block_hash = transaction['block_hash']
@@ -65,3 +241,60 @@ class TransactionsList:
             old = height  # update
         return blocks
 
+    def iter_blocks_json(self, address: str=None, recipient: str=None, operation: str=None,
+                         chunk_size: int=65536, clear_encoded: bool=False) -> Iterator[str]:
+        """Streams json.dumps(self.to_blocks_dict(...)) as str chunks of about chunk_size chars, without building
+        the dicts: memory use only depends on the number of blocks, not of transactions.
+        Transactions memoize their encoded fields, as with to_dict(). clear_encoded frees them once written,
+        for lists serialized once."""
+        runs = []
+        old = None
+        # Pre pass: height, hash of the last tx and tx count of every block run.
+        for transaction in self._selected(address, recipient, operation):
+            height = transaction.block_height
+            if old != height:
+                runs.append([height, None, 0])
+                old = height
+            runs[-1][1] = transaction.block_hash
+            runs[-1][2] += 1
+        if len(runs) != len(set(run[0] for run in runs)):
+            # A height split in several runs: to_blocks_dict only keeps the last one, at the place of the first.
+            # Not a ledger order, not worth streaming.
+            yield json.dumps(self.to_blocks_dict(address, recipient, operation))
+            return
+        dumps = json.dumps
+        transactions = iter(self._selected(address, recipient, operation))
+        chunk = ['{']
+        size = 1
+        for number, (height, block_hash, count) in enumerate(runs):
+            # Same layout and key order as to_blocks_dict
+            part = f'{", " if number else ""}{dumps(str(height))}: {{"block_height": {dumps(height)}, ' \
+                   f'"block_hash": {dumps(block_hash.hex())}, "transactions": ['
+            chunk.append(part)
+            size += len(part)
+            for position in range(count):
+                transaction = next(transactions)
+                tx_dict = transaction.to_dict(legacy=True, decode_pubkey=True)
+                del tx_dict['block_height']
+                del tx_dict['block_hash']
+                part = dumps(tx_dict) if position == 0 else ', ' + dumps(tx_dict)
+                if clear_encoded:
+                    transaction.clear_encoded()
+                chunk.append(part)
+                size += len(part)
+                if size >= chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+            chunk.append(']}')
+        chunk.append('}')
+        yield ''.join(chunk)
+
+    def write_blocks_json(self, stream: TextIO, address: str=None, recipient: str=None, operation: str=None,
+                          chunk_size: int=65536, clear_encoded: bool=False) -> int:
+        """Writes the to_blocks_dict() json to a text stream, see iter_blocks_json(). Returns the written length."""
+        length = 0
+        for chunk in self.iter_blocks_json(address, recipient, operation, chunk_size, clear_encoded):
+            stream.write(chunk)
+            length += len(chunk)
+        return length
@@ -0,0 +1,123 @@
+"""
+Compact transaction id index
+
+A txid is the first 8 bytes of the sha224 of the raw signature, as a signed int64 so it fits a sqlite INTEGER.
+Looking up an integer is far cheaper than comparing 512 bytes signatures - or their 684 chars base64 form.
+Two signatures can share a txid, so a match is always confirmed against the full signature.
+"""
+
+from base64 import b64decode
+from binascii import Error as DecodeError
+from hashlib import sha224
+from typing import Iterable, Optional, Union
+
+from bismuthcore.transaction import Transaction
+
+__version__ = '0.0.1'
+
+
+SQL_INSERT = "INSERT INTO txids VALUES (?,?)"
+
+# Collisions are resolved on the transactions of the candidate blocks only - through the Block Height Index,
+# the unary + keeps sqlite from using the Signature Index instead.
+SQL_LOOKUP = "SELECT t.timestamp FROM txids i CROSS JOIN transactions t " \
+             "ON t.block_height = i.block_height AND +t.signature = ? WHERE i.txid = ?"
+
+SQL_DELETE_FROM_HEIGHT = "DELETE FROM txids WHERE block_height >= ? OR block_height <= ?"
+
+SQL_CLEAR = "DELETE FROM txids"
+
+SQL_ALL_SIGNATURES = "SELECT signature, block_height FROM transactions"
+
+
+def raw_signature(signature: Union[str, bytes]) -> bytes:
+    """Raw signature, from either the bin or the legacy - base64 - form"""
+    if isinstance(signature, str):
+        try:
+            return b64decode(signature)
+        except DecodeError:
+            # Can't be a valid signature, but still gets a stable txid
+            return signature.encode('utf-8')
+    return bytes(signature)
+
+
+def txid(signature: Union[str, bytes]) -> int:
+    """The txid of a raw or base64 encoded signature"""
+    return int.from_bytes(sha224(raw_signature(signature)).digest()[:8], 'big', signed=True)
+
+
+class TxidIndex:
+    """Txid index of a bin ledger - sqlite - db, kept in the txids table - see ledgerschema.
+
+    Like balances, updates do not commit: they belong to the caller's sql transaction.
+    """
+
+    __slots__ = ('db', )
+
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, transactions: Iterable[Transaction]) -> None:
+        self.db.executemany(SQL_INSERT, ((txid(transaction.signature), transaction.block_height)
+                                         for transaction in transactions))
+
+    def add_rows(self, rows: Iterable[tuple]) -> None:
+        """Adds (txid, block_height) rows"""
+        self.db.executemany(SQL_INSERT, rows)
+
+    def lookup(self, signature: Union[str, bytes]) -> Optional[float]:
+        """Timestamp of the transaction with that signature in the ledger, None if there is none."""
+        raw = raw_signature(signature)
+        row = self.db.execute(SQL_LOOKUP, (raw, txid(raw))).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, signature: Union[str, bytes]) -> bool:
+        return self.lookup(signature) is not None
+
+    def rollback(self, height: int) -> None:
+        """Removes the txids of blocks from height on, and their mirror blocks"""
+        self.db.execute(SQL_DELETE_FROM_HEIGHT, (height, -height))
+
+    def rebuild(self) -> None:
+        """Recomputes the whole index from the transactions table"""
+        self.db.execute(SQL_CLEAR)
+        self.add_rows((txid(signature), block_height)
+                      for signature, block_height in self.db.execute(SQL_ALL_SIGNATURES).fetchall())
+
+
+class TxidSet:
+    """In memory txid multiset, for small and short lived sets of signatures like the mempool.
+
+    may_contain() has no false negatives as long as every added signature goes through add():
+    a False is definitive, a True has to be confirmed against the full signature.
+    """
+
+    __slots__ = ('_counts', )
+
+    def __init__(self, signatures: Iterable[Union[str, bytes]]=()):
+        # txid: number of signatures with that txid
+        self._counts = {}
+        for signature in signatures:
+            self.add(signature)
+
+    def add(self, signature: Union[str, bytes]) -> None:
+        key = txid(signature)
+        self._counts[key] = self._counts.get(key, 0) + 1
+
+    def discard(self, signature: Union[str, bytes]) -> None:
+        """Only call for a signature that was actually added - and not already discarded."""
+        key = txid(signature)
+        count = self._counts.get(key, 0)
+        if count > 1:
+            self._counts[key] = count - 1
+        elif count:
+            del self._counts[key]
+
+    def may_contain(self, signature: Union[str, bytes]) -> bool:
+        return txid(signature) in self._counts
+
+    def clear(self) -> None:
+        self._counts.clear()
+
+    def __len__(self) -> int:
+        return sum(self._counts.values())
@@ -0,0 +1,44 @@
+"""
+Address validation benchmark
+
+Block.validate_mid with the cached helpers vs plain polysign checks, on the dataset transactions.
+"""
+
+import json
+import sys
+
+from polysign.signerfactory import SignerFactory
+
+sys.path.append('../')
+from bismuthcore.block import Block
+from bismuthcore.decorators import timeit
+from bismuthcore.helpers import ADDRESS_VALID_CACHE
+from bismuthcore.transaction import Transaction
+
+
+@timeit
+def validate_polysign(block):
+    """ What validate_mid did before the cache"""
+    for transaction in block.transactions:
+        if not SignerFactory.address_is_valid(transaction.address):
+            raise ValueError("Not a valid sender address")
+        if not SignerFactory.address_is_valid(transaction.recipient):
+            raise ValueError("Not a valid recipient address")
+
+
+@timeit
+def validate_cached(block):
+    block.validate_mid()
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    print("Bench {} txs".format(len(txs)))
+    block = Block(txs)
+    validate_polysign(block)
+    validate_cached(block)
+    print("Cached addresses", len(ADDRESS_VALID_CACHE))
@@ -0,0 +1,71 @@
+"""
+Amounts conversion benchmark
+
+Compares the Decimal free converters to the former Decimal based ones, and checks they give the same results.
+"""
+
+import json
+import sys
+from decimal import Decimal
+
+sys.path.append('../')
+from bismuthcore.transaction import DECIMAL_1E8, f8_to_int, f8_to_int_batch, int_to_f8, int_to_f8_batch
+from bismuthcore.decorators import timeit
+
+
+def decimal_int_to_f8(an_int: int) -> str:
+    """Former Transaction.int_to_f8"""
+    return f"{(Decimal(an_int) / DECIMAL_1E8):.8f}"
+
+
+def decimal_f8_to_int(a_str: str) -> int:
+    """Former Transaction.f8_to_int"""
+    return int(Decimal(a_str) * DECIMAL_1E8)
+
+
+@timeit
+def f8_to_int_decimal(amounts):
+    return [decimal_f8_to_int(amount) for amount in amounts]
+
+
+@timeit
+def f8_to_int_fast(amounts):
+    return [f8_to_int(amount) for amount in amounts]
+
+
+@timeit
+def f8_to_int_column(amounts):
+    return f8_to_int_batch(amounts)
+
+
+@timeit
+def int_to_f8_decimal(amounts):
+    return [decimal_int_to_f8(amount) for amount in amounts]
+
+
+@timeit
+def int_to_f8_fast(amounts):
+    return [int_to_f8(amount) for amount in amounts]
+
+
+@timeit
+def int_to_f8_column(amounts):
+    return int_to_f8_batch(amounts)
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(json.loads(raw))
+    # amount, fee, reward columns
+    amounts = [tx[4] for tx in txs] + [tx[8] for tx in txs] + [tx[9] for tx in txs]
+    print("Bench {} amounts".format(len(amounts)))
+    ints = f8_to_int_decimal(amounts)
+    assert f8_to_int_fast(amounts) == ints
+    assert f8_to_int_column(amounts) == ints
+    strs = int_to_f8_decimal(ints)
+    assert int_to_f8_fast(ints) == strs
+    assert int_to_f8_column(ints) == strs
+    print("Same results on the whole dataset")
@@ -0,0 +1,57 @@
+"""
+Legacy block data decoding benchmark
+
+Blocks.from_legacy_block_data - whole batch in memory - vs the streaming decoder, serial and with a process pool.
+Run as python3 bench_decode.py [workers]
+"""
+
+import json
+import sys
+import tracemalloc
+
+sys.path.append('../')
+from bismuthcore.blocks import Blocks
+from bismuthcore.decorators import timeit
+
+# Legacy tuple fields sent in block data: timestamp, address, recipient, amount, signature, public_key,
+# operation, openfield
+LEGACY_BLOCK_FIELDS = (1, 2, 3, 4, 5, 6, 10, 11)
+
+
+@timeit
+def decode_list(block_data):
+    return len(Blocks.from_legacy_block_data(block_data).blocks)
+
+
+@timeit
+def decode_stream(block_data, workers=1):
+    count = 0
+    for block in Blocks.iter_legacy_block_data(block_data, workers=workers):
+        # Block is processed then dropped
+        count += 1
+    return count
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    # read data, as blocks of 100 txs
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            tx = json.loads(raw)
+            txs.append([tx[index] for index in LEGACY_BLOCK_FIELDS])
+    block_data = [txs[start:start + 100] for start in range(0, len(txs), 100)]
+    print("Bench {} txs, {} blocks".format(len(txs), len(block_data)))
+    decode_list(block_data)
+    decode_stream(block_data)
+    decode_stream(block_data, workers)
+    print("Peak memory list    {:.1f} MB".format(peak_memory(decode_list, block_data) / 1e6))
+    print("Peak memory stream  {:.1f} MB".format(peak_memory(decode_stream, block_data) / 1e6))
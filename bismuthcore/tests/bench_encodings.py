@@ -0,0 +1,62 @@
+"""
+Legacy encodings benchmark
+
+Repeated legacy exports of the same transactions - block hash, api answer, mempool relay - with and without the
+memoized encodings, and memory cost of the memoized values.
+"""
+
+import json
+import sys
+import tracemalloc
+
+sys.path.append('../')
+from bismuthcore.transaction import Transaction
+from bismuthcore.decorators import timeit
+
+
+@timeit
+def export_uncached(transactions):
+    for transaction in transactions:
+        transaction.to_tuple_for_block_hash()
+        transaction.clear_encoded()
+        transaction.to_dict(legacy=True)
+        transaction.clear_encoded()
+        transaction.to_tuple()
+        transaction.clear_encoded()
+
+
+@timeit
+def export_cached(transactions):
+    for transaction in transactions:
+        transaction.to_tuple_for_block_hash()
+        transaction.to_dict(legacy=True)
+        transaction.to_tuple()
+
+
+def cache_memory(transactions) -> int:
+    """Memory used by the memoized encodings, in bytes"""
+    for transaction in transactions:
+        transaction.clear_encoded()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for transaction in transactions:
+        transaction.to_tuple_for_block_hash()
+        transaction.to_tuple()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    print("Bench {} txs".format(len(txs)))
+    export_uncached(txs)
+    export_cached(txs)
+    # Second pass: everything is memoized already
+    export_cached(txs)
+    memory = cache_memory(txs)
+    print(f"Memoized encodings: {memory / 1000000:0.2f} MB, {memory / len(txs):0.0f} bytes per tx")
@@ -6,12 +6,15 @@ import json
 import sqlite3
 import sys
 from decimal import Decimal
+from time import time
 
 sys.path.append('../')
+from bismuthcore import balances, ledgerschema
 from bismuthcore.transaction import Transaction
 from bismuthcore.decorators import timeit
 from bismuthcore.compat import quantize_eight
 from bismuthcore.helpers import native_tx_to_bin_sqlite, TxConverter
+from bismuthcore.ledgerwriter import LedgerWriter
 
 SQL_CREATE = ('''
               CREATE TABLE "misc" (
@@ -122,6 +125,36 @@ def insert_new_class(tx_list):
     return test_new
 
 
+@timeit
+def insert_new_writer(tx_list):
+    """ Batched executemany inserts, indexes kept up to date"""
+    test_new = sqlite3.connect('file:ledger_new_writer?mode=memory', uri=True, timeout=1)
+    create(test_new, SQL_CREATE)
+    with LedgerWriter(test_new) as writer:
+        writer.add_many(Transaction.from_legacy(tx) for tx in tx_list)
+    return test_new
+
+
+@timeit
+def insert_new_writer_bulk(tx_list):
+    """ Batched executemany inserts, indexes dropped then rebuilt at the end"""
+    test_new = sqlite3.connect('file:ledger_new_writer_bulk?mode=memory', uri=True, timeout=1)
+    create(test_new, SQL_CREATE)
+    with LedgerWriter(test_new, bulk=True) as writer:
+        writer.add_many(Transaction.from_legacy(tx) for tx in tx_list)
+    return test_new
+
+
+@timeit
+def insert_new_writer_balances(tx_list):
+    """ Bulk writer on the full bin ledger schema, balances table updated along"""
+    test_new = sqlite3.connect('file:ledger_new_balances?mode=memory', uri=True, timeout=1)
+    ledgerschema.create(test_new)
+    with LedgerWriter(test_new, bulk=True, update_balances=True) as writer:
+        writer.add_many(Transaction.from_legacy(tx) for tx in tx_list)
+    return test_new
+
+
 @timeit
 def insert_legacy(tx_list):
     test_legacy = sqlite3.connect('file:ledger_legacy?mode=memory', uri=True, timeout=1)
@@ -174,6 +207,17 @@ def balance_new2(db, address: str):
     return Transaction.int_to_f8(balance)
 
 
+@timeit
+def balance_table(db, address: str):
+    """ Single row lookup in the maintained balances table"""
+    return Transaction.int_to_f8(balances.get_balance(db, address))
+
+
+@timeit
+def balance_check(db):
+    return balances.check_consistency(db)
+
+
 @timeit
 def balance_legacy(db, address: str):
     # from essentials.py
@@ -200,8 +244,12 @@ if __name__ == "__main__":
             txs.append(json.loads(raw))
     print("Bench {} txs".format(len(txs)))
     new_db = insert_new(txs)
-    insert_new_function(txs)
-    insert_new_class(txs)
+    for name, insert in (('insert_new', insert_new), ('insert_new_function', insert_new_function),
+                         ('insert_new_class', insert_new_class), ('insert_new_writer', insert_new_writer),
+                         ('insert_new_writer_bulk', insert_new_writer_bulk)):
+        start = time()
+        insert(txs).close()
+        print("{}  {:.0f} tx/s".format(name, len(txs) / (time() - start)))
     bal_new = balance_new(new_db, "e13e79dc7e4b8265d7cdafe31819939fcce98abc2c7662f7fb53fa38")
     # balances can be negative here since we don't have the chain from start.
     print(bal_new)
@@ -209,6 +257,12 @@ if __name__ == "__main__":
     # balances can be negative here since we don't have the chain from start.
     print(bal_new2)
     # da8a39cc9d880cd55c324afc2f9596c64fac05b8d41b3c9b6c481b4e
+    balances_db = insert_new_writer_balances(txs)
+    # A sender of the dataset
+    address = txs[0][2]
+    print(balance_new2(balances_db, address))
+    print(balance_table(balances_db, address))
+    print("Mismatches", len(balance_check(balances_db)))
     insert_legacy_object(txs)
     legacy_db = insert_legacy(txs)
     bal_legacy = balance_legacy(legacy_db, "e13e79dc7e4b8265d7cdafe31819939fcce98abc2c7662f7fb53fa38")
@@ -222,6 +276,18 @@ bench_legacy  4.797854 s
 bench_legacy_object  8.732996 s
 """
 
+"""
+Bench 100000 txs, in-ram db - transactions decoded from legacy on the fly, median of 5 runs
+insert_new  16989 tx/s
+insert_new_function  19235 tx/s
+insert_new_class  18643 tx/s
+insert_new_writer  16463 tx/s
+insert_new_writer_bulk  25460 tx/s
+With the indexes kept, the writer is on par with insert_new: both build Transaction objects, the function and
+class helpers do not. Index updates dominate, bulk mode is the one for syncs.
+Before the add_many gc change, insert_new_writer was 14-15k tx/s: every pending batch triggered full gc passes.
+"""
+
 """
 select distinct(address), count(*) as total from transactions where block_height > 700000 
 group by address order by total desc limit 50;
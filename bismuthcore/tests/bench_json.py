@@ -0,0 +1,50 @@
+"""
+Blocks dict json benchmark
+
+json.dumps(to_blocks_dict()) vs the streaming writer, time and peak memory, on the dataset transactions.
+"""
+
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.append('../')
+from bismuthcore.decorators import timeit
+from bismuthcore.transaction import Transaction
+from bismuthcore.transactionslist import TransactionsList
+
+
+@timeit
+def dumps_dict(tx_list):
+    return len(json.dumps(tx_list.to_blocks_dict()))
+
+
+@timeit
+def stream_json(tx_list):
+    with open(os.devnull, 'w') as stream:
+        return tx_list.write_blocks_json(stream, clear_encoded=True)
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    print("Bench {} txs".format(len(txs)))
+    tx_list = TransactionsList(txs)
+    dumps_dict(tx_list)
+    stream_json(tx_list)
+    print("Peak memory dumps   {:.1f} MB".format(peak_memory(dumps_dict, tx_list) / 1e6))
+    for transaction in txs:
+        transaction.clear_encoded()
+    print("Peak memory stream  {:.1f} MB".format(peak_memory(stream_json, tx_list) / 1e6))
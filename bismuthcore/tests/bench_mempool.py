@@ -0,0 +1,151 @@
+"""
+Mempool store benchmark
+
+Merge like workload - signature check, sender pending debit then insert - tx_to_send selection and size,
+on the sqlite memory db the ram mempool used vs the native store. Dataset transactions as mempool rows.
+Admission balance lookups: sender txs summed vs tracked pending debits, ledger history scans vs cached balances.
+Peer relay of the 10 last merged txs, the peer having sent us 1000: mergedts selection and list filter
+vs sequence number selection and set filter.
+Run as python3 bench_mempool.py [tx count]
+"""
+
+import json
+import sqlite3
+import sys
+from functools import partial
+from time import time
+
+sys.path.append('../')
+from bismuthcore import balances
+from bismuthcore.compat import quantize_eight
+from bismuthcore.helpers import fee_calculate
+from bismuthcore.ledgerschema import create
+from bismuthcore.ledgerwriter import LedgerWriter
+from bismuthcore.legacy.mempoolstores import MemoryMempoolStore, SqliteMempoolStore
+from bismuthcore.decorators import timeit
+from bismuthcore.transaction import Transaction
+
+
+def sqlite_store():
+    """Same db settings as the former ram mempool"""
+    db = sqlite3.connect("file:mempool_bench?mode=memory&cache=shared", uri=True, timeout=1, isolation_level=None,
+                         check_same_thread=False)
+    db.execute('PRAGMA journal_mode = WAL;')
+    db.execute("PRAGMA page_size = 4096;")
+    db.text_factory = str
+    return SqliteMempoolStore(db)
+
+
+def merge(store, rows):
+    start = time()
+    for row in rows:
+        if store.contains(row[4]):
+            continue
+        store.pending_debit(row[1])
+        store.insert(row)
+    return time() - start
+
+
+@timeit
+def to_send(store, count):
+    for _ in range(count):
+        store.to_send()
+
+
+@timeit
+def size_recompute(store, count):
+    """What Mempool.size() did before the store tracked it"""
+    for _ in range(count):
+        sys.getsizeof(str(store.txs()))
+
+
+@timeit
+def size_tracked(store, count):
+    for _ in range(count):
+        store.size()
+
+
+@timeit
+def debit_summed(store, rows):
+    """What merge did before the stores tracked pending debits"""
+    for row in rows:
+        debit_mempool = 0
+        for x in store.address_txs(row[1]):
+            debit_mempool = quantize_eight(debit_mempool + quantize_eight(x[0]) + fee_calculate(x[1], x[2]))
+
+
+@timeit
+def debit_tracked(store, rows):
+    for row in rows:
+        store.pending_debit(row[1])
+
+
+@timeit
+def ledger_scans(db, rows):
+    """Former per tx ledger side: four scans of the sender history"""
+    for row in rows:
+        for sql in ("SELECT iamount FROM transactions WHERE recipient = ?",
+                    "SELECT iamount FROM transactions WHERE address = ?",
+                    "SELECT ifee FROM transactions WHERE address = ?",
+                    "SELECT sum(ireward) FROM transactions WHERE recipient = ?"):
+            sum(entry[0] or 0 for entry in db.execute(sql, (row[1], )))
+
+
+@timeit
+def ledger_cached(cache, rows):
+    for row in rows:
+        cache.get(row[1], (0, b'tip'))
+
+
+@timeit
+def relay_mergedts(store, peer_txs, count):
+    """What tx_to_send did: whole table select since a time, signatures filtered through a list"""
+    since = max(row[8] for row in store.to_send()) - 5
+    for _ in range(count):
+        peers_sig = [tx[4] for tx in peer_txs]
+        [tx for tx in store.to_send(since) if tx[4] not in peers_sig]
+
+
+@timeit
+def relay_sequence(store, peer_txs, count):
+    for _ in range(count):
+        peers_sig = {tx[4] for tx in peer_txs}
+        [tx for tx in store.to_send_after(store.sequence - 10)[0] if tx[4] not in peers_sig]
+
+
+@timeit
+def sig_check(store, rows):
+    for row in rows:
+        store.contains(row[4])
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rows = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            tx = json.loads(raw)
+            # timestamp, address, recipient, amount, signature, public_key, operation, openfield, mergedts
+            rows.append((f"{tx[1]:.2f}", tx[2], tx[3], tx[4], tx[5], tx[6], tx[10], tx[11], int(tx[1])))
+            if len(rows) >= count:
+                break
+    print("Bench {} txs".format(len(rows)))
+    ledger = sqlite3.connect(':memory:')
+    create(ledger)
+    with LedgerWriter(ledger, update_balances=True) as writer, open("../Utils/tx_tuple_dataset.json") as f:
+        writer.add_many(Transaction.from_legacy(json.loads(raw)) for raw in f)
+    # Scans are slow: 200 txs
+    ledger_scans(ledger, rows[:200])
+    ledger_cached(balances.BalanceCache(partial(balances.get_balance, ledger)), rows[:200])
+    for name, store in (("sqlite", sqlite_store()), ("native", MemoryMempoolStore())):
+        duration = merge(store, rows)
+        print("merge {}  {:2.6f} s  {:.0f} tx/s".format(name, duration, len(rows) / duration))
+        sig_check(store, rows)
+        debit_summed(store, rows)
+        debit_tracked(store, rows)
+        relay_mergedts(store, rows[:1000], 100)
+        relay_sequence(store, rows[:1000], 100)
+        to_send(store, 10)
+        size_recompute(store, 10)
+        size_tracked(store, 10)
+        store.close()
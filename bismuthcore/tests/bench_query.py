@@ -0,0 +1,48 @@
+"""
+TransactionsList query benchmark
+
+Full scans vs the lazy address / recipient / operation index, on the dataset transactions.
+"""
+
+import json
+import sys
+
+sys.path.append('../')
+from bismuthcore.decorators import timeit
+from bismuthcore.transaction import Transaction
+from bismuthcore.transactionslist import TransactionsList
+
+
+@timeit
+def query_scan(tx_list, addresses):
+    count = 0
+    for address in addresses:
+        count += len([transaction for transaction in tx_list.transactions if transaction.address == address])
+    return count
+
+
+@timeit
+def build_index(tx_list):
+    return tx_list.index
+
+
+@timeit
+def query_index(tx_list, addresses):
+    count = 0
+    for address in addresses:
+        count += len(tx_list.filter(address=address).transactions)
+    return count
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    print("Bench {} txs".format(len(txs)))
+    tx_list = TransactionsList(txs)
+    addresses = sorted(set(transaction.address for transaction in txs))[:10] + ['unknown'] * 10
+    query_scan(tx_list, addresses)
+    build_index(tx_list)
+    query_index(tx_list, addresses)
@@ -0,0 +1,66 @@
+"""
+Ledger row scan benchmark
+
+Transaction.from_v2 vs TransactionRow views when a scan only needs a single field, time and allocations,
+on the dataset transactions read back from a bin ledger.
+"""
+
+import json
+import sqlite3
+import sys
+import tracemalloc
+
+sys.path.append('../')
+from bismuthcore import ledgerschema
+from bismuthcore.decorators import timeit
+from bismuthcore.ledgerwriter import LedgerWriter
+from bismuthcore.transaction import Transaction
+from bismuthcore.transactionrow import TransactionRow
+
+
+@timeit
+def scan_from_v2(rows):
+    return sum(Transaction.from_v2(row).amount for row in rows)
+
+
+@timeit
+def scan_row(rows):
+    return sum(TransactionRow(row).amount for row in rows)
+
+
+@timeit
+def keep_from_v2(rows):
+    return [Transaction.from_v2(row) for row in rows]
+
+
+@timeit
+def keep_row(rows):
+    return [TransactionRow(row) for row in rows]
+
+
+def allocated(function, *args):
+    tracemalloc.start()
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    db = sqlite3.connect(':memory:')
+    ledgerschema.create(db)
+    with LedgerWriter(db, bulk=True) as writer:
+        writer.add_many(txs)
+    rows = db.execute("SELECT * FROM transactions").fetchall()
+    print("Bench {} rows".format(len(rows)))
+    assert scan_from_v2(rows) == scan_row(rows)
+    keep_from_v2(rows)
+    keep_row(rows)
+    print("Allocated from_v2  {:.1f} MB".format(allocated(keep_from_v2, rows) / 1e6))
+    print("Allocated row      {:.1f} MB".format(allocated(keep_row, rows) / 1e6))
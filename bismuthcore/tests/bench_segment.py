@@ -0,0 +1,70 @@
+"""
+Cold block read benchmark
+
+Random old block reads: SQLite query and Transaction decode vs memory mapped segment, on the dataset transactions.
+Run as python3 bench_segment.py [reads]
+"""
+
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from itertools import groupby
+
+sys.path.append('../')
+from bismuthcore import ledgerschema
+from bismuthcore.decorators import timeit
+from bismuthcore.ledgerwriter import LedgerWriter
+from bismuthcore.segment import Segment, SegmentWriter
+from bismuthcore.transaction import Transaction
+
+
+@timeit
+def read_sqlite(db, heights):
+    count = 0
+    for height in heights:
+        rows = db.execute("SELECT * FROM transactions WHERE block_height = ?", (height, )).fetchall()
+        count += len([Transaction.from_v2(list(row)) for row in rows])
+    return count
+
+
+@timeit
+def read_segment(segment, heights):
+    count = 0
+    for height in heights:
+        count += len(list(segment.block(height).transactions))
+    return count
+
+
+@timeit
+def read_segment_last(segment, heights):
+    """Only decodes the mining transaction of every block"""
+    for height in heights:
+        segment.block(height).transactions[-1]
+
+
+if __name__ == "__main__":
+    reads = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    print("Bench {} txs".format(len(txs)))
+    with tempfile.TemporaryDirectory() as directory:
+        db = sqlite3.connect(os.path.join(directory, 'ledger.db'))
+        ledgerschema.create(db)
+        with LedgerWriter(db, bulk=True) as writer:
+            writer.add_many(txs)
+        path = os.path.join(directory, 'blocks.seg')
+        with SegmentWriter(path) as segment_writer:
+            for height, block in groupby(txs, key=lambda transaction: transaction.block_height):
+                segment_writer.append(list(block), height)
+        heights = random.choices(sorted(set(transaction.block_height for transaction in txs)), k=reads)
+        with Segment(path) as segment:
+            read_sqlite(db, heights)
+            read_segment(segment, heights)
+            read_segment_last(segment, heights)
+        db.close()
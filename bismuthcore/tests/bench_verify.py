@@ -0,0 +1,106 @@
+"""
+Signature verification benchmark
+
+polysign without key cache vs serial Block.validate_heavy vs SignatureVerifier with 1 to N worker processes,
+then block validation of transactions already verified - by the mempool - through a SignatureCache.
+Mempool merges of 1000 tx batches: signatures checked one at a time under the merge lock, as merge used to,
+vs verify_legacy_item in the SignatureVerifier pool, as the batch merge does before taking the lock.
+Uses freshly signed transactions, since the dataset signatures can not be verified without the ledger.
+Run as python3 bench_verify.py [tx count] [max workers]
+"""
+
+import os
+import sys
+import threading
+from time import time
+
+from polysign.signerfactory import SignerFactory
+
+sys.path.append('../')
+from bismuthcore.block import Block
+from bismuthcore.decorators import timeit
+from bismuthcore.signatureverifier import (RSA_KEYS, SignatureCache, SignatureVerifier, signature_item,
+                                           verify_legacy_item)
+from signing import signed_transactions
+
+
+@timeit
+def validate_polysign(block):
+    """ Parses the public key for every signature"""
+    for item in block.signature_items():
+        SignerFactory.verify_bis_signature_raw(*item)
+
+
+@timeit
+def validate_serial(block):
+    block.validate_heavy()
+
+
+@timeit
+def validate_cached(block, cache):
+    block.validate_heavy(cache=cache)
+
+
+def validate_pool(block, verifier):
+    start = time()
+    block.validate_heavy(verifier)
+    return time() - start
+
+
+def merge_serial(items, batch_size=1000):
+    """Returns the total and lock held durations"""
+    lock = threading.Lock()
+    start = time()
+    locked = 0
+    for index in range(0, len(items), batch_size):
+        with lock:
+            lock_start = time()
+            for item in items[index:index + batch_size]:
+                verify_legacy_item(item)
+            locked += time() - lock_start
+    return time() - start, locked
+
+
+def merge_batch(items, verifier, batch_size=1000):
+    """Returns the total and lock held durations. Under the lock, only the balance checks and inserts remain."""
+    lock = threading.Lock()
+    start = time()
+    locked = 0
+    for index in range(0, len(items), batch_size):
+        verifier.verify(items[index:index + batch_size])
+        with lock:
+            lock_start = time()
+            locked += time() - lock_start
+    return time() - start, locked
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    block = Block(signed_transactions(count, key_size=4096))
+    print("Bench {} txs".format(count))
+    validate_polysign(block)
+    validate_serial(block)
+    print(RSA_KEYS.stats)
+    for workers in range(1, max_workers + 1):
+        with SignatureVerifier(workers=workers) as verifier:
+            if workers > 1:
+                # Warm up the pool, process start is not what we measure
+                verifier.verify_transactions(block.transactions[:workers])
+            duration = validate_pool(block, verifier)
+        print("validate_pool {} workers  {:2.6f} s  {:.0f} tx/s".format(workers, duration, count / duration))
+    cache = SignatureCache()
+    # First pass fills the cache, like mempool merges would
+    validate_cached(block, cache)
+    validate_cached(block, cache)
+    print(cache.stats)
+    items = [signature_item(transaction) for transaction in block.transactions]
+    duration, locked = merge_serial(items)
+    print("merge_serial  {:2.6f} s  {:.0f} tx/s  lock held {:2.6f} s".format(duration, count / duration, locked))
+    for workers in range(1, max_workers + 1):
+        with SignatureVerifier(workers=workers, function=verify_legacy_item) as verifier:
+            if workers > 1:
+                verifier.verify(items[:workers])
+            duration, locked = merge_batch(items, verifier)
+        print("merge_batch {} workers  {:2.6f} s  {:.0f} tx/s  lock held {:2.6f} s".format(
+            workers, duration, count / duration, locked))
@@ -0,0 +1,65 @@
+"""
+Wire formats benchmark
+
+Size and encode/decode speed of the binary wire format (to_protobuf) vs the json and legacy tuple formats.
+"""
+
+import json
+import sys
+
+sys.path.append('../')
+from bismuthcore.transaction import Transaction
+from bismuthcore.transactionslist import TransactionsList
+from bismuthcore.decorators import timeit
+
+
+@timeit
+def encode_json(tx_list):
+    return "\n".join(transaction.to_json() for transaction in tx_list.transactions)
+
+
+@timeit
+def decode_json(payload):
+    # Transaction.from_json expects hex encoded addresses, decode as legacy tuples instead
+    return TransactionsList([Transaction.from_legacy(list(json.loads(raw).values())[:12])
+                             for raw in payload.split("\n")])
+
+
+@timeit
+def encode_tuple(tx_list):
+    return json.dumps(tx_list.to_listoftuples())
+
+
+@timeit
+def decode_tuple(payload):
+    return TransactionsList([Transaction.from_legacy(tx) for tx in json.loads(payload)])
+
+
+@timeit
+def encode_protobuf(tx_list):
+    return tx_list.to_protobuf()
+
+
+@timeit
+def decode_protobuf(payload):
+    return TransactionsList.from_protobuf(memoryview(payload))
+
+
+if __name__ == "__main__":
+    # read data
+    txs = []
+    with open("../Utils/tx_tuple_dataset.json") as f:
+        for raw in f:
+            txs.append(Transaction.from_legacy(json.loads(raw)))
+    print("Bench {} txs".format(len(txs)))
+    transactions = TransactionsList(txs)
+    for name, encode, decode in (('json', encode_json, decode_json), ('tuple', encode_tuple, decode_tuple),
+                                 ('protobuf', encode_protobuf, decode_protobuf)):
+        for transaction in txs:
+            # Do not let memoized encodings of a previous run skew the results
+            transaction.clear_encoded()
+        payload = encode(transactions)
+        size = len(payload.encode('utf-8')) if isinstance(payload, str) else len(payload)
+        print(f"{name}: {size / 1000000:0.2f} MB")
+        decoded = decode(payload)
+        assert [tx.to_bin_tuple() for tx in decoded.transactions] == [tx.to_bin_tuple() for tx in txs]
@@ -0,0 +1,31 @@
+"""
+Properly signed test transactions, shared by the tests and benchmarks
+"""
+
+from base64 import b64encode
+from hashlib import sha224
+
+from Cryptodome.Hash import SHA
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Signature import PKCS1_v1_5
+
+from bismuthcore.transaction import Transaction
+
+
+def signed_transactions(count: int, amount: str='1.00000000', key_size: int=1024, timestamp: int=1600000000) -> list:
+    """Properly signed transactions, from a throw away RSA key, one second apart from timestamp.
+    Regular Bismuth RSA addresses use 4096 bits keys, smaller ones keep the tests fast."""
+    key = RSA.generate(key_size)
+    pem = key.publickey().exportKey().decode('utf-8')
+    address = sha224(pem.encode('utf-8')).hexdigest()
+    signer = PKCS1_v1_5.new(key)
+    transactions = []
+    for index in range(count):
+        tx_timestamp = f"{timestamp + index:.2f}"
+        buffer = str((tx_timestamp, address, address, amount, '', f'test {index}')).encode('utf-8')
+        signature = b64encode(signer.sign(SHA.new(buffer))).decode('utf-8')
+        transactions.append(Transaction.from_legacy_params(timestamp=tx_timestamp, address=address, recipient=address,
+                                                           amount=amount, signature=signature,
+                                                           public_key=b64encode(pem.encode('utf-8')).decode('utf-8'),
+                                                           openfield=f'test {index}'))
+    return transactions
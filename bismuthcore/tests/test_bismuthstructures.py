@@ -3,13 +3,43 @@
 
 """Tests for `bismuthcore` package."""
 
+import io
+from base64 import b64encode, b64decode
+from hashlib import sha224
+import json
+import logging
+import os
 import pytest
+from functools import partial
 import random
+import sqlite3
 import sys
+import threading
+import time
+import types
 from decimal import Decimal, getcontext, ROUND_HALF_EVEN
 
 sys.path.append('../')
-from bismuthcore.transaction import Transaction
+from bismuthcore.transaction import Transaction, DECIMAL_1E8, f8_to_int_batch, int_to_f8_batch
+from bismuthcore.transactionbatch import TransactionBatch
+from bismuthcore.transactionrow import TransactionRow
+from bismuthcore.transactionslist import TransactionsList
+from bismuthcore.block import Block
+from bismuthcore.blocks import Blocks
+from bismuthcore.helpers import ADDRESS_RSA_CACHE, ADDRESS_VALID_CACHE, address_is_rsa, address_validate
+from bismuthcore.digestpipeline import DigestError, DigestPipeline
+from bismuthcore import balances
+from bismuthcore.ledgerschema import SQL_CREATE_TABLES, SQL_INSERT_TRANSACTION, create
+from bismuthcore.ledgerwriter import LedgerWriter
+from bismuthcore.legacy.mempoolstores import MemoryMempoolStore, SqliteMempoolStore, row_debit
+from bismuthcore.publickeys import PublicKeyStore
+from bismuthcore.segment import Segment, SegmentWriter, index_path
+from bismuthcore.signaturefilter import SignatureFilter
+from bismuthcore.signatureverifier import (ADDRESS_UNCHECKED, CHECK_ERROR, SIGNATURE_INVALID, RSAKeyCache,
+                                           SignatureCache, SignatureVerifier, signature_item, verify_legacy_item)
+from bismuthcore.txidindex import TxidIndex, TxidSet, txid
+from signing import signed_transactions
+from Utils import convert_db
 
 getcontext().rounding = ROUND_HALF_EVEN
 
@@ -40,6 +70,17 @@ def test_convert_amount():
         assert f8_amount == Transaction.int_to_f8(int_amount)
 
 
+def test_convert_amount_decimal_free():
+    """Decimal free converters give the same results as the Decimal based ones"""
+    random.seed('Reproducible test')
+    ints = [random.randint(-10 ** 12, 10 ** 16) for i in range(1000)] + [0, 1, -1, 10 ** 8, 10 ** 25]
+    strs = [f"{(Decimal(an_int) / DECIMAL_1E8):.8f}" for an_int in ints]
+    assert int_to_f8_batch(ints) == [Transaction.int_to_f8(an_int) for an_int in ints] == strs
+    strs += ['1', '.5', '-0.123456789', '1e-5', ' 2.5', '0.99999999999999999999999999999']
+    assert f8_to_int_batch(strs) == [Transaction.f8_to_int(a_str) for a_str in strs] \
+        == [int(Decimal(a_str) * DECIMAL_1E8) for a_str in strs]
+
+
 def test_checksum(verbose=False):
     if verbose:
         print(TX.checksum)
@@ -87,6 +128,683 @@ def test_to_dict_bin(verbose=False):
                                            'operation': 'TEST', 'openfield': 'test_openfield', 'format': 'Bin'}
 
 
+def test_encoded_cache():
+    """Memoized legacy encodings follow field changes"""
+    tx = Transaction(block_height=1, timestamp=0.01, address=TX.address, recipient=TX.recipient,
+                     signature=TX.signature, public_key=bytes(range(256)) * 2, block_hash=TX.block_hash)
+    first = tx.to_tuple()
+    assert first[6] == Transaction.public_key_to_legacy(tx.public_key)
+    assert tx.to_tuple() == first
+    assert tx.to_dict(legacy=True)['public_key'] == first[6]
+    tx.public_key = b'\x01\x02'
+    tx.signature = b'\x03\x04'
+    tx.block_hash = b'\x05'
+    assert tx.to_tuple()[5:8] == ('AwQ=', 'AQI=', '05')
+    assert tx.to_tuple_for_block_hash()[4:6] == ('AwQ=', 'AQI=')
+    tx.public_key = b''
+    assert tx.to_tuple()[6] == '0'
+
+
+def test_protobuf():
+    """Binary wire format round trip, from bytes or memoryview"""
+    assert Transaction.from_protobuf(TX.to_protobuf()).to_bin_tuple() == TX.to_bin_tuple()
+    blocks = Blocks([Block([TX, TX]), Block([TX])])
+    decoded = Blocks.from_protobuf(memoryview(blocks.to_protobuf()))
+    assert [len(block.transactions) for block in decoded.blocks] == [2, 1]
+    assert decoded.blocks[0].transactions[1].to_bin_tuple() == TX.to_bin_tuple()
+    with pytest.raises(ValueError):
+        Transaction.from_protobuf(TX.to_protobuf()[:-1])
+    with pytest.raises(ValueError, match="header"):
+        Transaction.from_protobuf(TX.to_protobuf()[:10])
+    with pytest.raises(ValueError, match="count"):
+        TransactionsList.from_protobuf(b'\x01\x00')
+    with pytest.raises(ValueError, match="count"):
+        Blocks.from_protobuf(b'')
+    long_field = Transaction.from_protobuf(TX.to_protobuf())
+    long_field.operation = 'x' * 70000
+    with pytest.raises(ValueError, match="operation too long"):
+        long_field.to_protobuf()
+
+
+def test_batch_roundtrip():
+    """Columnar batch converts back to the very same transactions"""
+    mining = Transaction(block_height=1, timestamp=0.02, address=TX.address, recipient=TX.address,
+                         signature=b'\x01\x02', block_hash=TX.block_hash, reward=1000000, openfield='nonce')
+    tx_list = TransactionsList([TX, mining])
+    batch = tx_list.to_batch()
+    assert len(batch) == 2
+    assert [tx.checksum for tx in TransactionsList.from_batch(batch).transactions] == [TX.checksum, mining.checksum]
+    assert batch[-1].is_mining
+    assert TransactionsList(batch).to_listoftuples() == tx_list.to_listoftuples()
+    assert batch.to_listoftuples(simplified=True) == tx_list.to_listoftuples(simplified=True)
+
+
+def test_transactions_index():
+    """Address, recipient and operation prefix queries, on lists and batches, follow mutations"""
+    a, b, c = 'a' * 56, 'b' * 56, 'c' * 56
+    txs = [Transaction(block_height=height, timestamp=height + 0.01 * position, address=address, recipient=recipient,
+                       signature=bytes([height, position]), operation=operation)
+           for height, position, address, recipient, operation in ((1, 0, a, b, 'token:issue'), (1, 1, b, b, ''),
+                                                                   (2, 0, a, c, 'token:transfer'), (3, 0, c, a, 'tok'))]
+    for transactions in (list(txs), TransactionBatch.from_transactions(txs)):
+        tx_list = TransactionsList(transactions)
+        assert tx_list.positions(address=a) == [0, 2]
+        assert tx_list.positions(recipient=b) == [0, 1]
+        assert tx_list.positions(operation='token:') == [0, 2]
+        assert tx_list.positions(operation='tok') == [0, 2, 3]
+        assert tx_list.positions(address=a, operation='token:t') == [2]
+        assert tx_list.positions(address='x') == []
+        assert [tx.recipient for tx in tx_list.involving(b).transactions] == [b, b]
+        assert len(tx_list.involving(a).transactions) == 3
+        assert list(tx_list.to_blocks_dict(address=a)) == [1, 2]
+        assert tx_list.to_blocks_dict(operation='token')[1]['transactions'] \
+            == tx_list.to_blocks_dict()[1]['transactions'][:1]
+    tx_list = TransactionsList(list(txs))
+    assert tx_list.positions(address=c) == [3]
+    tx_list.append(txs[2])
+    assert tx_list.positions(recipient=c) == [2, 4]
+    tx_list.transactions = txs[:1]
+    assert tx_list.positions(address=a) == [0]
+
+
+def test_blocks_json():
+    """Streamed json is the very same as json.dumps(to_blocks_dict())"""
+    txs = signed_transactions(4)
+    for height, transaction in zip((5, 5, 6, 7), txs):
+        transaction.block_height = height
+        transaction.block_hash = bytes([height]) * 28
+    mining = Transaction(block_height=7, timestamp=1600000010.5, address='a' * 56, recipient='a' * 56,
+                         signature=b'\x01\x02', block_hash=b'\x07' * 28, reward=1000000, openfield='nonce')
+    for transactions in (txs + [mining], TransactionBatch.from_transactions(txs + [mining]), [],
+                         [txs[0], txs[2], txs[1]]):
+        tx_list = TransactionsList(transactions)
+        expected = json.dumps(tx_list.to_blocks_dict())
+        assert ''.join(tx_list.iter_blocks_json()) == expected
+        assert ''.join(tx_list.iter_blocks_json(chunk_size=1, clear_encoded=True)) == expected
+        assert ''.join(tx_list.iter_blocks_json(address=txs[0].address)) \
+            == json.dumps(tx_list.to_blocks_dict(address=txs[0].address))
+    stream = io.StringIO()
+    assert TransactionsList(txs).write_blocks_json(stream) == len(stream.getvalue())
+    assert json.loads(stream.getvalue())['5']['transactions'][1]['openfield'] == 'test 1'
+
+
+def test_segment(tmp_path):
+    """Blocks read back from a segment, lazily and read-only, and interrupted appends are dropped"""
+    path = str(tmp_path / 'blocks.seg')
+    txs = signed_transactions(6)
+    for position, transaction in enumerate(txs):
+        transaction.block_height = 10 + position // 2
+    with SegmentWriter(path) as writer:
+        for start in (0, 2, 4):
+            writer.append(txs[start:start + 2])
+        with pytest.raises(ValueError):
+            writer.append(txs[:2])
+    with Segment(path) as segment:
+        assert (len(segment), segment.first_height, segment.last_height) == (3, 10, 12)
+        assert 11 in segment and 13 not in segment
+        block = segment.block(11)
+        assert [tx.to_bin_tuple() for tx in block.transactions] == [tx.to_bin_tuple() for tx in txs[2:4]]
+        assert block.transactions[-1].openfield == 'test 3'
+        assert len(segment.blocks(11, 100).transactions) == 4
+        assert segment.blocks(10, 13).to_listoftuples() == TransactionsList(txs).to_listoftuples()
+        assert segment.blocks(10, 13).positions(operation='') == list(range(6))
+        with pytest.raises(ValueError):
+            segment.block(9)
+        with pytest.raises(TypeError):
+            block.append(txs[0])
+    # Partial record and index entry, as left by a crash
+    with open(path, 'ab') as f:
+        f.write(b'\x0d\x00\x00')
+    with open(index_path(path), 'ab') as f:
+        f.write(b'\x0d\x00')
+    with SegmentWriter(path) as writer:
+        assert (writer.count, writer.last_height) == (3, 12)
+        txs[0].block_height = 13
+        writer.append(txs[:1])
+    with Segment(path) as segment:
+        assert segment.last_height == 13
+        assert segment.block(13).transactions[0].openfield == 'test 0'
+    # Lost index, rebuilt from the records
+    os.remove(index_path(path))
+    with SegmentWriter(path) as writer:
+        assert (writer.count, writer.last_height) == (4, 13)
+    with Segment(path) as segment:
+        assert segment.block(11).transactions[-1].openfield == 'test 3'
+    # Empty data file, as left by a crash before the header was written
+    empty = str(tmp_path / 'empty.seg')
+    open(empty, 'wb').close()
+    with SegmentWriter(empty) as writer:
+        writer.append(txs[:2], 1)
+    with Segment(empty) as segment:
+        assert len(segment) == 1
+
+
+def test_batch_block():
+    """A Block can use a batch as its transactions"""
+    block = Block(TransactionBatch.from_transactions([TX]))
+    assert block.height == 1
+    assert not block.tokens_operation_present
+    block.set_height(2)
+    block.set_hash(b'\x00' * 28)
+    assert block.height == 2
+    assert block.miner_tx.block_hash == b'\x00' * 28
+    assert block.tx_list_for_hash() == [TX.to_tuple_for_block_hash()]
+
+
+def test_public_keys_table():
+    """Public keys are stored once and resolved back on read"""
+    db = sqlite3.connect(':memory:')
+    create(db)
+    keys = PublicKeyStore(db, max_entries=1)
+    no_key = Transaction(block_height=2, address=TX.address, recipient=TX.address, signature=b'\x01')
+    for tx in (TX, TX, no_key):
+        db.execute(SQL_INSERT_TRANSACTION, tx.to_bin_tuple(sqlite_encode=True, public_keys=keys))
+    assert db.execute("SELECT COUNT(*) FROM pubkeys").fetchone()[0] == 1
+    # Fresh store, so keys come from the db
+    keys = PublicKeyStore(db)
+    rows = db.execute("SELECT * FROM transactions").fetchall()
+    decoded = [Transaction.from_v2(row, public_keys=keys) for row in rows]
+    assert [tx.to_bin_tuple() for tx in decoded] == [TX.to_bin_tuple(), TX.to_bin_tuple(), no_key.to_bin_tuple()]
+    with pytest.raises(ValueError):
+        keys.key_for(42)
+
+
+def test_transaction_row():
+    """Row views read like the Transaction they were stored from"""
+    db = sqlite3.connect(':memory:')
+    create(db)
+    keys = PublicKeyStore(db)
+    txs = signed_transactions(2) + [TX]
+    for tx in txs:
+        db.execute(SQL_INSERT_TRANSACTION, tx.to_bin_tuple(sqlite_encode=True, public_keys=keys))
+    rows = db.execute("SELECT * FROM transactions").fetchall()
+    for tx, row in zip(txs, rows):
+        view = TransactionRow(row, public_keys=keys)
+        assert view.public_key == tx.public_key
+        assert (view.bis_amount, view.is_mining, view.timestamp) == (tx.bis_amount, tx.is_mining, tx.timestamp)
+        assert view.to_tuple() == tx.to_tuple()
+        assert view.to_dict(legacy=True, decode_pubkey=True) == tx.to_dict(legacy=True, decode_pubkey=True)
+        assert view.to_buffer_for_signing() == tx.to_buffer_for_signing()
+        assert view.to_protobuf() == tx.to_protobuf()
+        assert view.to_transaction().to_bin_tuple() == tx.to_bin_tuple()
+    assert TransactionsList([TransactionRow(row, keys) for row in rows]).to_blocks_dict() \
+        == TransactionsList(txs).to_blocks_dict()
+    with pytest.raises(AttributeError):
+        view.amount = 1
+
+
+def test_ledger_writer():
+    """Batched writer inserts everything, and bulk mode restores the indexes"""
+    db = sqlite3.connect(':memory:')
+    create(db)
+    indexes = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions'"
+    index_count = db.execute(indexes).fetchone()[0]
+    with LedgerWriter(db, batch_size=2, bulk=True, public_keys=PublicKeyStore(db)) as writer:
+        writer.add_many([TX] * 5)
+        assert db.execute(indexes).fetchone()[0] == 0
+    assert writer.count == 5
+    assert db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 5
+    assert db.execute(indexes).fetchone()[0] == index_count
+    with pytest.raises(RuntimeError):
+        with LedgerWriter(db, batch_size=2, bulk=True) as writer:
+            writer.add_many([TX] * 3)
+            raise RuntimeError()
+    # The flushed batch stays, the pending row is dropped
+    assert db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 7
+    assert db.execute(indexes).fetchone()[0] == index_count
+    # Partial schema, no txids table: only the transactions indexes are rebuilt
+    partial = sqlite3.connect(':memory:')
+    create(partial, SQL_CREATE_TABLES[:2])
+    with LedgerWriter(partial, bulk=True) as writer:
+        writer.add_many([TX] * 2)
+    assert partial.execute(indexes).fetchone()[0] == index_count
+
+
+def test_convert_db(tmp_path, monkeypatch):
+    """Legacy to bin conversion resumes after an interruption, and converts further once the source grew"""
+    legacy_path, bin_path = str(tmp_path / 'legacy.db'), str(tmp_path / 'bin.db')
+    legacy = sqlite3.connect(legacy_path)
+    convert_db.create(legacy, convert_db.SQL_CREATE_LEGACY)
+    txs = signed_transactions(8)
+    for height, transaction in enumerate(txs):
+        transaction.block_height = height + 1
+    legacy.executemany("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                       [transaction.to_tuple() for transaction in txs[:5]])
+    legacy.commit()
+    assert convert_db.chunks(1, 5, 2) == [(1, 3), (3, 5), (5, 6)]
+    verify_chunk = convert_db.verify_chunk
+    calls = []
+
+    def crashing_verify(*args):
+        # Crash once the second chunk rows are committed, before its checkpoint
+        calls.append(args[3])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        verify_chunk(*args)
+
+    monkeypatch.setattr(convert_db, 'verify_chunk', crashing_verify)
+    with pytest.raises(KeyboardInterrupt):
+        convert_db.convert(legacy_path, bin_path, chunk_size=2, workers=1)
+    db = sqlite3.connect(bin_path)
+    assert db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 4
+    assert convert_db.resume(db, 1, 5, 2) == [(3, 5), (5, 6)]
+    assert db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 2
+    db.close()
+    monkeypatch.setattr(convert_db, 'verify_chunk', verify_chunk)
+    assert convert_db.convert(legacy_path, bin_path, chunk_size=2, workers=1) == 3
+    # The source grew: only the new heights are converted
+    legacy.executemany("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                       [transaction.to_tuple() for transaction in txs[5:]])
+    legacy.commit()
+    legacy.close()
+    assert convert_db.convert(legacy_path, bin_path, chunk_size=2, workers=1) == 3
+    db = sqlite3.connect(bin_path)
+    public_keys = PublicKeyStore(db)
+    converted = [Transaction.from_v2(list(row), public_keys=public_keys).to_bin_tuple()
+                 for row in db.execute("SELECT * FROM transactions ORDER BY rowid")]
+    assert converted == [Transaction.from_legacy(list(transaction.to_tuple())).to_bin_tuple() for transaction in txs]
+    assert not balances.check_consistency(db)
+    assert all(signature in TxidIndex(db) for signature in (transaction.signature for transaction in txs))
+    with pytest.raises(ValueError, match="checksum"):
+        verify_chunk(db, public_keys, 0, (1, 9), 8, b'')
+    # The source lost heights the checkpoints cover
+    for low, high in ((2, 8), (1, 7)):
+        with pytest.raises(ValueError):
+            convert_db.resume(db, low, high, 2)
+    db.close()
+
+
+def test_convert_db_mirror_blocks(tmp_path):
+    """New mirror blocks, below the converted heights, are converted as well"""
+    legacy_path, bin_path = str(tmp_path / 'legacy.db'), str(tmp_path / 'bin.db')
+    legacy = sqlite3.connect(legacy_path)
+    convert_db.create(legacy, convert_db.SQL_CREATE_LEGACY)
+    txs = signed_transactions(6)
+    for height, transaction in zip((1, 2, -2, 3, 4, -4), txs):
+        transaction.block_height = height
+    for part in (txs[:3], txs[3:]):
+        legacy.executemany("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                           [transaction.to_tuple() for transaction in part])
+        legacy.commit()
+        assert convert_db.convert(legacy_path, bin_path, chunk_size=2, workers=1) == 3
+    legacy.close()
+    db = sqlite3.connect(bin_path)
+    assert convert_db.gaps(-4, 4, [(-2, 0), (0, 2), (2, 3)]) == [(-4, -2), (3, 5)]
+    assert convert_db.resume(db, -4, 4, 2) == []
+    public_keys = PublicKeyStore(db)
+    converted = [Transaction.from_v2(list(row), public_keys=public_keys).to_bin_tuple()
+                 for row in db.execute("SELECT * FROM transactions ORDER BY block_height")]
+    assert converted == [Transaction.from_legacy(list(transaction.to_tuple())).to_bin_tuple()
+                         for transaction in sorted(txs, key=lambda transaction: transaction.block_height)]
+    assert not balances.check_consistency(db)
+    assert db.execute("SELECT COUNT(*) FROM txids").fetchone()[0] == 6
+    db.close()
+
+
+def test_balances():
+    """Balances table follows inserts and rollbacks, and matches a full recompute"""
+    db = sqlite3.connect(':memory:')
+    create(db)
+    mining = Transaction(block_height=2, timestamp=0.02, address=TX.recipient, recipient=TX.recipient,
+                         signature=b'\x01', reward=1000000, openfield='nonce')
+    with LedgerWriter(db, update_balances=True) as writer:
+        writer.add_many([TX, TX, mining])
+    assert balances.get_balance(db, TX.address) == -2 * (TX.amount + TX.fee)
+    assert balances.get_balance(db, TX.recipient) == 2 * TX.amount + mining.reward
+    assert balances.check_consistency(db) == {}
+    balances.rollback(db, 2)
+    db.commit()
+    assert balances.get(db, TX.recipient) == (2 * TX.amount, 0, 0, 0)
+    assert balances.check_consistency(db) == {}
+    # An update outside of the writer is detected
+    db.execute("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", mining.to_bin_tuple(sqlite_encode=True))
+    assert list(balances.check_consistency(db)) == [TX.recipient]
+    balances.rebuild(db)
+    assert balances.check_consistency(db) == {}
+    # Cached balances are read once per ledger tip
+    cache = balances.BalanceCache(partial(balances.get_balance, db))
+    assert cache.get(TX.recipient, (2, b'tip')) == 2 * TX.amount + mining.reward
+    balances.rollback(db, 2)
+    assert cache.get(TX.recipient, (2, b'tip')) == 2 * TX.amount + mining.reward
+    assert cache.get(TX.recipient, (1, b'other')) == 2 * TX.amount
+    assert cache.stats['hits'] == 1
+
+
+def test_txid_index():
+    """Txid lookups find ledger txs from raw or base64 signatures, and follow rollbacks"""
+    db = sqlite3.connect(':memory:')
+    create(db)
+    other = Transaction.from_v2(list(TX.to_bin_tuple()))
+    other.block_height, other.signature = 2, b'\x02' * 8
+    with LedgerWriter(db, update_txids=True) as writer:
+        writer.add_many([TX, other])
+    index = TxidIndex(db)
+    assert txid(TX.signature) == txid(TX.to_tuple()[5])
+    assert index.lookup(TX.to_tuple()[5]) == TX.timestamp
+    assert other.signature in index
+    assert b'\x03' not in index
+    index.rollback(2)
+    assert other.signature not in index
+    index.rebuild()
+    assert other.signature in index
+    signatures = TxidSet([TX.to_tuple()[5]])
+    assert signatures.may_contain(TX.signature) and not signatures.may_contain(other.signature)
+    signatures.discard(TX.signature)
+    assert len(signatures) == 0
+    # Duplicates within a block, and txs already in the ledger
+    mining = Transaction(block_height=3, timestamp=1.0, address='a' * 56, recipient='a' * 56,
+                         signature=b'\x04', openfield='nonce')
+    Block([TX, mining], check_txs=True)
+    with pytest.raises(ValueError):
+        Block([TX, TX, mining], check_txs=True)
+    with pytest.raises(ValueError):
+        Block([TX, mining], check_txs=True, txid_index=index)
+
+
+def test_signature_filter(tmp_path):
+    """Signature filter has no false negatives, persists and catches up with the ledger"""
+    db = sqlite3.connect(':memory:')
+    create(db)
+    other = Transaction.from_v2(list(TX.to_bin_tuple()))
+    other.block_height, other.signature = 2, b'\x02' * 8
+    with LedgerWriter(db, update_txids=True) as writer:
+        writer.add(TX)
+    signature_filter = SignatureFilter.build(db)
+    assert signature_filter.lookup(TX.to_tuple()[5]) == TX.timestamp
+    assert all(bytes([index]) * 8 not in signature_filter for index in range(3, 103))
+    assert signature_filter.negatives > 90
+    assert signature_filter.false_positive_rate < 0.1
+    path = str(tmp_path / 'signatures.bin')
+    signature_filter.save(path)
+    with LedgerWriter(db, update_txids=True) as writer:
+        writer.add(other)
+    signature_filter = SignatureFilter.open(db, path, txid_index=TxidIndex(db))
+    assert signature_filter.height == 2
+    assert TX.signature in signature_filter and other.signature in signature_filter
+    signature_filter.rollback(2)
+    balances.rollback(db, 2)
+    TxidIndex(db).rollback(2)
+    assert signature_filter.height == 1
+    assert signature_filter.bloom.removed == 1
+    assert other.signature not in signature_filter
+    assert signature_filter.stats["false_positives"] == 1
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_signature_verifier(workers):
+    """Parallel checks give per transaction results, and raise on the first invalid one"""
+    transactions = signed_transactions(6)
+    block = Block(transactions)
+    with SignatureVerifier(workers=workers, chunk_size=2) as verifier:
+        block.validate_heavy(verifier)
+        Blocks([block, Block(transactions[:2])]).validate_heavy(verifier)
+        transactions[2].signature, transactions[4].signature = transactions[4].signature, transactions[2].signature
+        results = verifier.verify_transactions(transactions)
+        assert [index for index, error in enumerate(results) if error] == [2, 4]
+        with pytest.raises(ValueError, match="Invalid signature"):
+            block.validate_heavy(verifier)
+    with pytest.raises(ValueError, match="Invalid signature"):
+        block.validate_heavy()
+
+
+def test_legacy_signature_check():
+    """Mempool checks tell invalid signatures from key errors, in the pool too"""
+    transactions = signed_transactions(2)
+    item = signature_item(transactions[0])
+    items = [item, (transactions[1].signature, ) + item[1:], (item[0], b'junk') + item[2:]]
+    with SignatureVerifier(workers=2, chunk_size=1, function=verify_legacy_item) as verifier:
+        valid, invalid, key = verifier.verify(items)
+    assert valid is None and invalid == (SIGNATURE_INVALID, '') and key[0] == CHECK_ERROR
+    # Valid for the mempool, but not the normalized key address: not cached for block validation
+    cache = SignatureCache()
+    with SignatureVerifier(workers=1, cache=cache, function=verify_legacy_item) as verifier:
+        assert verifier.verify([item, item[:3] + ('a' * 56, )]) == [None, (ADDRESS_UNCHECKED, '')]
+    assert len(cache) == 1 and not cache.verified(item[:3] + ('a' * 56, ))
+
+
+def test_signature_cache():
+    """Verified signatures are not verified again, in both serial and pool validation"""
+    transactions = signed_transactions(4)
+    block = Block(transactions)
+    cache = SignatureCache(max_entries=3)
+    block.validate_heavy(cache=cache)
+    assert cache.stats["misses"] == 4 and cache.stats["evictions"] == 1 and len(cache) == 3
+    with SignatureVerifier(workers=2, cache=cache) as verifier:
+        block.validate_heavy(verifier)
+        assert cache.stats["hits"] == 3
+        # Same signature, other claimed sender: not a cache hit
+        item = signature_item(transactions[1])
+        assert verifier.verify([item[:3] + ('a' * 56, )])[0]
+    transactions[0].signature = transactions[1].signature
+    with pytest.raises(ValueError):
+        block.validate_heavy(cache=cache)
+
+
+def test_rsa_key_cache():
+    """Parsed keys are reused, and give the same verdicts as polysign"""
+    transactions = signed_transactions(3)
+    keys = RSAKeyCache()
+    for transaction in transactions:
+        keys.verify(*signature_item(transaction))
+    assert keys.stats["misses"] == 1 and keys.stats["hits"] == 2
+    assert keys.get(transactions[0].public_key)[1] == transactions[0].address
+    signature, public_key, buffer, address = signature_item(transactions[0])
+    with pytest.raises(ValueError, match="Invalid signature"):
+        keys.verify(transactions[1].signature, public_key, buffer, address)
+    with pytest.raises(ValueError, match="wrong address"):
+        keys.verify(signature, public_key, buffer, 'a' * 56)
+    with pytest.raises(ValueError):
+        keys.get(b'not a key')
+
+
+def test_digest_pipeline():
+    """Valid blocks are written in order, the earliest rejected block stops the batch"""
+    transactions = signed_transactions(8, amount='0.00000000')
+    blocks = [Block(transactions[index:index + 2]) for index in range(0, 8, 2)]
+    written = []
+    pipeline = DigestPipeline(write=written.append, queue_size=1)
+    legacy_block = [[tx.to_tuple()[index] for index in (1, 2, 3, 4, 5, 6, 10, 11)] for tx in blocks[2].transactions]
+    wire_block = bytes(blocks[3].to_protobuf())
+    assert pipeline.run(blocks[:2] + [legacy_block, wire_block]) == 4
+    assert written[:2] == blocks[:2]
+    assert [block.to_protobuf() for block in written[2:]] == [block.to_protobuf() for block in blocks[2:]]
+    assert pipeline.stats["decode"]["count"] == 4 and pipeline.stats["write"]["count"] == 4
+    assert set(pipeline.stats["signature"]) == {"count", "seconds", "queue_depth", "max_queue_depth"}
+    # Block 2 fails the fast checks, block 1 fails the signature checks
+    blocks[2] = Block([transactions[4], transactions[4], transactions[5]])
+    transactions[2].signature = transactions[0].signature
+    written.clear()
+    with pytest.raises(DigestError) as error:
+        DigestPipeline(write=written.append).run(blocks)
+    assert (error.value.index, error.value.stage, error.value.written) == (1, 'signature', 1)
+    assert written == blocks[:1]
+    # Signatures of wire blocks are checked all the same
+    tampered = Block.from_protobuf(wire_block)
+    signature = tampered.transactions[1].signature
+    tampered.transactions[1].signature = signature[:-1] + bytes([signature[-1] ^ 1])
+    with pytest.raises(DigestError) as error:
+        DigestPipeline().run([bytes(tampered.to_protobuf())])
+    assert error.value.stage == 'signature'
+
+    def failing_blocks():
+        # A failing input still ends the stage threads
+        yield blocks[0]
+        raise OSError("read error")
+
+    threads = threading.active_count()
+    with pytest.raises(OSError):
+        DigestPipeline().run(failing_blocks())
+    assert threading.active_count() == threads
+
+
+def test_address_cache():
+    """Cached address checks keep both verdicts, and do not hold over long strings"""
+    ADDRESS_VALID_CACHE.clear()
+    for _ in range(2):
+        assert address_validate('a' * 56) and address_is_rsa('a' * 56)
+        assert not address_validate('invalid') and not address_is_rsa(TX.address)
+    assert len(ADDRESS_VALID_CACHE) == 2 and ADDRESS_VALID_CACHE.stats["hits"] >= 2
+    assert not address_is_rsa('a' * 100) and not address_validate('z' * 100)
+    assert 'a' * 100 not in ADDRESS_RSA_CACHE and len(ADDRESS_VALID_CACHE) == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_iter_legacy_block_data(workers):
+    """Streaming decoder yields the same blocks in order, serial or parallel"""
+    transactions = signed_transactions(6, amount='0.00000000')
+    block_data = [[[tx.to_tuple()[index] for index in (1, 2, 3, 4, 5, 6, 10, 11)] for tx in transactions[start:start + 2]]
+                  for start in range(0, 6, 2)]
+    decoded = Blocks.iter_legacy_block_data(block_data, first_level_checks=True, workers=workers)
+    assert [block.miner_tx.to_bin_tuple() for block in decoded] == [tx.to_bin_tuple() for tx in transactions[1::2]]
+    blocks = Blocks.from_legacy_block_data(block_data, workers=workers)
+    blocks.validate_heavy()
+    block_data[1][0][3] = '-1'
+    with pytest.raises(ValueError):
+        list(Blocks.iter_legacy_block_data(block_data, workers=workers))
+
+
+@pytest.mark.parametrize("native", [False, True])
+def test_mempool_store(native):
+    """Native and sqlite mempool stores answer the same"""
+    store = MemoryMempoolStore() if native else SqliteMempoolStore(sqlite3.connect(':memory:'))
+    a, b, c = 'a' * 56, 'b' * 56, 'c' * 56
+    now = int(time.time())
+    rows = [(f'{now - 10:.2f}', a, b, '2.00000000', 'sig1', 'key', '', 'of', now - 5),
+            (f'{now - 9:.2f}', a, c, '5.00000000', 'sig2', 'key', 'token:issue', '', now - 1),
+            (f'{now - 8:.2f}', b, c, '1.00000000', 'sig3', 'key', '', 'open', now),
+            (f'{now - 100000:.2f}', c, a, '0.50000000', 'sig4', 'key', '', '', now - 100000)]
+    for row in rows:
+        store.insert(row)
+        assert store.size() == sys.getsizeof(str(store.txs()))
+    assert store.contains('sig1') and not store.contains('sig5')
+    assert store.status() == (4, 6, 3, 3)
+    assert [row[4] for row in store.to_send()] == ['sig2', 'sig1', 'sig3', 'sig4']
+    assert [row[4] for row in store.to_send(now - 2)] == ['sig2', 'sig3']
+    # Sequence numbers: what was merged after the last send, whatever the timestamps
+    rows_sent, sequence = store.to_send_after(0)
+    assert rows_sent == store.to_send() and sequence == 4
+    assert [row[4] for row in store.to_send_after(2)[0]] == ['sig3', 'sig4']
+    assert sorted(store.address_txs(a)) == [('2.00000000', 'of', ''), ('5.00000000', '', 'token:issue')]
+    # Amounts, dust fees - and the token issue fee
+    assert store.pending_debit(a) == 7 * 10 ** 8 + 1002000 + 1000000 + 10 * 10 ** 8
+    assert store.txs()[0] == rows[0][:8]
+    store.purge()
+    assert not store.contains('sig4')
+    assert store.size() == sys.getsizeof(str(store.txs()))
+    assert store.delete('sig1') and not store.delete('sig1')
+    assert store.status() == (2, 4, 2, 1)
+    assert store.address_txs(a) == [('5.00000000', '', 'token:issue')]
+    assert store.pending_debit(a) == 15 * 10 ** 8 + 1000000
+    store.insert((f'{now:.2f}', b, a, '1.00000000', 'sig5', 'key', '', 'caf\xe9 \u20ac', now - 50))
+    assert [row[4] for row in store.to_send_after(sequence)[0]] == ['sig5']
+    assert store.to_send_after(5) == ([], 5)
+    assert store.size() == sys.getsizeof(str(store.txs()))
+    assert store.delete('sig5')
+    assert store.size() == sys.getsizeof(str(store.txs()))
+    store.clear()
+    assert store.status()[:2] == (0, None)
+    assert store.to_send() == []
+    assert store.size() == sys.getsizeof(str([]))
+    assert store.pending_debit(a) == 0
+
+
+def legacy_essentials() -> types.ModuleType:
+    """Stand in for the node essentials module the legacy mempool imports"""
+    essentials = types.ModuleType('essentials')
+    essentials.address_validate = address_validate
+    essentials.is_sequence = lambda data: isinstance(data, (list, tuple))
+    essentials.execute_param_c = lambda cursor, sql, param, app_log: cursor.execute(sql, param)
+
+    def validate_pem(public_key):
+        if not b64decode(public_key).startswith(b'-----BEGIN'):
+            raise ValueError("Not a valid PEM pre boundary")
+
+    essentials.validate_pem = validate_pem
+    return essentials
+
+
+@pytest.fixture
+def mempool_module(monkeypatch):
+    essentials = legacy_essentials()
+    monkeypatch.setitem(sys.modules, 'essentials', essentials)
+    from bismuthcore.legacy import mempool
+    monkeypatch.setattr(mempool, 'essentials', essentials)
+    return mempool
+
+
+def ram_mempool(mempool_module, **kwargs):
+    config = types.SimpleNamespace(mempool_ram_conf=True, version_conf='mainnet', debug_conf=1, mempool_allowed=[])
+    return mempool_module.Mempool(logging.getLogger('mempool'), config, threading.Lock(), **kwargs)
+
+
+def test_mempool_queries(mempool_module):
+    """The ram mempool runs the mempool queries against its store, and refuses others"""
+    mempool = ram_mempool(mempool_module)
+    row = (f'{time.time():.2f}', 'a' * 56, 'b' * 56, '1.00000000', 'sig1', 'key', '', 'open', int(time.time()))
+    mempool.store.insert(row)
+    assert mempool.fetchall(mempool_module.SQL_SELECT_ALL_TXS) == [row[:8]]
+    assert mempool.fetchall(mempool_module.SQL_SELECT_TX_TO_SEND) == [row]
+    assert mempool.fetchone(mempool_module.SQL_SIG_CHECK, ('sig1', )) == (row[0], )
+    assert mempool.fetchone(mempool_module.SQL_STATUS) == (1, 4, 1, 1)
+    assert mempool.fetchone(mempool_module.SQL_COUNT_DISTINCT_SENDERS) == (1, )
+    assert mempool.fetchone(mempool_module.SQL_COUNT_DISTINCT_RECIPIENTS) == (1, )
+    mempool.execute(mempool_module.SQL_DELETE_TX, ('sig1', ))
+    mempool.commit()
+    assert not mempool.sig_check('sig1') and mempool.fetchone(mempool_module.SQL_SIG_CHECK, ('sig1', )) is None
+    with pytest.raises(ValueError):
+        mempool.fetchall("SELECT 1")
+    mempool.close()
+
+
+
+def test_mempool_disk_writes(mempool_module, tmp_path, monkeypatch):
+    """Writes through the disk mempool keep its store in sync"""
+    monkeypatch.chdir(tmp_path)
+    config = types.SimpleNamespace(mempool_ram_conf=False, version_conf='mainnet', debug_conf=1, mempool_allowed=[])
+    mempool = mempool_module.Mempool(logging.getLogger('mempool'), config, threading.Lock())
+    now = int(time.time())
+    rows = [(f'{now:.2f}', 'a' * 56, 'b' * 56, '1.00000000', signature, 'key', '', 'open', now)
+            for signature in ('sig1', 'sig2', 'sig3')]
+    for row in rows:
+        mempool.store.insert(row)
+    mempool.fetchone(mempool_module.SQL_DELETE_TX, ('sig1', ), write=True)
+    assert mempool.store.status()[0] == 2 and mempool.store.pending_debit('a' * 56) == 2 * row_debit(rows[0])
+    # A statement the store does not know: resynced from the table
+    mempool.execute("DELETE FROM transactions WHERE signature = ?", ('sig2', ))
+    mempool.commit()
+    assert not mempool.sig_check('sig2') and mempool.store.pending_debit('a' * 56) == row_debit(rows[0])
+    assert mempool.store.size() == SqliteMempoolStore(mempool.db).size()
+    mempool.close()
+
+def test_mempool_merge(mempool_module):
+    """Batch merges give the same per tx messages as checking txs one at a time"""
+    mempool = ram_mempool(mempool_module, balance_cache=balances.BalanceCache(lambda address: 10 ** 12))
+    # Default verifier: no pool of its own
+    assert mempool.signature_verifier.workers == 1
+    ledger = sqlite3.connect(':memory:')
+    ledger.execute("CREATE TABLE transactions (block_height INTEGER, block_hash TEXT, timestamp NUMERIC, "
+                   "signature TEXT)")
+    ledger.execute("INSERT INTO transactions VALUES (1, 'hash', 1, 'ledger_sig')")
+    valid, other = [list(tx.to_tuple()[index] for index in (1, 2, 3, 4, 5, 6, 10, 11))
+                    for tx in signed_transactions(2, timestamp=int(time.time()) - 10)]
+    valid[0] = other[0] = f'{float(valid[0]):.2f}'
+    bad_signature = other[:4] + [valid[4]] + other[5:]
+    junk_key = b64encode(b'junk').decode('utf-8')
+    bad_pem = valid[:1] + [sha224(b'junk').hexdigest()] + valid[2:5] + [junk_key] + valid[6:]
+    result = mempool.merge([valid, bad_pem, bad_signature, valid], '127.0.0.1', ledger.cursor())
+    assert result == ["Mempool merging started from 127.0.0.1",
+                      "Mempool: Received address: {}".format(valid[1]),
+                      "Mempool updated with a received transaction from 127.0.0.1",
+                      "Success",
+                      "Mempool: Public key does not validate: Not a valid PEM pre boundary",
+                      "Mempool: Unexpected error checking sig: RSA key format is not supported",
+                      "Mempool: Wrong signature ({}) for data {} in mempool insert attempt".format(
+                          valid[4], tuple(bad_signature[:4] + bad_signature[6:])),
+                      "That transaction is already in our mempool"]
+    assert [row[4] for row in mempool.store.txs()] == [valid[4]]
+    mempool.close()
+
+
 if __name__ == "__main__":
     """
     test_to_tuple(verbose=True)